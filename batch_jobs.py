@@ -0,0 +1,157 @@
+"""
+批处理文件模式
+把不需要交互的调用（信息提取、背景故事生成）写成批处理接口格式的JSONL请求文件，每行为
+{"custom_id": ..., "method": "POST", "url": "/v1/chat/completions", "body": 请求参数}，
+执行后得到按 custom_id 对应的结果文件，再由 patient_template_gen.py 写回患者JSON和背景故事目录。
+
+执行方式：
+1. openai：上传到支持批处理接口的服务（OpenAI 或兼容的服务商，价格通常为同步调用的一半），之后用 collect 下载结果
+2. local：使用 vLLM 离线引擎（vllm.entrypoints.openai.run_batch）在本机处理整个文件
+其他方式生成的结果文件放到 results.jsonl 后同样可以用 collect 写回
+
+每个阶段的文件位于 BATCH_DIR/<阶段>/：requests.jsonl（请求）、plan.json（写回结果需要的信息）、
+state.json（已提交的批处理任务）、results.jsonl（结果）、errors.jsonl（失败的请求）
+"""
+import json
+import os
+import subprocess
+import sys
+
+from config import PathConfig, SystemConfig
+
+ENDPOINT = '/v1/chat/completions'
+REQUESTS_NAME = 'requests.jsonl'
+PLAN_NAME = 'plan.json'
+STATE_NAME = 'state.json'
+RESULTS_NAME = 'results.jsonl'
+ERRORS_NAME = 'errors.jsonl'
+
+
+def stage_dir(stage, root=None):
+    """批处理阶段的目录"""
+    return os.path.join(root or PathConfig.BATCH_DIR, stage)
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_requests(directory, requests, plan):
+    """
+    写出请求文件和写回结果需要的信息，并删除上一轮的任务状态和结果
+
+    Args:
+        directory (str): 阶段目录
+        requests (list): (custom_id, 请求参数) 列表
+        plan: 写回结果时需要的信息（可JSON序列化）
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in (STATE_NAME, RESULTS_NAME, ERRORS_NAME):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    path = os.path.join(directory, REQUESTS_NAME)
+    with open(path + '.tmp', 'w') as f:
+        for custom_id, body in requests:
+            f.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': ENDPOINT, 'body': body}, ensure_ascii=False) + '\n')
+    os.replace(path + '.tmp', path)
+    _write_json(os.path.join(directory, PLAN_NAME), plan)
+
+
+def read_plan(directory):
+    return _read_json(os.path.join(directory, PLAN_NAME))
+
+
+def has_results(directory):
+    return os.path.exists(os.path.join(directory, RESULTS_NAME))
+
+
+def submit_openai(directory, client):
+    """
+    上传请求文件并创建批处理任务
+
+    Args:
+        directory (str): 阶段目录
+        client: OpenAI客户端（服务需要支持 files 和 batches 接口）
+
+    Returns:
+        str: 批处理任务ID
+    """
+    with open(os.path.join(directory, REQUESTS_NAME), 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT,
+                                  completion_window=SystemConfig.BATCH_COMPLETION_WINDOW)
+    _write_json(os.path.join(directory, STATE_NAME), {'runner': 'openai', 'batch_id': batch.id, 'input_file_id': input_file.id})
+    return batch.id
+
+
+def collect_openai(directory, client):
+    """
+    查询批处理任务，完成后下载结果文件和失败请求文件
+
+    Returns:
+        str: 任务状态（'completed' 时结果已下载）
+    """
+    state = _read_json(os.path.join(directory, STATE_NAME))
+    if state is None:
+        raise ValueError(f"{directory} 中没有已提交的批处理任务")
+    batch = client.batches.retrieve(state['batch_id'])
+    if batch.status != 'completed':
+        return batch.status
+    for file_id, name in ((batch.output_file_id, RESULTS_NAME), (batch.error_file_id, ERRORS_NAME)):
+        if file_id:
+            path = os.path.join(directory, name)
+            with open(path + '.tmp', 'w') as f:
+                f.write(client.files.content(file_id).text)
+            os.replace(path + '.tmp', path)
+    return batch.status
+
+
+def run_local(directory, model_path):
+    """
+    使用 vLLM 离线引擎处理请求文件，结果写入 results.jsonl
+
+    Args:
+        directory (str): 阶段目录
+        model_path (str): 模型路径，请求中的 model 需与其一致
+    """
+    path = os.path.join(directory, RESULTS_NAME)
+    subprocess.run([sys.executable, '-m', 'vllm.entrypoints.openai.run_batch',
+                    '-i', os.path.join(directory, REQUESTS_NAME), '-o', path + '.tmp', '--model', model_path], check=True)
+    os.replace(path + '.tmp', path)
+
+
+def read_results(directory):
+    """
+    读取结果文件
+
+    Returns:
+        tuple: ({custom_id: ChatCompletion}, {custom_id: 错误信息})
+    """
+    from openai.types.chat import ChatCompletion
+    responses = {}
+    errors = {}
+    for name in (RESULTS_NAME, ERRORS_NAME):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if result.get('error') or response.get('status_code') != 200:
+                    errors[result['custom_id']] = result.get('error') or response.get('body')
+                else:
+                    responses[result['custom_id']] = ChatCompletion.model_validate(response['body'])
+    return responses, errors
@@ -0,0 +1,89 @@
+"""
+患者案例画像的规模基准
+生成指定数量的模拟患者案例（JSON数组，格式与 patient_cases_json 的输出相同，文本字段为固定长度的占位文本），
+流式构建 CohortProfile 并计算全部画像，报告各阶段耗时、吞吐量和进程的最大常驻内存
+
+用法（在项目根目录下运行）：
+    python benchmarks/cohort_profile.py --cases 1000000
+    python benchmarks/cohort_profile.py --cases 200000 --text-chars 400 --keep ./synthetic_cases.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from cohort_profile import CohortProfile, FIELDS  # noqa: E402
+
+ICD_CODES = ['F32.901', 'F41.101', 'F41.201', 'F32.101', 'F20.001', 'F31.301', 'F42.001', 'F43.101', 'F51.001', 'F90.001']
+
+
+def write_cases(path, count, text_chars, seed):
+    """写出 count 个模拟患者案例，部分字段随机缺失或为“无”"""
+    rng = random.Random(seed)
+    text = '病' * text_chars
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for idx in range(count):
+            case = {field: text for field in FIELDS}
+            case['患者'] = idx + 1
+            case['年龄'] = rng.randint(8, 85)
+            case['性别'] = rng.choice(['男', '女'])
+            case['ICD编码'] = ','.join(rng.sample(ICD_CODES, rng.choice([1, 1, 1, 2, 2, 3])))
+            for field in ('家族史', '重要或相关躯体疾病史'):
+                if rng.random() < 0.6:
+                    case[field] = '无'
+            if rng.random() < 0.05:
+                del case['现病史']
+            f.write(('' if idx == 0 else ',\n') + json.dumps(case, ensure_ascii=False, indent=2))
+        f.write('\n]')
+
+
+def max_rss_mb():
+    """当前进程的最大常驻内存（MB）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='患者案例画像的规模基准')
+    parser.add_argument('--cases', type=int, default=1000000, help='模拟案例数')
+    parser.add_argument('--text-chars', type=int, default=200, help='每个文本字段的字数')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='每块处理的案例数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--keep', default=None, help='保留生成的模拟数据到该路径，不指定时使用临时文件并在结束后删除')
+    args = parser.parse_args()
+
+    path = args.keep or tempfile.mkstemp(suffix='.json')[1]
+    try:
+        start = time.perf_counter()
+        write_cases(path, args.cases, args.text_chars, args.seed)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"生成 {args.cases} 个案例（{size_mb:.0f} MB）耗时 {time.perf_counter() - start:.1f}s，最大常驻内存 {max_rss_mb():.0f} MB")
+
+        start = time.perf_counter()
+        profile = CohortProfile.from_json(path, args.chunk_size, icd_level=3)
+        load_seconds = time.perf_counter() - start
+        print(f"流式构建画像耗时 {load_seconds:.1f}s（{args.cases / load_seconds:,.0f} 个案例/秒），最大常驻内存 {max_rss_mb():.0f} MB")
+
+        start = time.perf_counter()
+        profile.age_histogram()
+        profile.gender_counts()
+        profile.missing_rates()
+        profile.cooccurrence()
+        profile.crosstab('年龄')
+        profile.crosstab('性别')
+        print(f"分布、缺失率、共现矩阵和交叉表耗时 {time.perf_counter() - start:.2f}s")
+    finally:
+        if args.keep is None:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+API模式冷启动的导入耗时基准
+使用 python -X importtime 导入入口模块，汇总总导入耗时和耗时最多的模块，
+并检查API路径没有导入本地推理后端（torch、transformers）
+
+用法（在项目根目录下运行）：
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --module main --target-ms 1500 --top 15
+"""
+import argparse
+import os
+import re
+import resource
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# API路径不应导入的模块
+FORBIDDEN_MODULES = ['torch', 'transformers', 'onnxruntime', 'optimum']
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure(module):
+    """
+    在子进程中导入模块并解析 -X importtime 的输出
+
+    Returns:
+        dict: 总导入耗时（毫秒）、入口直接导入的模块的累计耗时、已导入模块集合和子进程的最大常驻内存（MB）
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("导入 {} 失败：\n{}".format(module, result.stderr[-2000:]))
+
+    total_us = 0
+    children = []
+    direct_imports = []
+    imported = set()
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        total_us += self_us
+        imported.add(name.split('.')[0])
+        # 每深一层缩进增加2个空格；子模块先于父模块输出
+        level = (len(indent) - 1) // 2
+        if level == 1:
+            children.append((cumulative_us, name))
+        elif level == 0:
+            if name == module:
+                direct_imports = children
+            children = []
+
+    # Linux下 ru_maxrss 单位为KB
+    max_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {
+        'total_ms': total_us / 1000,
+        'direct_imports': sorted(direct_imports, reverse=True),
+        'imported': imported,
+        'max_rss_mb': max_rss_mb,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量API模式入口的冷启动导入耗时')
+    parser.add_argument('--module', default='main', help='要导入的入口模块')
+    parser.add_argument('--target-ms', type=float, default=1500, help='总导入耗时的目标上限（毫秒）')
+    parser.add_argument('--top', type=int, default=10, help='列出耗时最多的模块数')
+    args = parser.parse_args()
+
+    stats = measure(args.module)
+    print(f"导入 {args.module} 总耗时: {stats['total_ms']:.1f} ms，最大常驻内存: {stats['max_rss_mb']:.1f} MB")
+    print(f"耗时最多的 {args.top} 个直接导入的模块：")
+    for cumulative_us, name in stats['direct_imports'][:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    forbidden = [name for name in FORBIDDEN_MODULES if name in stats['imported']]
+    if forbidden:
+        print(f"失败: API模式导入了本地推理后端 {forbidden}")
+        failed = True
+    if stats['total_ms'] > args.target_ms:
+        print(f"失败: 导入耗时 {stats['total_ms']:.1f} ms 超过目标 {args.target_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+对话调度的完成时间（makespan）基准
+按队列模式的派发方式（空闲的工作进程领取下一个任务）模拟一次运行，比较：
+    fifo           按患者和对话编号派发（原来的顺序）
+    longest_first  按 TurnPredictor 的预测轮数从长到短派发
+    oracle         按实际轮数从长到短派发（同一派发方式下的参考）
+以及理论下界 max(总轮数 / 工作进程数, 最长对话轮数)。每轮的耗时视为相同，完成时间以轮数计。
+每个进程分到的对话越少，长尾在完成时间中的占比越大，调度顺序的影响也越明显。
+
+对话的实际轮数：
+1. 指定 --outputs 时使用其中已有的 patient_N.json，预测器按患者留一法使用其他患者的对话作为历史
+2. 否则按诊断树的计划话题数生成模拟数据：每个患者有固定的话题轮数系数，每个对话再加随机扰动，
+   预测器的“历史运行”使用另一批患者（与实际生成时相同，本次运行的患者没有自己的历史对话）
+两种情况下预测都只能利用诊断树和其他患者的轮数，患者自身的差异对预测不可见。
+
+用法（在项目根目录下运行）：
+    python benchmarks/schedule_makespan.py --workers 8,16,32,64
+    python benchmarks/schedule_makespan.py --outputs ./DataSyn --cases ./raw_data/pat_smhc_train.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from config import SystemConfig  # noqa: E402
+from scheduling import TurnPredictor, longest_first, makespan  # noqa: E402
+
+
+def load_outputs(output_dir, patient_info):
+    """已有输出中未被截断的对话：[(患者案例, 对话编号, 轮数)]"""
+    jobs = []
+    for patient_template in patient_info:
+        path = os.path.join(output_dir, 'patient_{}.json'.format(patient_template['患者']))
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            conversations = json.load(f)
+        for idx, item in enumerate(conversations):
+            if item is not None and not item.get('truncated'):
+                jobs.append((patient_template, idx, len(item['conversation'])))
+    return jobs
+
+
+def synthetic_patients(count, rng):
+    """随机生成患者的年龄、性别（决定诊断树）"""
+    return [{'患者': idx + 1, '年龄': rng.randint(12, 70), '性别': rng.choice(['男', '女'])} for idx in range(count)]
+
+
+def synthetic_jobs(patient_info, num, predictor, rng, effects, noise):
+    """按计划话题数 × 患者系数 × 随机扰动生成每个对话的轮数"""
+    jobs = []
+    for patient_template in patient_info:
+        _, topics = predictor.plan_size(patient_template)
+        for idx in range(num):
+            turns = topics * effects[patient_template['患者']] * rng.lognormvariate(0, noise)
+            jobs.append((patient_template, idx, max(1, round(turns))))
+    return jobs
+
+
+def leave_one_patient_out(jobs):
+    """对每个患者，用其他患者的对话建立预测器，返回 {患者编号: 预测轮数}"""
+    predictions = {}
+    for patient_template, _, _ in jobs:
+        patient_id = patient_template['患者']
+        if patient_id in predictions:
+            continue
+        predictor = TurnPredictor()
+        for other, _, turns in jobs:
+            if other['患者'] != patient_id:
+                predictor.observe(other, turns)
+        predictions[patient_id] = predictor.predict(patient_template)
+    return predictions
+
+
+def compare(jobs, predictions, workers_list):
+    """各工作进程数下三种派发顺序的完成时间"""
+    fifo = sorted(jobs, key=lambda job: (job[0]['患者'], job[1]))
+    predicted = longest_first(fifo, lambda job: predictions[job[0]['患者']])
+    oracle = longest_first(fifo, lambda job: job[2])
+    total = sum(job[2] for job in jobs)
+    longest = max(job[2] for job in jobs)
+    rows = []
+    for workers in workers_list:
+        rows.append({
+            'workers': workers,
+            'fifo': makespan([job[2] for job in fifo], workers),
+            'longest_first': makespan([job[2] for job in predicted], workers),
+            'oracle': makespan([job[2] for job in oracle], workers),
+            'lower_bound': max(total / workers, longest),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较FIFO与按预测轮数从长到短调度的完成时间')
+    parser.add_argument('--outputs', default=None, help='已有对话输出目录（patient_N.json），不指定时使用模拟数据')
+    parser.add_argument('--cases', default=os.path.join(PROJECT_ROOT, 'raw_data', 'pa20.json'), help='患者案例JSON文件')
+    parser.add_argument('--workers', default='8,16,32,64', help='工作进程数，逗号分隔')
+    parser.add_argument('--patients', type=int, default=40, help='模拟数据的患者数')
+    parser.add_argument('--num', type=int, default=SystemConfig.NUM_CONVERSATIONS, help='模拟数据中每个患者的对话数')
+    parser.add_argument('--noise', type=float, default=0.15, help='模拟数据中单个对话轮数的对数正态扰动')
+    parser.add_argument('--seed', type=int, default=0, help='模拟数据的随机种子')
+    args = parser.parse_args()
+    workers_list = [int(value) for value in args.workers.split(',')]
+
+    if args.outputs:
+        with open(args.cases) as f:
+            patient_info = json.load(f)
+        jobs = load_outputs(args.outputs, patient_info)
+        if not jobs:
+            raise SystemExit(f"{args.outputs} 中没有可用的对话")
+        predictions = leave_one_patient_out(jobs)
+        source = f"{args.outputs} 中 {len(jobs)} 个对话（按患者留一法预测）"
+    else:
+        rng = random.Random(args.seed)
+        predictor = TurnPredictor()
+        # 前一半患者作为历史运行，后一半是本次运行，两批患者不重叠
+        all_patients = synthetic_patients(2 * args.patients, rng)
+        history_patients, patient_info = all_patients[:args.patients], all_patients[args.patients:]
+        effects = {patient_template['患者']: rng.uniform(0.9, 1.8) for patient_template in all_patients}
+        for patient_template, _, turns in synthetic_jobs(history_patients, args.num, predictor, rng, effects, args.noise):
+            predictor.observe(patient_template, turns)
+        jobs = synthetic_jobs(patient_info, args.num, predictor, rng, effects, args.noise)
+        predictions = {patient_template['患者']: predictor.predict(patient_template) for patient_template in patient_info}
+        source = f"模拟数据：{args.patients} 个患者 × {args.num} 个对话（历史为另外 {args.patients} 个患者）"
+
+    print(f"对话来源：{source}")
+    print(f"{'进程数':>6} {'fifo':>10} {'longest_first':>14} {'oracle':>10} {'下界':>10} {'缩短':>8}")
+    for row in compare(jobs, predictions, workers_list):
+        saving = 1 - row['longest_first'] / row['fifo']
+        print(f"{row['workers']:>8} {row['fifo']:>10.1f} {row['longest_first']:>14.1f} {row['oracle']:>10.1f} "
+              f"{row['lower_bound']:>10.1f} {saving:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+生成预算控制
+ConversationBudget：单个对话的轮数、token数和耗时上限，超出时由 main.py 以诊断结果结束对话并标记为截断
+RunGovernor：整个运行的花费预算，跟踪已花费与预计花费，预算不足时限流或停止开始新的对话
+"""
+import threading
+import time
+
+from config import SystemConfig
+
+
+class ConversationBudget:
+    """单个对话的预算控制器，上限为None时不限制"""
+
+    def __init__(self, max_turns=None, max_tokens=None, max_seconds=None):
+        self.max_turns = max_turns if max_turns is not None else SystemConfig.MAX_TURNS_PER_CONVERSATION
+        self.max_tokens = max_tokens if max_tokens is not None else SystemConfig.MAX_TOKENS_PER_CONVERSATION
+        self.max_seconds = max_seconds if max_seconds is not None else SystemConfig.MAX_SECONDS_PER_CONVERSATION
+        self.start_time = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def exceeded(self, turns, tokens):
+        """
+        检查对话是否超出预算
+
+        Args:
+            turns (int): 已完成的轮数（医生提问+患者回答为一轮）
+            tokens (int): 医生和患者已消耗的token总数
+
+        Returns:
+            str or None: 超出的预算类型（'max_turns'、'max_tokens'、'max_seconds'），未超出时返回None
+        """
+        if self.max_turns is not None and turns >= self.max_turns:
+            return 'max_turns'
+        if self.max_tokens is not None and tokens >= self.max_tokens:
+            return 'max_tokens'
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return 'max_seconds'
+        return None
+
+
+class RunGovernor:
+    """
+    整个运行的花费控制器
+    每个对话开始前调用 admit() 申请准入，结束后调用 complete() 记录实际花费；
+    完成 estimate_after 个对话后，用平均花费为在途对话预留额度并估算整个运行的总花费。
+    已花费加上在途对话的预留超出预算时，等待在途对话结束（限流）；没有在途对话仍会超出时停止准入
+    """
+
+    def __init__(self, total_conversations, budget=None, estimate_after=None):
+        self.total_conversations = total_conversations
+        self.budget = budget if budget is not None else SystemConfig.RUN_BUDGET
+        self.estimate_after = estimate_after if estimate_after is not None else SystemConfig.COST_ESTIMATE_AFTER
+        self.condition = threading.Condition()
+        self.spent = 0
+        self.completed = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self.stopped = False
+
+    def average_cost(self):
+        """已完成对话的平均花费，完成数不足 estimate_after 时返回None"""
+        if self.completed < max(self.estimate_after, 1):
+            return None
+        return self.spent / self.completed
+
+    def projected_cost(self):
+        """按平均花费估算的整个运行总花费"""
+        average = self.average_cost()
+        return None if average is None else average * self.total_conversations
+
+    def admit(self):
+        """
+        申请开始一个新对话
+
+        Returns:
+            bool: 允许开始时返回True，预算耗尽时返回False
+        """
+        with self.condition:
+            while not self.stopped:
+                if self.budget is None:
+                    break
+                reserve = self.average_cost() or 0
+                if self.spent + (self.in_flight + 1) * reserve < self.budget:
+                    break
+                if self.in_flight == 0:
+                    self.stopped = True
+                    print(f"已花费 {self.spent:.4f}，预算 {self.budget} 已用尽，停止开始新的对话")
+                    break
+                # 等待在途对话结束后再根据实际花费判断
+                self.condition.wait()
+            if self.stopped:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def complete(self, cost):
+        """记录一个已结束对话的实际花费"""
+        with self.condition:
+            self.in_flight -= 1
+            self.completed += 1
+            self.spent += cost
+            if self.completed == self.estimate_after:
+                print(f"根据前 {self.completed} 个对话估算，整个运行的总花费约为 {self.projected_cost():.4f}")
+            self.condition.notify_all()
+
+    def summary(self):
+        with self.condition:
+            return {
+                'budget': self.budget,
+                'spent': self.spent,
+                'projected': self.projected_cost(),
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
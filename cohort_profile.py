@@ -0,0 +1,298 @@
+"""
+患者案例队列画像
+按块流式读取患者案例JSON（JSON数组或JSONL），每块用pandas向量化地提取年龄、性别、ICD编码和各字段的缺失情况，
+较长的文本字段在处理完一块后即丢弃，内存占用只与案例数和ICD编码数成正比，可以处理数百万个案例。
+
+画像内容：
+1. 任意分箱的年龄分布、性别分布
+2. ICD编码计数和共现矩阵（案例 × 编码的稀疏指示矩阵 X，共现矩阵为 X^T X）
+3. 各字段的缺失率（字段不存在、为空或空白）和取值为“无”的比例
+4. 年龄段/性别 × ICD编码的交叉表（分组的独热矩阵 G，交叉表为 G^T X）
+
+画像用于规划生成任务和分层抽样。
+
+用法：
+    python cohort_profile.py --cases ./raw_data/pat_smhc_train.json --bins 0,18,30,45,60,120 --icd-level 3
+    python cohort_profile.py --cases ./raw_data/pat_smhc_train.json --output ./cohort_profile.json
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from scipy import sparse
+
+from config import PathConfig, SystemConfig
+
+FIELDS = ['年龄', '性别', 'ICD编码', '诊断结果', '主诉', '现病史', '重要或相关躯体疾病史', '家族史', '个人史', '精神检查', '处理意见']
+
+
+def iter_cases(path, chunk_chars=1 << 20):
+    """
+    逐条读取患者案例，不把整个文件载入内存
+
+    Args:
+        path (str): JSON数组或JSONL文件
+        chunk_chars (int): 每次读取的字符数
+
+    Yields:
+        dict: 患者案例
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer, pos, eof = '', 0, False
+        while True:
+            # 跳过数组的开头、元素之间的逗号和空白
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,[':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    if buffer[pos:].strip():
+                        raise
+                    return
+                chunk = f.read(chunk_chars)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield item
+
+
+def iter_chunks(items, size):
+    """把可迭代对象按 size 个一组分块"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def age_labels(bins):
+    """分箱的标签，如 [0, 18, 30, inf] -> ['0-17', '18-29', '30+']（左闭右开）"""
+    labels = []
+    for low, high in zip(bins[:-1], bins[1:]):
+        if np.isinf(high):
+            labels.append(f"{low:g}+")
+        elif float(low).is_integer() and float(high).is_integer():
+            labels.append(f"{low:g}-{high - 1:g}")
+        else:
+            labels.append(f"{low:g}-{high:g}")
+    return labels
+
+
+def icd_pairs(codes, offset=0, level=None):
+    """
+    把ICD编码列（逗号分隔的多个编码）展开为 (案例行号, 编码) 对，同一案例中的重复编码只保留一个
+
+    Args:
+        codes (pd.Series): ICD编码列
+        offset (int): 该块第一个案例的行号
+        level (int, optional): 编码保留的前缀长度
+
+    Returns:
+        pd.DataFrame: row（int64）和 code（category）两列
+    """
+    exploded = codes.reset_index(drop=True).str.split(',').explode().str.strip()
+    exploded = exploded[exploded.notna() & exploded.ne('')]
+    if level:
+        exploded = exploded.str[:level]
+    return pd.DataFrame({'row': exploded.index.to_numpy(dtype=np.int64) + offset,
+                         'code': pd.Categorical(exploded.astype(object))}).drop_duplicates()
+
+
+class CohortProfile:
+    """患者案例的紧凑列式表示和画像统计"""
+
+    def __init__(self, frame, missing, none, pairs):
+        """
+        Args:
+            frame (pd.DataFrame): 每个案例的年龄（数值，无法解析时为NaN）和性别
+            missing (pd.DataFrame): 每个案例各字段是否缺失（bool）
+            none (pd.DataFrame): 每个案例各字段是否为“无”（bool）
+            pairs (pd.DataFrame): icd_pairs 产出的 (案例行号, ICD编码) 对
+        """
+        self.frame = frame
+        self.missing = missing
+        self.none = none
+        # 案例 × ICD编码的稀疏指示矩阵，编码按出现次数从多到少（次数相同时按编码）排列
+        counts = pairs['code'].value_counts(sort=False)
+        counts = counts[counts > 0]
+        counts.index = counts.index.astype(object)
+        counts = counts.sort_index().sort_values(ascending=False, kind='stable')
+        self.icd_codes = [str(code) for code in counts.index]
+        columns = pd.Index(counts.index).get_indexer(pairs['code'])
+        self.icd_matrix = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (pairs['row'].to_numpy(), columns)),
+                                            shape=(len(frame), len(self.icd_codes)))
+
+    @classmethod
+    def from_records(cls, records, chunk_size=10000, icd_level=None):
+        """
+        从患者案例的可迭代对象构建画像，每块处理后只保留年龄、性别、字段缺失标记和ICD编码对
+
+        Args:
+            records (iterable): 患者案例
+            chunk_size (int): 每块处理的案例数，较长的文本字段同时在内存中的只有一块
+            icd_level (int, optional): ICD编码保留的前缀长度（如3表示F32.901计为F32），None时使用完整编码
+        """
+        frames, missings, nones, pairs = [], [], [], []
+        offset = 0
+        for chunk in iter_chunks(records, chunk_size):
+            raw = pd.DataFrame.from_records(chunk, columns=FIELDS)
+            text = raw.astype('string')
+            missings.append(pd.DataFrame({field: (text[field].isna() | text[field].str.strip().eq('')).fillna(True).astype(bool)
+                                          for field in FIELDS}))
+            nones.append(pd.DataFrame({field: text[field].str.strip().eq('无').fillna(False).astype(bool) for field in FIELDS}))
+            frames.append(pd.DataFrame({
+                '年龄': pd.to_numeric(raw['年龄'], errors='coerce').astype('float32'),
+                '性别': pd.Categorical(text['性别'].str.strip().astype(object)),
+            }))
+            pairs.append(icd_pairs(text['ICD编码'], offset, icd_level))
+            offset += len(chunk)
+        if not frames:
+            empty = pd.DataFrame({field: pd.Series(dtype=bool) for field in FIELDS})
+            frame = pd.DataFrame({'年龄': pd.Series(dtype='float32'), '性别': pd.Series(dtype='category')})
+            return cls(frame, empty, empty.copy(), icd_pairs(pd.Series([], dtype=object)))
+        frame = pd.DataFrame({'年龄': pd.concat([item['年龄'] for item in frames], ignore_index=True),
+                              '性别': union_categoricals([item['性别'] for item in frames], ignore_order=True)})
+        pairs = pd.DataFrame({'row': np.concatenate([item['row'].to_numpy() for item in pairs]),
+                              'code': union_categoricals([item['code'] for item in pairs], ignore_order=True)})
+        return cls(frame, pd.concat(missings, ignore_index=True), pd.concat(nones, ignore_index=True), pairs)
+
+    @classmethod
+    def from_json(cls, path, chunk_size=10000, icd_level=None):
+        """从患者案例JSON（数组或JSONL）流式构建画像"""
+        return cls.from_records(iter_cases(path), chunk_size, icd_level)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def age_histogram(self, bins=None):
+        """
+        年龄分布（左闭右开的分箱），年龄缺失或不在分箱范围内的计入“其他”
+
+        Args:
+            bins (list, optional): 分箱边界，默认为 SystemConfig.COHORT_AGE_BINS
+        """
+        bins = np.asarray(bins or SystemConfig.COHORT_AGE_BINS, dtype=float)
+        ages = self.frame['年龄'].to_numpy(dtype=float)
+        valid = (ages >= bins[0]) & (ages < bins[-1])
+        counts, _ = np.histogram(ages[valid], bins=bins)
+        histogram = pd.Series(counts, index=age_labels(bins), name='年龄')
+        histogram['其他'] = int((~valid).sum())
+        return histogram
+
+    def gender_counts(self):
+        """性别分布，缺失计入“缺失”"""
+        return self.frame['性别'].astype('object').fillna('缺失').value_counts()
+
+    def icd_counts(self):
+        """各ICD编码的案例数（同一案例中的重复编码只计一次）"""
+        return pd.Series(np.asarray(self.icd_matrix.sum(axis=0)).ravel(), index=self.icd_codes, name='ICD编码')
+
+    def cooccurrence(self):
+        """ICD编码共现矩阵（稀疏，编码顺序同 icd_codes），对角线为各编码的案例数"""
+        return (self.icd_matrix.T @ self.icd_matrix).tocsr()
+
+    def cooccurrence_frame(self, top=None):
+        """出现最多的 top 个编码之间的共现矩阵（DataFrame），top为None时包括全部编码"""
+        size = len(self.icd_codes) if top is None else min(top, len(self.icd_codes))
+        return pd.DataFrame(self.cooccurrence()[:size, :size].toarray(),
+                            index=self.icd_codes[:size], columns=self.icd_codes[:size])
+
+    def missing_rates(self):
+        """各字段的缺失率和取值为“无”的比例"""
+        return pd.DataFrame({'缺失': self.missing.mean(), '无': self.none.mean()})
+
+    def groups(self, by, bins=None):
+        """
+        分组的标签和每个案例所属的分组（-1表示不属于任何分组）
+
+        Args:
+            by (str): '年龄'（按 bins 分箱）或 '性别'
+        """
+        if by == '年龄':
+            bins = np.asarray(bins or SystemConfig.COHORT_AGE_BINS, dtype=float)
+            codes = pd.cut(self.frame['年龄'], bins, right=False, labels=False).fillna(-1).astype(int).to_numpy()
+            return age_labels(bins), codes
+        if by == '性别':
+            codes, labels = pd.factorize(self.frame['性别'].astype('object'))
+            return list(labels), codes
+        raise ValueError(f"不支持的分组: {by}")
+
+    def crosstab(self, by, bins=None, top=None):
+        """
+        分组 × ICD编码的交叉表（案例数）
+
+        Args:
+            by (str): '年龄' 或 '性别'
+            bins (list, optional): 年龄分箱边界
+            top (int, optional): 只保留出现最多的 top 个编码
+        """
+        labels, codes = self.groups(by, bins)
+        rows = np.flatnonzero(codes >= 0)
+        onehot = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, codes[rows])), shape=(len(self.frame), len(labels)))
+        size = len(self.icd_codes) if top is None else min(top, len(self.icd_codes))
+        table = (onehot.T @ self.icd_matrix[:, :size]).toarray()
+        return pd.DataFrame(table, index=pd.Index(labels, name=by), columns=self.icd_codes[:size])
+
+    def summary(self, bins=None, top=20):
+        """可JSON序列化的画像摘要"""
+        cooccurrence = self.cooccurrence_frame(top)
+        return {
+            'cases': len(self),
+            'age': self.age_histogram(bins).to_dict(),
+            'gender': self.gender_counts().to_dict(),
+            'icd_codes': len(self.icd_codes),
+            'icd': self.icd_counts().head(top).to_dict(),
+            'icd_cooccurrence': {code: row[row > 0].drop(code, errors='ignore').to_dict()
+                                 for code, row in cooccurrence.iterrows()},
+            'missing': self.missing_rates().to_dict(orient='index') if len(self) else {},
+            'age_x_icd': self.crosstab('年龄', bins, top).to_dict(orient='index'),
+            'gender_x_icd': self.crosstab('性别', top=top).to_dict(orient='index'),
+        }
+
+
+def to_builtin(value):
+    """把numpy标量转换为JSON可序列化的Python类型"""
+    if isinstance(value, dict):
+        return {str(key): to_builtin(item) for key, item in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='统计患者案例的年龄、性别、ICD编码分布、编码共现、字段缺失和交叉表')
+    parser.add_argument('--cases', default=PathConfig.PATIENT_CASES_JSON_PATH, help='患者案例JSON（数组或JSONL）')
+    parser.add_argument('--bins', default=None, help='年龄分箱边界，逗号分隔（左闭右开，inf表示无上界），默认为 SystemConfig.COHORT_AGE_BINS')
+    parser.add_argument('--icd-level', type=int, default=SystemConfig.COHORT_ICD_LEVEL, help='ICD编码保留的前缀长度，如3表示F32.901计为F32')
+    parser.add_argument('--top', type=int, default=20, help='共现矩阵和交叉表中保留的编码数')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='每块处理的案例数')
+    parser.add_argument('--output', default=None, help='画像JSON的输出路径，不指定时只打印')
+    args = parser.parse_args()
+    bins = [float(value) for value in args.bins.split(',')] if args.bins else None
+
+    profile = CohortProfile.from_json(args.cases, args.chunk_size, args.icd_level)
+    pd.set_option('display.width', 200)
+    print(f"共 {len(profile)} 个案例，{len(profile.icd_codes)} 种ICD编码")
+    print("年龄分布:\n", profile.age_histogram(bins).to_string())
+    print("性别分布:\n", profile.gender_counts().to_string())
+    print("字段缺失率:\n", profile.missing_rates().round(4).to_string())
+    print("ICD编码共现:\n", profile.cooccurrence_frame(args.top).to_string())
+    print("年龄段 × ICD编码:\n", profile.crosstab('年龄', bins, args.top).to_string())
+    print("性别 × ICD编码:\n", profile.crosstab('性别', top=args.top).to_string())
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(to_builtin(profile.summary(bins, args.top)), f, ensure_ascii=False, indent=2)
+        print(f"画像已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+对话数据的列式导出（Parquet/Arrow）
+将 DataSyn/patient_N.json 中嵌套的对话展开为两张扁平表：
+1. turns：每句发言一行（患者编号、对话编号、轮次、角色、文本、话题、token数、耗时、是否为分叉对话与主干共享的前缀）
+2. conversations：每个对话一行，并关联患者病例字段；分叉对话的token数和耗时不包括共享前缀（已计入主干对话）
+每个患者写出一个分片文件，整个目录可以直接作为一个 Arrow/Parquet 数据集读取
+
+用法：
+    python columnar_export.py --input ./DataSyn --cases ./raw_data/pa20.json --output ./DataSyn_parquet
+"""
+import argparse
+import glob
+import json
+import os
+import re
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import get_output_dir, get_patient_info_path
+
+TURN_SCHEMA = pa.schema([
+    ('patient_id', pa.int32()),
+    ('conversation_idx', pa.int32()),
+    ('turn', pa.int32()),
+    ('role', pa.string()),
+    ('text', pa.string()),
+    ('topic', pa.string()),
+    ('tokens', pa.int64()),
+    ('latency', pa.float64()),
+    ('shared_prefix', pa.bool_()),
+])
+
+# 患者病例字段到列名的映射，嵌套字段（个人史、精神检查）以JSON字符串保存
+CASE_FIELDS = [
+    ('年龄', 'age', pa.int32()),
+    ('性别', 'gender', pa.string()),
+    ('ICD编码', 'icd_code', pa.string()),
+    ('诊断结果', 'diagnosis', pa.string()),
+    ('主诉', 'chief_complaint', pa.string()),
+    ('现病史', 'present_illness', pa.string()),
+    ('重要或相关躯体疾病史', 'physical_illness_history', pa.string()),
+    ('家族史', 'family_history', pa.string()),
+    ('个人史', 'personal_history', pa.string()),
+    ('精神检查', 'mental_exam', pa.string()),
+    ('处理意见', 'treatment', pa.string()),
+]
+
+CONVERSATION_SCHEMA = pa.schema([
+    ('patient_id', pa.int32()),
+    ('conversation_idx', pa.int32()),
+    ('num_turns', pa.int32()),
+    ('doctor_chars', pa.int64()),
+    ('patient_chars', pa.int64()),
+    ('tokens', pa.int64()),
+    ('latency', pa.float64()),
+    ('truncated', pa.string()),
+    ('fork_round', pa.int32()),
+] + [(column, dtype) for _, column, dtype in CASE_FIELDS])
+
+
+def conversation_turn_rows(patient_id, conversation_idx, conversation, turn_meta=None):
+    """
+    将单个对话展开为发言行
+
+    Args:
+        patient_id (int): 患者编号
+        conversation_idx (int): 对话编号（从0开始）
+        conversation (list): [{"doctor": ..., "patient": ...}, ...]
+        turn_meta (list, optional): 按发言顺序排列的 {"topic", "tokens", "latency"}（分叉对话的共享前缀另有 "shared_prefix"），
+            由 main.py 在生成时记录；从已有JSON导出时为None，对应列为空
+
+    Returns:
+        list: 发言行
+    """
+    rows = []
+    for turn, item in enumerate(conversation):
+        for role in ('doctor', 'patient'):
+            if role not in item:
+                continue
+            meta = turn_meta[len(rows)] if turn_meta is not None and len(rows) < len(turn_meta) else {}
+            rows.append({
+                'patient_id': patient_id,
+                'conversation_idx': conversation_idx,
+                'turn': turn,
+                'role': role,
+                'text': item[role],
+                'topic': meta.get('topic'),
+                'tokens': meta.get('tokens'),
+                'latency': meta.get('latency'),
+                'shared_prefix': meta.get('shared_prefix', False) if meta else None,
+            })
+    return rows
+
+
+def case_columns(patient_template):
+    """将患者病例字段转换为列值"""
+    columns = {}
+    for key, column, _ in CASE_FIELDS:
+        value = patient_template.get(key) if patient_template else None
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        elif value is not None and column != 'age':
+            value = str(value)
+        columns[column] = value
+    return columns
+
+
+def patient_tables(patient_id, conversations, patient_template=None, turn_meta=None):
+    """
+    构建单个患者的 turns 表和 conversations 表
+
+    Args:
+        patient_id (int): 患者编号
+        conversations (list): [{"conversation": [...]}, ...]，即 patient_N.json 的内容
+        patient_template (dict, optional): 患者病例
+        turn_meta (list, optional): 每个对话的发言元数据列表
+
+    Returns:
+        tuple: (turns表, conversations表)
+    """
+    turn_rows = []
+    conversation_rows = []
+    case = case_columns(patient_template)
+    for idx, item in enumerate(conversations):
+        rows = conversation_turn_rows(patient_id, idx, item['conversation'], turn_meta[idx] if turn_meta else None)
+        turn_rows.extend(rows)
+        # 分叉对话的共享前缀已计入主干对话，与对话花费（扣除共享前缀）一致
+        own_rows = [row for row in rows if not row['shared_prefix']]
+        tokens = [row['tokens'] for row in own_rows if row['tokens'] is not None]
+        latency = [row['latency'] for row in own_rows if row['latency'] is not None]
+        conversation_rows.append(dict({
+            'patient_id': patient_id,
+            'conversation_idx': idx,
+            'num_turns': len(item['conversation']),
+            'doctor_chars': sum(len(row['text'] or '') for row in rows if row['role'] == 'doctor'),
+            'patient_chars': sum(len(row['text'] or '') for row in rows if row['role'] == 'patient'),
+            'tokens': sum(tokens) if tokens else None,
+            'latency': sum(latency) if latency else None,
+            'truncated': item.get('truncated'),
+            'fork_round': item['fork']['round'] if item.get('fork') else None,
+        }, **case))
+    return (pa.Table.from_pylist(turn_rows, schema=TURN_SCHEMA),
+            pa.Table.from_pylist(conversation_rows, schema=CONVERSATION_SCHEMA))
+
+
+def write_patient_tables(output_dir, patient_id, conversations, patient_template=None, turn_meta=None):
+    """
+    将单个患者的对话写出为 output_dir/turns/patient_N.parquet 和 output_dir/conversations/patient_N.parquet
+
+    Args:
+        output_dir (str): 列式输出根目录
+        patient_id (int): 患者编号
+        conversations (list): 患者的全部对话
+        patient_template (dict, optional): 患者病例
+        turn_meta (list, optional): 每个对话的发言元数据列表
+    """
+    turns, conversation_table = patient_tables(patient_id, conversations, patient_template, turn_meta)
+    for name, table in (('turns', turns), ('conversations', conversation_table)):
+        table_dir = os.path.join(output_dir, name)
+        os.makedirs(table_dir, exist_ok=True)
+        path = os.path.join(table_dir, 'patient_{}.parquet'.format(patient_id))
+        pq.write_table(table, path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+
+
+def export_directory(input_dir, case_path, output_dir):
+    """
+    将已有的 patient_N.json 目录转换为列式数据集
+
+    Args:
+        input_dir (str): 对话JSON目录
+        case_path (str): 患者案例JSON文件，用于关联病例字段
+        output_dir (str): 列式输出根目录
+
+    Returns:
+        int: 导出的患者数
+    """
+    cases = {}
+    if case_path and os.path.exists(case_path):
+        with open(case_path) as f:
+            cases = {case['患者']: case for case in json.load(f)}
+
+    count = 0
+    for path in glob.glob(os.path.join(input_dir, 'patient_*.json')):
+        match = re.search(r'patient_(\d+)\.json$', path)
+        if match is None:
+            continue
+        patient_id = int(match.group(1))
+        with open(path) as f:
+            conversations = json.load(f)
+        write_patient_tables(output_dir, patient_id, conversations, cases.get(patient_id))
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将生成的对话导出为Parquet列式数据集')
+    parser.add_argument('--input', default=get_output_dir(), help='patient_N.json 所在目录')
+    parser.add_argument('--cases', default=get_patient_info_path(), help='患者案例JSON文件')
+    parser.add_argument('--output', default=get_output_dir() + '_parquet', help='列式输出根目录')
+    args = parser.parse_args()
+
+    count = export_directory(args.input, args.cases, args.output)
+    print(f"已导出 {count} 个患者的对话到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,34 @@ class ModelConfig:
     DEFAULT_MODEL_NAME = '/tcci_mnt/shihao/models/Qwen3-8B'
     GPT4_MODEL_NAME = 'gpt-4o'
     
-    # 模型成本配置（每1000个token的成本）
-    GPT4_INPUT_COST = 15 / 1000000   # GPT-4o输入成本
-    GPT4_OUTPUT_COST = 5 / 1000000   # GPT-4o输出成本
+    # 模型价格表（美元/token）：输入、命中缓存的输入、输出
+    # 按模型名称或模型路径的最后一段匹配，未列出的模型（如本地部署）使用 DEFAULT_PRICING
+    PRICING = {
+        'gpt-4o': {'input': 2.5 / 1000000, 'cached_input': 1.25 / 1000000, 'output': 10 / 1000000},
+        'gpt-4o-mini': {'input': 0.15 / 1000000, 'cached_input': 0.075 / 1000000, 'output': 0.6 / 1000000},
+        'gpt-4.1': {'input': 2 / 1000000, 'cached_input': 0.5 / 1000000, 'output': 8 / 1000000},
+        'gpt-4.1-mini': {'input': 0.4 / 1000000, 'cached_input': 0.1 / 1000000, 'output': 1.6 / 1000000},
+    }
+    DEFAULT_PRICING = {'input': 0, 'cached_input': 0, 'output': 0}
+    BATCH_PRICE_SCALE = 0.5  # 批处理接口相对于同步调用的价格系数
+    
+    # 按调用类型路由的模型和服务地址（见 llm_tools_api.route），未列出或为None的调用类型使用调用方的模型（默认为 DEFAULT_MODEL_NAME），
+    # 服务地址按模型名称选择（包含'gpt'时为 OPENAI_BASE_URL，否则为 LOCAL_BASE_URL）。
+    # 每项可以设置 'model'、'base_url'、'api_key'，例如让判断类调用使用部署在另一端口的小模型：
+    #     'topic_end': {'model': '/models/Qwen3-1.7B', 'base_url': 'http://localhost:9013/v1/'}
+    # 设置 'backend': 'cpu' 时不连接服务，由ONNX Runtime在本进程的CPU上推理量化模型（'model' 为 cpu_backend.py export 的输出目录）：
+    #     'topic_end': {'model': '/models/Qwen3-1.7B-onnx-int8', 'backend': 'cpu'}
+    ROUTES = {
+        'doctor_reply': None,  # 医生回复（包括开场提问和角色扮演基线）
+        'patient_reply': None,  # 患者回复（包括角色扮演基线）
+        'topic_end': None,  # 话题是否结束（包括角色扮演对话是否结束）
+        'topic_detection': None,  # 话题是否已被覆盖
+        'parse_experience': None,  # 从患者经历中解析后续话题
+        'experience_trigger': None,  # 患者是否应该说出创伤经历
+        'extraction': None,  # 病例信息提取
+        'background_gen': None,  # 背景故事生成
+        'background_exist': None,  # 病例中是否已有背景经历
+    }
 
 # ============= 文件路径配置 =============
 class PathConfig:
@@ -49,6 +74,15 @@ class PathConfig:
     
     # 输出路径
     OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'DataSyn')
+    COLUMNAR_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'DataSyn_parquet')  # 列式输出（turns/conversations表）
+    ARCHIVE_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'DataSyn_archive')  # 压缩分片归档输出
+    DEDUP_REPORT_PATH = os.path.join(PROJECT_ROOT, 'dedup_report.json')  # 近重复检测报告
+    QUEUE_PATH = os.path.join(PROJECT_ROOT, 'work_queue.db')  # 多进程生成的任务队列数据库
+    JUDGE_LOG_PATH = os.path.join(PROJECT_ROOT, 'judge_log.jsonl')  # LLM判断记录（本地分类器的训练数据）
+    JUDGE_MODEL_DIR = os.path.join(PROJECT_ROOT, 'judge_models')  # 本地判断分类器
+    TRANSCRIPT_DIR = os.path.join(PROJECT_ROOT, 'transcripts')  # LLM调用的录制/回放文件
+    SHARD_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'DataSyn_shards')  # 多节点分片输出，由 sharding.py 合并
+    BATCH_DIR = os.path.join(PROJECT_ROOT, 'batch')  # 批处理模式的请求/结果文件（见 batch_jobs.py）
     
     # 临时文件和缓存路径
     TEMP_DIR = os.path.join(PROJECT_ROOT, 'temp')
@@ -59,15 +93,99 @@ class SystemConfig:
     """系统相关配置"""
     # 生成配置
     NUM_CONVERSATIONS = 5  # 每个患者生成的对话数量
+    WRITE_COLUMNAR = False  # 生成对话时是否同时写出Parquet列式数据
+    OUTPUT_STORAGE = 'json'  # 对话存储方式：'json'（每个患者一个JSON文件）或 'archive'（压缩分片归档）
+    ARCHIVE_COMPRESSION = 'zstd'  # 归档压缩格式：'zstd' 或 'gzip'
+    ARCHIVE_SHARD_SIZE = 64 * 1024 * 1024  # 单个归档分片的最大字节数
     
     # API调用配置
     DEFAULT_TOP_P = 0.9
     DEFAULT_TEMPERATURE = 0.8
     DEFAULT_FREQUENCY_PENALTY = 0.8
     
+    # 近重复检测配置
+    DEDUP_INDEX = False  # 生成对话时是否增量构建近重复检测索引
+    DEDUP_NUM_PERM = 128  # MinHash签名长度
+    DEDUP_SHINGLE_SIZE = 3  # 中文字符shingle长度
+    DEDUP_CONVERSATION_THRESHOLD = 0.5  # 判定为近重复对话的Jaccard相似度
+    DEDUP_OPENING_THRESHOLD = 0.7  # 判定为重复开场白的Jaccard相似度
+    DEDUP_MAX_CANDIDATES = 32  # 每次插入最多比较的簇代表数
+    DEDUP_MIN_CHARS = 10  # 去除空白后少于该字数的文本（如空开场白）不参与检测
+    
+    ROLEPLAY_WORKERS = 16  # roleplay.py 并发生成的对话数
+    
+    # 任务队列配置（main.py --queue）
+    QUEUE_LEASE_SECONDS = 300  # 任务租约时长（秒），生成期间每隔三分之一租约续约一次
+    QUEUE_MAX_ATTEMPTS = 3  # 单个对话的最大尝试次数
+    QUEUE_POLL_SECONDS = 5  # 剩余任务都在其他进程中运行时的等待间隔（秒）
+    
+    # 调度配置（见 scheduling.py）
+    SCHEDULE = 'fifo'  # 'fifo'（按患者和对话编号）或 'longest_first'（按预测轮数从长到短派发，队列模式多进程时有效）
+    SCHEDULE_TURNS_PER_TOPIC = 1.3  # 没有历史对话时每个计划话题的预测轮数
+    SCHEDULE_PATIENT_WEIGHT = 2  # 与患者历史平均轮数加权时，按诊断树的预测相当于多少个对话
+    
+    # 患者案例画像配置（见 cohort_profile.py）
+    COHORT_AGE_BINS = [0, 10, 20, 30, 40, 50, 60, 70, 80, float('inf')]  # 年龄分箱边界（左闭右开）
+    COHORT_ICD_LEVEL = None  # ICD编码保留的前缀长度（如3表示F32.901计为F32），None时使用完整编码
+    
+    # CPU量化推理后端配置（见 cpu_backend.py）
+    CPU_BACKEND_THREADS = 0  # 每个模型的ONNX Runtime线程数，0时使用全部物理核心
+    CPU_BACKEND_MAX_TOKENS = 512  # 请求没有指定 max_tokens 时的最大生成token数
+    
+    # 批处理模式配置（patient_template_gen.py --batch）
+    BATCH_COMPLETION_WINDOW = '24h'  # 批处理接口的完成时限
+    
+    # 背景故事生成配置
+    STORY_SEED = 0  # 关键词采样的基础种子
+    STORY_PROMPT_VERSION = 'v1'  # 修改背景故事生成提示词时需要更新，使已有故事失效
+    
+    # 录制/回放配置（见 transcript.py）
+    TRANSCRIPT_MODE = None  # None、'record'（记录所有LLM请求/响应和随机种子）或 'replay'（不调用模型，按记录重新运行）
+    TRANSCRIPT_DIR = None  # 转录目录，None时使用 PathConfig.TRANSCRIPT_DIR
+    RUN_SEED = None  # 对话随机种子的基础值，None时每个对话随机生成（录制时会记录实际使用的种子）
+    
+    # 判断类调用（话题是否结束、话题是否已覆盖、是否说出创伤经历、角色扮演是否结束）的配置
+    JUDGE_MODE = 'single_token'  # 'single_token'：支持guided_choice的模型只生成1个token并由logprobs给出概率（OpenAI模型仍生成完整回复）；'text'：生成完整回复后匹配
+    JUDGE_TOP_LOGPROBS = 5  # 计算标签概率时请求的 top_logprobs 数量
+    JUDGE_LOG = False  # 记录LLM判断的输入和结果到 PathConfig.JUDGE_LOG_PATH，用于训练本地分类器（见 judge_distill.py）
+    JUDGE_DISTILL = False  # 话题结束、创伤经历和角色扮演结束的判断先由本地分类器回答，置信度不足时转交LLM
+    JUDGE_LOCAL_THRESHOLD = 0.9  # 本地分类器直接回答所需的最低置信度
+    JUDGE_SHADOW_RATE = 0.05  # 本地回答中同时调用LLM以估计一致率的比例
+    
     # 对话配置
     MAX_DIALOGUE_HISTORY = 8  # 最大对话历史长度
     
+    # 对话分叉配置（见 forking.py，线程模式下生效）：每个患者的第一个对话作为主干，其余对话从主干的分叉点继续生成
+    FORK_MODE = False  # 是否启用对话分叉
+    FORK_ROUNDS = [2, 4]  # 保存分叉点的轮数（医生提问+患者回答为一轮），第i个对话从第 (i-1) 个（循环使用）分叉
+    FORK_VARY = ['story', 'topics']  # 分叉时改变的内容：'story'（换用该对话的背景故事）、'topics'（打乱剩余话题的顺序）
+    
+    # 开场提问预取配置（见 opening.py，线程模式下生效）
+    OPENING_PREFETCH = False  # 是否按批预取各对话的第一句医生提问（改变请求方式，已有的录制不再匹配）
+    OPENING_BATCH_PATIENTS = 8  # 每批预取的患者数
+    OPENING_MAX_N = 8  # 单次请求的最大n（请求消息相同的对话合并为一次请求）
+    OPENING_WORKERS = 8  # 并发的预取请求数
+    
+    # 流式生成配置：记录首token时间和token间隔，并在满足条件时提前停止生成
+    STREAMING = False  # 医生/患者的回复是否使用流式生成
+    STREAM_STOP_ON_BLANK_LINE = True  # 出现空行时停止（提示词要求输出一整段没有空行的内容）
+    STREAM_MAX_CHARS = {'doctor': 300, 'patient': 600, 'roleplay_doctor': 300, 'roleplay_patient': 600}  # 各角色回复的最大字数，None表示不限制
+    
+    # 单个对话的预算（None表示不限制），超出时以诊断结果结束对话并标记为截断
+    MAX_TURNS_PER_CONVERSATION = 40  # 最大轮数
+    MAX_TOKENS_PER_CONVERSATION = 300000  # 医生和患者消耗的最大token数
+    MAX_SECONDS_PER_CONVERSATION = 1800  # 最长耗时（秒）
+    
+    # 整个运行的花费预算（美元，None表示不限制），达到预算时停止开始新的对话
+    RUN_BUDGET = None
+    COST_ESTIMATE_AFTER = 20  # 完成多少个对话后开始估算总花费并为在途对话预留额度
+    
+    # 状态接口配置（见 status_server.py）
+    STATUS_PORT = None  # 状态接口端口，None表示不启动
+    STATUS_HOST = '127.0.0.1'  # 监听地址
+    STATUS_WINDOW_SECONDS = 600  # 计算近期吞吐量和token速率的时间窗口（秒）
+    QUIET = False  # 不输出每句发言和调试信息
+    
     # 调试配置
     DEBUG = False
 
@@ -107,6 +225,3 @@ def ensure_dirs_exist():
     
     for dir_path in dirs_to_create:
         os.makedirs(dir_path, exist_ok=True)
-
-# 初始化时创建必要目录
-ensure_dirs_exist() 
\ No newline at end of file
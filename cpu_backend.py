@@ -0,0 +1,337 @@
+"""
+CPU量化推理后端
+把模型导出为ONNX并做int8（动态量化）或int4（MatMulNBits仅权重量化），由ONNX Runtime在CPU上推理。
+CpuChatClient 提供与OpenAI客户端相同的 chat.completions.create 接口（返回相同结构的响应），
+在 ModelConfig.ROUTES 中为某类调用设置 'backend': 'cpu' 后，医生/患者回复和判断类调用不需要修改即可使用，
+录制/回放、流式生成、开场提问的n参数、判断类调用的logprobs和guided_choice都照常工作。
+适合用空闲的CPU承担话题结束等只生成1个token的判断类调用。
+
+与服务端的差异：
+1. frequency_penalty、response_format 等参数被忽略
+2. 同一模型在进程内只加载一次，ONNX Runtime 会话本身使用多线程（SystemConfig.CPU_BACKEND_THREADS），生成调用按模型串行
+
+用法：
+    python cpu_backend.py export --model /models/Qwen3-1.7B --output /models/Qwen3-1.7B-onnx-int8 --bits 8
+    python cpu_backend.py export --model /models/Qwen3-1.7B --output /models/Qwen3-1.7B-onnx-int4 --bits 4
+    python cpu_backend.py bench --model /models/Qwen3-1.7B-onnx-int8
+
+    # config.py
+    ROUTES = {'topic_end': {'model': '/models/Qwen3-1.7B-onnx-int8', 'backend': 'cpu'}, ...}
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from config import SystemConfig
+
+# 按优先级查找的模型文件（export 的输出）
+ONNX_FILES = ['model_int4.onnx', 'model_quantized.onnx', 'model.onnx']
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def onnx_file(model_dir):
+    """模型目录中使用的ONNX文件名"""
+    for name in ONNX_FILES:
+        if os.path.exists(os.path.join(model_dir, name)):
+            return name
+    raise FileNotFoundError(f"{model_dir} 中没有ONNX模型（{', '.join(ONNX_FILES)}），请先运行 python cpu_backend.py export")
+
+
+class CpuModel:
+    """加载到CPU的ONNX模型和分词器，同一模型目录的所有客户端共享"""
+
+    def __init__(self, model_dir, threads=None):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForCausalLM
+        from transformers import AutoTokenizer
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads if threads is not None else SystemConfig.CPU_BACKEND_THREADS
+        self.model = ORTModelForCausalLM.from_pretrained(model_dir, file_name=onnx_file(model_dir), provider='CPUExecutionProvider',
+                                                         session_options=options, use_cache=True, use_io_binding=False)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.lock = threading.Lock()
+        self.eos_token_ids = self._eos_token_ids()
+
+    def _eos_token_ids(self):
+        eos = self.model.generation_config.eos_token_id
+        eos = list(eos) if isinstance(eos, (list, tuple)) else [eos] if eos is not None else []
+        if self.tokenizer.eos_token_id is not None and self.tokenizer.eos_token_id not in eos:
+            eos.append(self.tokenizer.eos_token_id)
+        return eos
+
+    def encode(self, messages, chat_template_kwargs=None):
+        """按对话模板编码请求消息"""
+        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True,
+                                                    **(chat_template_kwargs or {}))
+        encoded = self.tokenizer(prompt, return_tensors='pt', add_special_tokens=False)
+        return {'input_ids': encoded['input_ids'], 'attention_mask': encoded['attention_mask']}
+
+    def choice_constraint(self, choices, prompt_len):
+        """
+        guided_choice：每一步只允许与已生成部分匹配的候选的下一个token，候选生成完后只允许结束
+
+        Returns:
+            callable: generate 的 prefix_allowed_tokens_fn
+        """
+        sequences = [self.tokenizer.encode(choice, add_special_tokens=False) for choice in choices]
+
+        def allowed(batch_id, input_ids):
+            generated = input_ids[prompt_len:].tolist()
+            tokens = {ids[len(generated)] for ids in sequences if ids[:len(generated)] == generated and len(ids) > len(generated)}
+            if any(ids == generated for ids in sequences):
+                tokens.update(self.eos_token_ids)
+            return sorted(tokens) or self.eos_token_ids
+        return allowed
+
+    def generation_kwargs(self, inputs, temperature=None, top_p=None, max_tokens=None, n=1, guided_choice=None):
+        """把OpenAI请求参数转换为 generate 的参数"""
+        temperature = 1.0 if temperature is None else temperature
+        kwargs = dict(inputs, max_new_tokens=max_tokens or SystemConfig.CPU_BACKEND_MAX_TOKENS,
+                      eos_token_id=self.eos_token_ids, pad_token_id=self.tokenizer.pad_token_id or self.eos_token_ids[0],
+                      num_return_sequences=n)
+        if temperature > 0:
+            kwargs.update(do_sample=True, temperature=temperature, top_p=1.0 if top_p is None else top_p)
+        else:
+            kwargs.update(do_sample=False, temperature=None, top_p=None, top_k=None)
+        if guided_choice:
+            kwargs['prefix_allowed_tokens_fn'] = self.choice_constraint(guided_choice, inputs['input_ids'].shape[1])
+        return kwargs
+
+
+def load_model(model_dir):
+    """加载（并缓存）模型目录中的ONNX模型"""
+    with _models_lock:
+        if model_dir not in _models:
+            _models[model_dir] = CpuModel(model_dir)
+        return _models[model_dir]
+
+
+def token_logprobs(model, token_ids, logits, top):
+    """
+    每个生成token的log概率和 top 个候选（按未经采样处理的原始logits计算，与服务端的logprobs一致）
+
+    Returns:
+        dict: 与OpenAI响应中的 logprobs 相同的结构
+    """
+    import torch
+    content = []
+    for token_id, step_logits in zip(token_ids, logits):
+        logprobs = torch.log_softmax(step_logits.float(), dim=-1)
+        values, indices = logprobs.topk(max(top or 0, 1))
+        content.append({
+            'token': model.tokenizer.decode([token_id]),
+            'logprob': float(logprobs[token_id]),
+            'top_logprobs': [{'token': model.tokenizer.decode([int(index)]), 'logprob': float(value)}
+                             for value, index in zip(values[:top or 0], indices[:top or 0])],
+        })
+    return {'content': content}
+
+
+class _Completions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **kwargs):
+        return self.client.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, client):
+        self.completions = _Completions(client)
+
+
+class CpuChatClient:
+    """与OpenAI客户端接口相同的CPU推理客户端（client.chat.completions.create）"""
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self.chat = _Chat(self)
+
+    def create(self, model, messages, temperature=None, top_p=None, max_tokens=None, n=1, stream=False,
+               stream_options=None, logprobs=False, top_logprobs=None, extra_body=None, **ignored):
+        cpu_model = load_model(self.model_dir)
+        extra_body = extra_body or {}
+        inputs = cpu_model.encode(messages, extra_body.get('chat_template_kwargs'))
+        kwargs = cpu_model.generation_kwargs(inputs, temperature, top_p, max_tokens, n or 1, extra_body.get('guided_choice'))
+        if stream:
+            return CpuStream(cpu_model, model, kwargs, (stream_options or {}).get('include_usage', False))
+
+        import torch
+        with cpu_model.lock, torch.no_grad():
+            output = cpu_model.model.generate(**kwargs, return_dict_in_generate=True, output_logits=bool(logprobs))
+        prompt_len = inputs['input_ids'].shape[1]
+        choices, completion_tokens = [], 0
+        for index, sequence in enumerate(output.sequences):
+            token_ids = [int(token_id) for token_id in sequence[prompt_len:]]
+            length = next((pos for pos, token_id in enumerate(token_ids) if token_id in cpu_model.eos_token_ids), None)
+            finish_reason = 'length' if length is None else 'stop'
+            token_ids = token_ids if length is None else token_ids[:length]
+            completion_tokens += len(token_ids)
+            choice = {'index': index, 'finish_reason': finish_reason,
+                      'message': {'role': 'assistant', 'content': cpu_model.tokenizer.decode(token_ids, skip_special_tokens=True)}}
+            if logprobs:
+                choice['logprobs'] = token_logprobs(cpu_model, token_ids, [step[index] for step in output.logits], top_logprobs)
+            choices.append(choice)
+        return chat_completion({
+            'id': 'cpu-' + uuid.uuid4().hex,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': choices,
+            'usage': {'prompt_tokens': prompt_len, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_len + completion_tokens},
+        })
+
+
+def chat_completion(response):
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate(response)
+
+
+class CpuStream:
+    """
+    流式生成：在后台线程中生成，逐段产出与OpenAI流式响应相同结构的chunk；
+    close() 在下一个token处停止生成（与关闭服务端连接的效果相同）
+    """
+
+    def __init__(self, cpu_model, model, kwargs, include_usage):
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+        self.cpu_model = cpu_model
+        self.model = model
+        self.include_usage = include_usage
+        self.id = 'cpu-' + uuid.uuid4().hex
+        self.stopped = threading.Event()
+        self.prompt_len = kwargs['input_ids'].shape[1]
+        self.streamer = TextIteratorStreamer(cpu_model.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stopped = self.stopped
+
+        class Stop(StoppingCriteria):
+            def __call__(self, input_ids, scores, **_):
+                return stopped.is_set()
+
+        self.output = None
+        self.error = None
+        self.thread = threading.Thread(target=self._generate, daemon=True,
+                                       args=(dict(kwargs, num_return_sequences=1, streamer=self.streamer,
+                                                  stopping_criteria=StoppingCriteriaList([Stop()])),))
+        self.thread.start()
+
+    def _generate(self, kwargs):
+        import torch
+        try:
+            with self.cpu_model.lock, torch.no_grad():
+                self.output = self.cpu_model.model.generate(**kwargs)
+        except Exception as exc:
+            # 在迭代的线程中重新抛出，避免生成失败看起来像正常结束的空回复
+            self.error = exc
+        finally:
+            self.streamer.end()
+
+    def _chunk(self, delta, finish_reason=None, usage=None):
+        from openai.types.chat import ChatCompletionChunk
+        chunk = {'id': self.id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': self.model,
+                 'choices': [] if usage else [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+        if usage:
+            chunk['usage'] = usage
+        return ChatCompletionChunk.model_validate(chunk)
+
+    def __iter__(self):
+        yield self._chunk({'role': 'assistant', 'content': ''})
+        for text in self.streamer:
+            if text:
+                yield self._chunk({'content': text})
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        yield self._chunk({}, 'stop')
+        if self.include_usage and self.output is not None:
+            completion_tokens = self.output.shape[1] - self.prompt_len
+            yield self._chunk(None, usage={'prompt_tokens': self.prompt_len, 'completion_tokens': completion_tokens,
+                                           'total_tokens': self.prompt_len + completion_tokens})
+
+    def close(self):
+        self.stopped.set()
+
+
+def export(model_path, output_dir, bits=8, arch='avx2', block_size=32):
+    """
+    把transformers模型导出为ONNX并量化
+
+    Args:
+        model_path (str): transformers模型目录
+        output_dir (str): 输出目录（ONNX模型、配置和分词器）
+        bits (int): 8 为权重和激活的动态int8量化（ORTQuantizer），4 为仅权重的int4分块量化（MatMulNBits）
+        arch (str): int8量化针对的指令集（'avx2'、'avx512'、'avx512_vnni'、'arm64'）
+        block_size (int): int4量化的分块大小
+    """
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as fp32_dir:
+        ORTModelForCausalLM.from_pretrained(model_path, export=True, use_cache=True).save_pretrained(fp32_dir)
+        if bits == 8:
+            quantizer = ORTQuantizer.from_pretrained(fp32_dir, file_name='model.onnx')
+            config = getattr(AutoQuantizationConfig, arch)(is_static=False, per_channel=True)
+            quantizer.quantize(quantization_config=config, save_dir=output_dir, use_external_data_format=True)
+        elif bits == 4:
+            import onnx
+            from onnxruntime.quantization.matmul_nbits_quantizer import MatMulNBitsQuantizer
+            quantizer = MatMulNBitsQuantizer(onnx.load(os.path.join(fp32_dir, 'model.onnx')), bits=4, block_size=block_size, is_symmetric=True)
+            quantizer.process()
+            quantizer.model.save_model_to_file(os.path.join(output_dir, 'model_int4.onnx'), use_external_data_format=True)
+        else:
+            raise ValueError(f"不支持的量化位数: {bits}")
+        for name in os.listdir(fp32_dir):
+            if name.endswith('.json'):
+                shutil.copy(os.path.join(fp32_dir, name), output_dir)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_dir)
+
+
+def bench(model_dir, max_tokens=64, repeats=3):
+    """单次判断调用（1个token）和短回复的耗时"""
+    client = CpuChatClient(model_dir)
+    messages = [{"role": "system", "content": "你是一个功能强大的文本助手，擅长处理各种文本问题"},
+                {"role": "user", "content": "患者：最近总是睡不着，心情也很差。判断围绕诊断话题“睡眠情况”的对话是否应该结束，如果应该结束返回”是“，如果不应该结束返回”否“。"}]
+    load_model(model_dir)
+    for name, kwargs in (('judge', dict(max_tokens=1, logprobs=True, top_logprobs=5,
+                                        extra_body={'guided_choice': ['是', '否'], 'chat_template_kwargs': {'enable_thinking': False}})),
+                         ('reply', dict(max_tokens=max_tokens, temperature=0.8, top_p=0.9))):
+        durations, tokens = [], 0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            response = client.chat.completions.create(model=model_dir, messages=messages, **kwargs)
+            durations.append(time.perf_counter() - start)
+            tokens += response.usage.completion_tokens
+        print(f"{name}: 平均耗时 {sum(durations) / repeats:.3f}s，输出 {tokens / repeats:.0f} 个token，"
+              f"回复示例：{response.choices[0].message.content[:40]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出CPU量化模型并测试推理耗时')
+    parser.add_argument('command', choices=['export', 'bench'])
+    parser.add_argument('--model', required=True, help='export：transformers模型目录；bench：导出的ONNX模型目录')
+    parser.add_argument('--output', default=None, help='export 的输出目录')
+    parser.add_argument('--bits', type=int, choices=[4, 8], default=8, help='量化位数')
+    parser.add_argument('--arch', default='avx2', help='int8量化针对的指令集（avx2、avx512、avx512_vnni、arm64）')
+    parser.add_argument('--block-size', type=int, default=32, help='int4量化的分块大小')
+    parser.add_argument('--max-tokens', type=int, default=64, help='bench 中短回复的最大token数')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        if not args.output:
+            parser.error('export 需要指定 --output')
+        export(args.model, args.output, args.bits, args.arch, args.block_size)
+        print(f"已导出到 {args.output}（{onnx_file(args.output)}）")
+    else:
+        bench(args.model, args.max_tokens)
+
+
+if __name__ == "__main__":
+    main()
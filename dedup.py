@@ -0,0 +1,231 @@
+"""
+近重复对话检测（MinHash + LSH）
+对每个对话的医生和患者发言拼接后取中文字符 shingle，计算 MinHash 签名并插入 LSH 索引；
+近重复的条目归为一簇，只有每簇的代表进入LSH桶，每次插入最多与 DEDUP_MAX_CANDIDATES 个同桶的代表比较，
+即使大量对话重复（如医生人设较少时的开场白），耗时和内存也随对话数近似线性增长；
+同时单独索引每个对话的医生开场白，检测重复的开场。过短的文本（如空开场白）不参与检测
+索引可以在 main.py 写出对话时增量构建，也可以对已有的 DataSyn 目录离线构建
+
+用法：
+    python dedup.py --input ./DataSyn --output ./dedup_report.json
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from config import get_output_dir, PathConfig, SystemConfig
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MASK32 = np.uint64(0xFFFFFFFF)
+SHINGLE_BASE = np.uint64(1000003)
+
+
+def shingle_hashes(text, k):
+    """
+    计算文本的中文字符 k-shingle 哈希（去除空白后，按Unicode码点滚动哈希）
+
+    Args:
+        text (str): 文本
+        k (int): shingle 长度
+
+    Returns:
+        np.ndarray: 去重后的32位shingle哈希
+    """
+    text = re.sub(r'\s+', '', text or '')
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    k = min(k, len(codes))
+    n = len(codes) - k + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    for i in range(k):
+        hashes = (hashes * SHINGLE_BASE + codes[i:i + n]) & MASK32
+    return np.unique(hashes)
+
+
+def choose_bands(num_perm, threshold):
+    """选择 bands × rows = num_perm 的划分，使LSH的相似度阈值 (1/b)^(1/r) 最接近目标阈值"""
+    best = None
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands)
+    return best[1]
+
+
+class MinHashLSH:
+    """MinHash签名与LSH分桶索引"""
+
+    def __init__(self, threshold, num_perm=None, shingle_size=None, seed=1, max_candidates=None, min_chars=None):
+        self.threshold = threshold
+        self.num_perm = num_perm or SystemConfig.DEDUP_NUM_PERM
+        self.shingle_size = shingle_size or SystemConfig.DEDUP_SHINGLE_SIZE
+        self.max_candidates = max_candidates or SystemConfig.DEDUP_MAX_CANDIDATES
+        self.min_chars = min_chars if min_chars is not None else SystemConfig.DEDUP_MIN_CHARS
+        self.bands = choose_bands(self.num_perm, threshold)
+        self.rows = self.num_perm // self.bands
+        rng = np.random.RandomState(seed)
+        # 系数小于2^31，保证 a*h+b 不超出uint64
+        self.a = rng.randint(1, 1 << 31, size=self.num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=self.num_perm).astype(np.uint64)
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+        self.signatures = {}    # 簇代表 -> 签名
+        self.inserted = 0
+        self.skipped = 0
+
+    def signature(self, text):
+        """计算文本的MinHash签名"""
+        hashes = shingle_hashes(text, self.shingle_size)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key, text):
+        """
+        插入一条文本：与同桶的簇代表（最多 max_candidates 个）比较，相似度不低于阈值时归入最相似的簇，
+        否则成为新簇的代表；去除空白后短于 min_chars 个字的文本不参与检测
+
+        Returns:
+            tuple or None: (所属簇的代表, 估计的Jaccard相似度)，成为新的代表或文本过短时返回None
+        """
+        self.inserted += 1
+        if len(re.sub(r'\s+', '', text or '')) < self.min_chars:
+            self.skipped += 1
+            return None
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        candidates = {}
+        for bucket, band_key in zip(self.buckets, band_keys):
+            for candidate in bucket.get(band_key, ()):
+                candidates.setdefault(candidate, None)
+                if len(candidates) >= self.max_candidates:
+                    break
+            if len(candidates) >= self.max_candidates:
+                break
+        best = None
+        for candidate in candidates:
+            similarity = float(np.mean(self.signatures[candidate] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        if best is not None:
+            return best
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket[band_key].append(key)
+        self.signatures[key] = signature
+        return None
+
+
+class DedupIndex:
+    """线程安全的对话去重索引，分别检测重复对话和重复的医生开场白，按簇记录重复"""
+
+    def __init__(self, conversation_threshold=None, opening_threshold=None):
+        self.conversations = MinHashLSH(conversation_threshold or SystemConfig.DEDUP_CONVERSATION_THRESHOLD)
+        self.openings = MinHashLSH(opening_threshold or SystemConfig.DEDUP_OPENING_THRESHOLD)
+        self.conversation_clusters = {}    # 簇代表 -> [{"conversation", "similarity"}, ...]
+        self.opening_clusters = {}    # 簇代表 -> {"opening": 开场白（每簇只保存一次）, "duplicates": [...]}
+        self.lock = threading.Lock()
+
+    def add_conversation(self, patient_id, conversation_idx, conversation):
+        """
+        将单个对话加入索引
+
+        Args:
+            patient_id (int): 患者编号
+            conversation_idx (int): 对话编号（从0开始）
+            conversation (list): [{"doctor": ..., "patient": ...}, ...]
+        """
+        key = '{}/{}'.format(patient_id, conversation_idx)
+        text = ''.join(turn.get('doctor', '') + turn.get('patient', '') for turn in conversation)
+        opening = conversation[0].get('doctor', '') if conversation else ''
+        with self.lock:
+            match = self.conversations.insert(key, text)
+            if match is not None:
+                self.conversation_clusters.setdefault(match[0], []).append({'conversation': key, 'similarity': match[1]})
+            match = self.openings.insert(key, opening)
+            if match is not None:
+                cluster = self.opening_clusters.setdefault(match[0], {'opening': opening, 'duplicates': []})
+                cluster['duplicates'].append({'conversation': key, 'similarity': match[1]})
+
+    def add_patient(self, patient_id, conversations):
+        """将单个患者的全部对话（patient_N.json 的内容）加入索引"""
+        for idx, item in enumerate(conversations):
+            self.add_conversation(patient_id, idx, item['conversation'])
+
+    def report(self, max_pairs=200):
+        """
+        生成去重报告
+
+        Args:
+            max_pairs (int): 每类最多列出的簇数，以及每簇最多列出的重复条目数
+
+        Returns:
+            dict: 去重报告，key 形如 "患者编号/对话编号"，簇按重复条目数从多到少排列
+        """
+        with self.lock:
+            total = self.conversations.inserted
+            duplicate_conversations = sum(len(members) for members in self.conversation_clusters.values())
+            repeated_openings = sum(len(cluster['duplicates']) for cluster in self.opening_clusters.values())
+            conversation_clusters = sorted(self.conversation_clusters.items(), key=lambda item: -len(item[1]))[:max_pairs]
+            opening_clusters = sorted(self.opening_clusters.items(), key=lambda item: -len(item[1]['duplicates']))[:max_pairs]
+            return {
+                'conversations': total,
+                'duplicate_conversations': duplicate_conversations,
+                'duplicate_conversation_rate': duplicate_conversations / total if total else 0.0,
+                'repeated_openings': repeated_openings,
+                'repeated_opening_rate': repeated_openings / total if total else 0.0,
+                'skipped_short': {'conversations': self.conversations.skipped, 'openings': self.openings.skipped},
+                'conversation_threshold': self.conversations.threshold,
+                'opening_threshold': self.openings.threshold,
+                'conversation_clusters': [{'representative': key, 'size': len(members) + 1, 'duplicates': members[:max_pairs]}
+                                          for key, members in conversation_clusters],
+                'opening_clusters': [{'representative': key, 'size': len(cluster['duplicates']) + 1, 'opening': cluster['opening'],
+                                      'duplicates': cluster['duplicates'][:max_pairs]}
+                                     for key, cluster in opening_clusters],
+            }
+
+    def save_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+
+def build_from_directory(input_dir):
+    """对已有的 patient_N.json 目录构建去重索引"""
+    index = DedupIndex()
+    paths = []
+    for path in glob.glob(os.path.join(input_dir, 'patient_*.json')):
+        match = re.search(r'patient_(\d+)\.json$', path)
+        if match is not None:
+            paths.append((int(match.group(1)), path))
+    for patient_id, path in sorted(paths):
+        with open(path) as f:
+            index.add_patient(patient_id, json.load(f))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用MinHash LSH检测近重复的对话和医生开场白')
+    parser.add_argument('--input', default=get_output_dir(), help='patient_N.json 所在目录')
+    parser.add_argument('--output', default=PathConfig.DEDUP_REPORT_PATH, help='去重报告输出路径')
+    args = parser.parse_args()
+
+    index = build_from_directory(args.input)
+    index.save_report(args.output)
+    report = index.report(max_pairs=0)
+    print(f"共 {report['conversations']} 个对话，近重复对话 {report['duplicate_conversations']} 个，"
+          f"重复开场白 {report['repeated_openings']} 个，报告已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
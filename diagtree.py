@@ -25,14 +25,27 @@ class Tree:
             return False
         
     
+def diagtree_file(diagtree_dir, patient_template):
+    """按患者性别和年龄（20岁及以下为青少年）选择诊断树文件"""
+    filename1 = 'male' if patient_template['性别'] == '男' else 'female'
+    if int(patient_template['年龄']) <= 20:
+        filename2 = '_teen.json'
+    else:
+        filename2 = '_adult.json'
+    return os.path.join(diagtree_dir, filename1+filename2)
+
+
 class DiagTree():
-    def __init__(self, model_name, prompts={}) -> None:
+    def __init__(self, model_name, prompts={}, rng=None) -> None:
+        self.rng = rng or random    # 由对话种子初始化的随机数生成器，录制/回放时保证话题选择可复现
         self.doctor_promot_path = prompts['doctor']
         self.diagtree_path = prompts['diagtree']
         self.model_name = model_name
         self.diagtree = None
         self.dialstate = []
         self.topic_end = []
+        self.topic_end_prob = []    # 每次判断话题结束时“是”/“否”的概率（没有logprobs时为None）
+        self.sections = {}    # dynamic_select 选出的话题所属的部分（事件询问、病情判断、个人史），用于分叉时打乱话题顺序
     
 
     def load_tree(self):    #加载一棵针对x症状的树
@@ -57,7 +70,7 @@ class DiagTree():
                 if self.topic_end[-3] == False:
                     self.topic_end[-1] = True
                     return True
-                elif random.randint(0, 2) == 1:
+                elif self.rng.randint(0, 2) == 1:
                     return self.topic_end[-1]
                 else:
                     self.topic_end[-1] = True
@@ -66,7 +79,7 @@ class DiagTree():
                 if self.topic_end[-1] == True:
                     return True
                 else:
-                    if random.randint(0, 2) == 1:
+                    if self.rng.randint(0, 2) == 1:
                         self.topic_end[-1] = True
                         return True
                     else:
@@ -109,16 +122,14 @@ class DiagTree():
 
     def topic_detection(self, topic_seq, parse_topic):    #检测回答中是否已经包含了问诊树的话题
         result = []
+        prompt_tokens = completion_tokens = 0
         for topic in topic_seq:
             prompt = "判断在话题集合“{}”中是否有表达意思与“{}”相似或者相同的，如果包含输出”是“，如果不包含输出”否“。".format(topic, parse_topic)
-            answer, x = llm_tools_api.api_topic_detection(self.model_name, prompt)
-            if '否' in answer:
-                result.append(False)
-            elif '是' in answer:
-                result.append(True)
-            else:
-                raise ValueError
-        return result, x[0], x[1]
+            answer, _, x = llm_tools_api.api_topic_detection(self.model_name, prompt)
+            result.append(answer == '是')
+            prompt_tokens += x[0]
+            completion_tokens += x[1]
+        return result, prompt_tokens, completion_tokens
 
 
     def dynamic_select(self):    #动态的根据LLM判断当前状态访问树中节点,返回一个list
@@ -129,44 +140,49 @@ class DiagTree():
         assert self.diagtree.children[0].value == '事件询问'
         options = self.diagtree.children[0].children
         for i in range(len(options)):
-            option = random.sample(options, 1)[0]
+            option = self.rng.sample(options, 1)[0]
             options.remove(option)
             if option.value == 'parse':
                 # self.parse_experience(self.model_name, input)
                 self.dialstate.append('parse')
+                self.sections['parse'] = '事件询问'
             else:
                 prompt = self.prompt_gen(option.value)
                 self.dialstate.append(prompt)
+                self.sections[prompt] = '事件询问'
 
         assert self.diagtree.children[1].value == '病情判断'
         options = self.diagtree.children[1].children
         for i in range(len(options)):
-            option = random.sample(options, 1)[0]
+            option = self.rng.sample(options, 1)[0]
             options.remove(option)
             if option.children == []:
                 prompt = self.prompt_gen(option.value)
                 self.dialstate.append(prompt)
+                self.sections[prompt] = '病情判断'
             elif len(option.children) >= 1:
                 opts = option.children
                 for j in range(len(opts)):
-                    opt = random.sample(opts, 1)[0]
+                    opt = self.rng.sample(opts, 1)[0]
                     opts.remove(opt)
                     prompt = self.prompt_gen(opt.value)
                     self.dialstate.append(prompt)
+                    self.sections[prompt] = '病情判断'
             else:
                 raise TypeError
         
         assert self.diagtree.children[2].value == '个人史'
         assert self.diagtree.children[3].value == '家族史，亲戚中是否有精神疾病患者'
 
-        if random.randint(0,1) == 1:
+        if self.rng.randint(0,1) == 1:
             options = self.diagtree.children[2].children
             for i in range(len(options)):
-                option = random.sample(options, 1)[0]
+                option = self.rng.sample(options, 1)[0]
                 if option.children == []:
                     options.remove(option)
                     prompt = self.prompt_gen(option.value)
                     self.dialstate.append(prompt)
+                    self.sections[prompt] = '个人史'
                 else:
                     raise TypeError
             prompt = self.prompt_gen(self.diagtree.children[3].value)
@@ -176,30 +192,43 @@ class DiagTree():
             self.dialstate.append(prompt)
             options = self.diagtree.children[2].children
             for i in range(len(options)):
-                option = random.sample(options, 1)[0]
+                option = self.rng.sample(options, 1)[0]
                 if option.children == []:
                     options.remove(option)
                     prompt = self.prompt_gen(option.value)
                     self.dialstate.append(prompt)
+                    self.sections[prompt] = '个人史'
                 else:
                     raise TypeError
 
         return self.dialstate
                 
     
+    def permute_topics(self, start):
+        """
+        打乱 dialstate[start:] 中各部分剩余话题的顺序（对话分叉时使用），
+        每个话题只在所属部分原来占据的位置之间移动，由经历解析插入的话题和家族史保持原位置
+        """
+        for section in ('事件询问', '病情判断', '个人史'):
+            positions = [idx for idx in range(start, len(self.dialstate)) if self.sections.get(self.dialstate[idx]) == section]
+            topics = [self.dialstate[idx] for idx in positions]
+            self.rng.shuffle(topics)
+            for idx, topic in zip(positions, topics):
+                self.dialstate[idx] = topic
+
+
     def is_topic_end(self, current_state, input_history):    #根据随机的话题，并判断话题持续轮数
         prompt = "一段精神科医生和精神疾病患者之间的对话为{}，判断围绕诊断话题”{}“的对话是否应该结束，如果应该结束返回”是“，如果不应该结束返回”否“。倾向于判断话题应该结束".format(input_history, current_state)
-        result, x = llm_tools_api.api_dialogue_state(self.model_name, prompt)
-        if '是' in result:
-            result = True
-        elif '否' in result:
-            result = False
-        else:
-            raise ValueError
-        self.topic_end.append(result)
-        print("**********1", self.topic_end)
+        # 当前话题的第几次判断（话题结束的判断之后开始新话题）
+        turns = 1
+        while turns <= len(self.topic_end) and not self.topic_end[-turns]:
+            turns += 1
+        result, probability, x = llm_tools_api.api_dialogue_state(self.model_name, prompt, turns)
+        self.topic_end.append(result == '是')
+        self.topic_end_prob.append(probability)
+        llm_tools_api.log("**********1", self.topic_end)
         result = self.force_topic_end()
-        print("**********2", self.topic_end)
+        llm_tools_api.log("**********2", self.topic_end)
         return self.topic_end[-1], x[0], x[1]
 
 
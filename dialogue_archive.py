@@ -0,0 +1,241 @@
+"""
+对话压缩分片归档
+将生成的对话写入压缩的JSONL分片（zstd或gzip），每个对话压缩为一个独立的帧，
+分片文件本身仍是合法的 .jsonl.zst / .jsonl.gz，可以整体解压；
+同时维护索引 index.jsonl，将 (患者编号, 对话编号) 映射到 (分片, 偏移, 长度)，
+读取单个对话时只需定位并解压对应的帧
+
+用法：
+    python dialogue_archive.py convert --input ./DataSyn --output ./DataSyn_archive
+    python dialogue_archive.py get --archive ./DataSyn_archive --patient 1 --conversation 0
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+
+from config import get_output_dir, PathConfig, SystemConfig
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_NAME = 'index.jsonl'
+SHARD_SUFFIX = {'zstd': '.jsonl.zst', 'gzip': '.jsonl.gz'}
+
+
+def compress_frame(data, compression):
+    """将一行数据压缩为独立的帧"""
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd压缩需要安装 zstandard：pip install zstandard")
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    elif compression == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    else:
+        raise ValueError(f"不支持的压缩格式: {compression}")
+
+
+def decompress_frame(data, compression):
+    """解压单个帧"""
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd解压需要安装 zstandard：pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == 'gzip':
+        return gzip.decompress(data)
+    else:
+        raise ValueError(f"不支持的压缩格式: {compression}")
+
+
+class ArchiveWriter:
+    """
+    线程安全的分片归档写入器
+    分片压缩后的大小超过 shard_size 时切换到新分片；重新打开已有归档时从新分片继续写入
+    """
+
+    def __init__(self, root, compression=None, shard_size=None):
+        self.root = root
+        self.compression = compression or SystemConfig.ARCHIVE_COMPRESSION
+        self.shard_size = shard_size or SystemConfig.ARCHIVE_SHARD_SIZE
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        existing = glob.glob(os.path.join(root, 'shard-*'))
+        self.shard_num = max([int(re.search(r'shard-(\d+)', os.path.basename(p)).group(1)) for p in existing], default=-1)
+        self.shard_file = None
+        self.shard_name = None
+        self.index_file = open(os.path.join(root, INDEX_NAME), 'a')
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_num += 1
+        self.shard_name = 'shard-{:05d}{}'.format(self.shard_num, SHARD_SUFFIX[self.compression])
+        self.shard_file = open(os.path.join(self.root, self.shard_name), 'ab')
+
+    def add_conversation(self, patient_id, conversation_idx, conversation, extra=None):
+        """
+        追加单个对话
+
+        Args:
+            patient_id (int): 患者编号
+            conversation_idx (int): 对话编号（从0开始）
+            conversation (list): [{"doctor": ..., "patient": ...}, ...]
+            extra (dict, optional): patient_N.json 中该对话的其他字段，如 truncated（超出预算的类型）、fork（分叉点）
+        """
+        record = {'patient': patient_id, 'conversation_idx': conversation_idx, 'conversation': conversation}
+        record.update(extra or {})
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        frame = compress_frame(line.encode('utf-8'), self.compression)
+        with self.lock:
+            if self.shard_file is None or self.shard_file.tell() >= self.shard_size:
+                self._next_shard()
+            offset = self.shard_file.tell()
+            self.shard_file.write(frame)
+            self.shard_file.flush()
+            # 帧写入后再写索引，中断时索引不会指向不完整的数据
+            self.index_file.write(json.dumps({'patient': patient_id, 'conversation_idx': conversation_idx,
+                                              'shard': self.shard_name, 'offset': offset, 'length': len(frame)}) + '\n')
+            self.index_file.flush()
+
+    def add_patient(self, patient_id, conversations):
+        """
+        追加单个患者的全部对话
+
+        Args:
+            patient_id (int): 患者编号
+            conversations (list): [{"conversation": [...]}, ...]，即 patient_N.json 的内容
+        """
+        for idx, item in enumerate(conversations):
+            extra = {key: value for key, value in item.items() if key != 'conversation'}
+            self.add_conversation(patient_id, idx, item['conversation'], extra)
+
+    def close(self):
+        with self.lock:
+            if self.shard_file is not None:
+                self.shard_file.close()
+                self.shard_file = None
+            self.index_file.close()
+
+
+class ArchiveReader:
+    """按 (患者编号, 对话编号) 随机读取归档中的对话，患者编号按字符串比较（1 与 '1' 相同）"""
+
+    def __init__(self, root):
+        self.root = root
+        self.index = {}
+        self.conversations = {}    # 患者编号（字符串） -> 排序后的对话编号
+        with open(os.path.join(root, INDEX_NAME), 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断时可能留下不完整的最后一行
+                    continue
+                # 同一对话重复写入时以最后一次为准
+                self.index[(str(entry['patient']), entry['conversation_idx'])] = entry
+        for patient, idx in self.index:
+            self.conversations.setdefault(patient, []).append(idx)
+        for indices in self.conversations.values():
+            indices.sort()
+
+    def patients(self):
+        """返回归档中的全部患者编号（字符串）"""
+        return sorted(self.conversations)
+
+    def get_record(self, patient_id, conversation_idx):
+        """
+        读取单个对话的完整记录
+
+        Returns:
+            dict: {"patient", "conversation_idx", "conversation", 以及写入时的其他字段（如 "truncated"、"fork"）}
+        """
+        entry = self.index[(str(patient_id), conversation_idx)]
+        compression = 'zstd' if entry['shard'].endswith(SHARD_SUFFIX['zstd']) else 'gzip'
+        with open(os.path.join(self.root, entry['shard']), 'rb') as f:
+            f.seek(entry['offset'])
+            data = f.read(entry['length'])
+        return json.loads(decompress_frame(data, compression))
+
+    def get(self, patient_id, conversation_idx):
+        """
+        读取单个对话
+
+        Returns:
+            list: [{"doctor": ..., "patient": ...}, ...]
+        """
+        return self.get_record(patient_id, conversation_idx)['conversation']
+
+    def get_patient(self, patient_id):
+        """读取单个患者的全部对话，格式与 patient_N.json 相同"""
+        conversations = []
+        for idx in self.conversations.get(str(patient_id), []):
+            record = self.get_record(patient_id, idx)
+            conversations.append({key: value for key, value in record.items() if key not in ('patient', 'conversation_idx')})
+        return conversations
+
+
+def convert(input_dir, root, compression=None, shard_size=None):
+    """
+    将已有的 patient_N.json 目录转换为分片归档
+
+    Args:
+        input_dir (str): 对话JSON目录
+        root (str): 归档目录
+
+    Returns:
+        int: 转换的患者数
+    """
+    paths = []
+    for path in glob.glob(os.path.join(input_dir, 'patient_*.json')):
+        match = re.search(r'patient_(\d+)\.json$', path)
+        if match is not None:
+            paths.append((int(match.group(1)), path))
+
+    writer = ArchiveWriter(root, compression, shard_size)
+    try:
+        for patient_id, path in sorted(paths):
+            with open(path) as f:
+                writer.add_patient(patient_id, json.load(f))
+    finally:
+        writer.close()
+    return len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对话压缩分片归档')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='将 patient_N.json 目录转换为分片归档')
+    convert_parser.add_argument('--input', default=get_output_dir(), help='patient_N.json 所在目录')
+    convert_parser.add_argument('--output', default=PathConfig.ARCHIVE_OUTPUT_DIR, help='归档目录')
+    convert_parser.add_argument('--compression', choices=list(SHARD_SUFFIX), default=SystemConfig.ARCHIVE_COMPRESSION)
+    convert_parser.add_argument('--shard-size', type=int, default=SystemConfig.ARCHIVE_SHARD_SIZE, help='单个分片的最大字节数')
+
+    get_parser = subparsers.add_parser('get', help='读取单个对话')
+    get_parser.add_argument('--archive', default=PathConfig.ARCHIVE_OUTPUT_DIR, help='归档目录')
+    get_parser.add_argument('--patient', type=int, required=True, help='患者编号')
+    get_parser.add_argument('--conversation', type=int, default=None, help='对话编号（从0开始），不指定时输出该患者的全部对话')
+
+    args = parser.parse_args()
+    if args.command == 'convert':
+        count = convert(args.input, args.output, args.compression, args.shard_size)
+        print(f"已将 {count} 个患者的对话转换到 {args.output}")
+    else:
+        reader = ArchiveReader(args.archive)
+        if args.conversation is None:
+            result = reader.get_patient(args.patient)
+        else:
+            result = reader.get(args.patient, args.conversation)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
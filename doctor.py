@@ -1,21 +1,21 @@
+import copy
 import json
 import random
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
 import llm_tools_api
-from diagtree import DiagTree
-import os
+from diagtree import DiagTree, diagtree_file
 from config import SystemConfig
 
 
 class Doctor(llm_tools_api.DoctorCost):
-    def __init__(self, patient_template, doctor_prompt_path, diagtree_path, model_path, use_api) -> None:
+    def __init__(self, patient_template, doctor_prompt_path, diagtree_path, model_path, use_api, rng=None) -> None:
         super().__init__(model_path.split('/')[-1])
+        self.rng = rng or random
         self.patient_template = patient_template
         self.doctor_prompt_path = doctor_prompt_path
         self.diagtree_path = diagtree_path
         self.model_path = model_path
         self.model_name = model_path #.split('/')[-1]
+        self.reply_model = llm_tools_api.routed_model('doctor_reply', self.model_name)    # 医生回复使用的模型（见 ModelConfig.ROUTES）
         self.doctor_model = None
         self.doctor_tokenizer = None
         self.doctor_prompt = None
@@ -30,16 +30,11 @@ class Doctor(llm_tools_api.DoctorCost):
         self.topic_seq = []
         self.topic_begin = 0
         self.diagtree = None
+        self.opening = None    # 预取的开场提问
+        self.opening_tokens = None
         # diagtree init
-        age = self.patient_template['年龄']
-        gender = self.patient_template['性别']
-        filename1 = 'male' if gender == '男' else 'female'
-        if int(age) <= 20:
-            filename2 = '_teen.json'
-        else:
-            filename2 = '_adult.json'
-        self.diagtree_path = os.path.join(self.diagtree_path, filename1+filename2)
-        self.diagnosis_tree = DiagTree(model_name=self.model_name, prompts={'doctor': self.doctor_prompt_path, 'diagtree': self.diagtree_path})
+        self.diagtree_path = diagtree_file(self.diagtree_path, self.patient_template)
+        self.diagnosis_tree = DiagTree(model_name=self.model_name, prompts={'doctor': self.doctor_prompt_path, 'diagtree': self.diagtree_path}, rng=self.rng)
         self.diagnosis_tree.load_tree()
         self.topic_seq = self.diagnosis_tree.dynamic_select()
 
@@ -47,7 +42,7 @@ class Doctor(llm_tools_api.DoctorCost):
     def doctorbot_init(self, first_topic):
         with open(self.doctor_prompt_path) as f:
             prompt = json.load(f)
-        doctor_num = random.randint(0, len(prompt)-1)
+        doctor_num = self.rng.randint(0, len(prompt)-1)
         self.doctor_prompt = prompt[doctor_num]
         self.doctor_persona = "你是一名{}的{}专业的精神卫生中心临床心理科主任医师，对一名患者进行问诊。注意，你有如下的问诊习惯，你在所有的对话过程中都要记住和保持这些问诊习惯：\
             你尤其擅长诊断{}，你的问诊速度是{}的，你的交流风格是{}的，你{}在适当到时候与患者进行共情对话，你{}向患者解释一些专业名词术语。使用口语化的表达。" \
@@ -59,36 +54,63 @@ class Doctor(llm_tools_api.DoctorCost):
         if self.use_api:
             self.client = llm_tools_api.doctor_client_init(self.model_name)
         else:
-            self.doctor_model = AutoModelForCausalLM.from_pretrained(
-                self.model_path,
-                torch_dtype=torch.bfloat16,
-                device_map="auto"
-            )
-            self.doctor_tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            self.doctor_model, self.doctor_tokenizer = llm_tools_api.local_model_init(self.reply_model)
         self.messages.extend([{"role": "system", "content": self.doctor_persona},
                             {"role": "user", "content": final_prompt}])
         
 
+    def opening_messages(self):
+        """开场提问的请求消息，只依赖医生人设、患者的年龄和性别以及第一个话题"""
+        if not self.messages:
+            self.doctorbot_init(self.topic_seq[self.current_idx])
+        return self.messages
+
+    def set_opening(self, doctor_response, tokens):
+        """
+        记录开场提问（由 doctor_response_gen 生成或由 opening.py 预取），花费在对话中第一次调用 doctor_response_gen 时计入
+
+        Args:
+            doctor_response (str): 开场提问
+            tokens (list): 该提问分摊的 [输入token数, 输出token数, 命中缓存的输入token数]
+        """
+        self.opening = doctor_response
+        self.opening_tokens = tokens
+        self.current_idx += 1
+        self.messages.pop()
+
+    def fork(self):
+        """
+        复制对话进行到当前位置的医生（见 forking.py），客户端和本地模型共享，
+        诊断树、话题序列和随机数生成器复制后仍互相引用
+        """
+        memo = {id(self.client): self.client, id(self.doctor_model): self.doctor_model,
+                id(self.doctor_tokenizer): self.doctor_tokenizer}
+        return copy.deepcopy(self, memo)
+
+    def diagnosis_message(self):
+        return "诊断结束，你的诊断结果为：{}，最终处理意见为：{}".format(self.patient_template['诊断结果'], self.patient_template['处理意见'])
+
     def doctor_response_gen(self, patient_response, dialogue_history):
         if self.use_api:
             if self.dialbegin == True:
-                self.doctorbot_init(self.topic_seq[self.current_idx])
-                # print(self.topic_seq)
-                self.current_idx += 1
-                chat_response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=self.messages,
-                    top_p=SystemConfig.DEFAULT_TOP_P
-                )
-                super().money_cost(chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens)
-                doctor_response = chat_response.choices[0].message.content
-                self.messages.pop()
+                # 开场提问已由 opening.py 预取时不再请求
+                if self.opening is None:
+                    # print(self.topic_seq)
+                    messages = self.opening_messages()    # 初始化人设和客户端
+                    doctor_response, tokens = llm_tools_api.chat_completion(
+                        self.client, 'doctor',
+                        model=self.reply_model,
+                        messages=messages,
+                        top_p=SystemConfig.DEFAULT_TOP_P
+                    )
+                    self.set_opening(doctor_response, tokens)
+                super().money_cost(*self.opening_tokens, call_type='doctor_reply')
                 self.dialbegin = False
-                return doctor_response
+                return self.opening
             else:   
                 is_topic_end, pt, ct = self.diagnosis_tree.is_topic_end(self.topic_seq[self.current_idx], dialogue_history[self.topic_begin:])
-                super().money_cost(pt, ct)
-                print("********topic_end", is_topic_end)
+                super().money_cost(pt, ct, call_type='topic_end')
+                llm_tools_api.log("********topic_end", is_topic_end)
                 if is_topic_end:
                     # topic_cover = self.diagnosis_tree.topic_detection(dialogue_history[self.topic_begin:])
                     # # print("******topic_cover", topic_cover)
@@ -100,19 +122,18 @@ class Doctor(llm_tools_api.DoctorCost):
                     self.topic_begin = len(dialogue_history)
                     is_dialogue_end = self.diagnosis_tree.is_end(self.topic_seq[self.current_idx])
                     if is_dialogue_end:
-                        diag_result = "诊断结束，你的诊断结果为：{}，最终处理意见为：{}".format(self.patient_template['诊断结果'], self.patient_template['处理意见'])
-                        return diag_result, None, super().get_cost()
+                        return self.diagnosis_message(), None, super().get_cost()
                     else:
                         self.current_idx += 1
-                        print("**********current_topic1", self.topic_seq[self.current_idx])
+                        llm_tools_api.log("**********current_topic1", self.topic_seq[self.current_idx])
                         if self.topic_seq[self.current_idx] == 'parse':
                             parse_topic, loc, pt, ct = self.diagnosis_tree.parse_experience(dialogue_history)
-                            print("*******parse_topic", parse_topic)
-                            super().money_cost(pt, ct)
+                            llm_tools_api.log("*******parse_topic", parse_topic)
+                            super().money_cost(pt, ct, call_type='parse_experience')
                             assert loc == self.current_idx
                             topic_cover, pt, ct = self.diagnosis_tree.topic_detection(self.topic_seq[loc+1:], parse_topic)
-                            print("************topic_cover1:", topic_cover)
-                            super().money_cost(pt, ct)
+                            llm_tools_api.log("************topic_cover1:", topic_cover)
+                            super().money_cost(pt, ct, call_type='topic_detection')
                             delete_list = [self.topic_seq[loc+1+idx] for idx in range(len(topic_cover)) if topic_cover[idx] == True]
                             for i in range(len(parse_topic)):
                                 self.topic_seq.insert(loc+i+1, parse_topic[i])
@@ -132,26 +153,26 @@ class Doctor(llm_tools_api.DoctorCost):
                             doctor_prompt = self.doctor_persona + self.patient_persona + "\n你与患者的所有对话历史如下{}，".format(dialogue_history[-6:]) + "\n你回复患者的内容必须完全依据：\n1.对话历史\n2.当前围绕的话题{}。不要包含其他话题的问题。如果当前话题有关自杀或者自残，禁止输出冒犯性的提问。".format(self.topic_seq[self.current_idx]) + \
                                 "\n3.你每次只能围绕1个话题询问。使用口语化的表达，简洁的生成\n4.不要生成类似“谢谢”，“你的回答很有帮助”，”听到你的描述我很“，“你提到”之类的话。不要与历史对话使用相同的开头\n输出一整段文字，不要有空行。"
                         self.messages.append({"role": "user", "content": doctor_prompt})
-                        chat_response = self.client.chat.completions.create(
-                            model=self.model_name,
+                        doctor_response, tokens = llm_tools_api.chat_completion(
+                            self.client, 'doctor',
+                            model=self.reply_model,
                             messages=self.messages,
                             top_p=SystemConfig.DEFAULT_TOP_P,
                             frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
                         )
-                        super().money_cost(chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens)
-                        doctor_response = chat_response.choices[0].message.content
+                        super().money_cost(*tokens, call_type='doctor_reply')
                         self.messages.pop()
                         return doctor_response, self.topic_seq[self.current_idx], None
                 else:
-                    print("**********current_topic2", self.topic_seq[self.current_idx])
+                    llm_tools_api.log("**********current_topic2", self.topic_seq[self.current_idx])
                     if self.topic_seq[self.current_idx] == 'parse':
                         parse_topic, loc, pt, ct = self.diagnosis_tree.parse_experience(dialogue_history)
-                        print("*******parse_topic", parse_topic)
-                        super().money_cost(pt, ct)
+                        llm_tools_api.log("*******parse_topic", parse_topic)
+                        super().money_cost(pt, ct, call_type='parse_experience')
                         assert loc == self.current_idx
                         topic_cover, pt, ct = self.diagnosis_tree.topic_detection(self.topic_seq[loc+1:], parse_topic)
-                        print("************topic_cover2:", topic_cover)
-                        super().money_cost(pt, ct)
+                        llm_tools_api.log("************topic_cover2:", topic_cover)
+                        super().money_cost(pt, ct, call_type='topic_detection')
                         delete_list = [self.topic_seq[loc+1+idx] for idx in range(len(topic_cover)) if topic_cover[idx] == True]
                         for i in range(len(parse_topic)):
                             self.topic_seq.insert(loc+i+1, parse_topic[i])
@@ -165,14 +186,14 @@ class Doctor(llm_tools_api.DoctorCost):
                         doctor_prompt = self.doctor_persona + self.patient_persona + "\n你与患者的所有对话历史如下{}，".format(dialogue_history[-6:]) + "\n你回复患者的内容必须完全依据：\n1.对话历史\n2.当前围绕的话题{}。不要包含其他话题的问题。如果当前话题有关自杀或者自残，禁止输出冒犯性的提问。。".format(self.topic_seq[self.current_idx]) + \
                             "3.\n你每次只能围绕1个话题询问。使用简洁的，口语化的表达进行文本生成\n4.不要生成类似“谢谢”，“你的回答很有帮助”，”听到你的描述我很“，“你提到”之类的话。不要与历史对话使用相同的开头\n输出一整段文字，不要有空行。"
                     self.messages.append({"role": "user", "content": doctor_prompt})
-                    chat_response = self.client.chat.completions.create(
-                        model=self.model_name,
+                    doctor_response, tokens = llm_tools_api.chat_completion(
+                        self.client, 'doctor',
+                        model=self.reply_model,
                         messages=self.messages,    #不直接使用过去的历史，使用历史+prompt
                         top_p=SystemConfig.DEFAULT_TOP_P,
                         frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
                     )
-                    super().money_cost(chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens)
-                    doctor_response = chat_response.choices[0].message.content
+                    super().money_cost(*tokens, call_type='doctor_reply')
                     self.messages.pop()
                     return doctor_response, self.topic_seq[self.current_idx], None
         else:
@@ -218,6 +239,7 @@ class Roleplay_Doctor():
     def __init__(self, patient_template, model_path, use_api) -> None:
         self.patient_template = patient_template
         self.model_name = model_path.split('/')[-1]
+        self.reply_model = llm_tools_api.routed_model('doctor_reply', self.model_name)
         self.use_api = use_api
         self.messages = []
         self.dialbegin = True
@@ -234,25 +256,25 @@ class Roleplay_Doctor():
         if self.use_api:
             if self.dialbegin == True:
                 self.doctorbot_init()
-                chat_response = self.client.chat.completions.create(
-                    model=self.model_name,
+                doctor_response, _ = llm_tools_api.chat_completion(
+                    self.client, 'roleplay_doctor',
+                    model=self.reply_model,
                     messages=self.messages,
                     top_p = 0.93
                 )
-                doctor_response = chat_response.choices[0].message.content
                 self.messages.pop()
                 self.dialbegin = False
                 return doctor_response
             else:
                 doctor_prompt = '你是一名专业的精神卫生中心临床心理科主任医师，对一名患者进行问诊,使用口语化的表达。\n你与患者的所有对话历史如下{}。\n你回复患者的内容必须完全依据：\n1.对话历史 \n2.不要重复询问之前问过的问题。 \
-                "3.\n你每次只能围绕1个话题询问。使用简洁的，口语化的表达进行文本生成\n3.不要生成类似“谢谢”，“你的回答很有帮助”，”听到你的描述我很“，“你提到”之类的话。不要与历史对话使用相同的开头\n输出一整段文字，不要有空行。'.format(dialogue_history[-8:])
+                "3.\n你每次只能围绕1个话题询问。使用简洁的，口语化的表达进行文本生成\n3.不要生成类似“谢谢”，“你的回答很有帮助”，”听到你的描述我很“，“你提到”之类的话。不要与历史对话使用相同的开头\n输出一整段文字，不要有空行。'.format(llm_tools_api.render_history(dialogue_history, 8))
                 self.messages.append({"role": "user", "content": doctor_prompt})
-                chat_response = self.client.chat.completions.create(
-                        model=self.model_name,
-                        messages=self.messages,    #不直接使用过去的历史，使用历史+prompt
-                        top_p=0.93,
-                        frequency_penalty=0.8
-                    )
-                doctor_response = chat_response.choices[0].message.content
+                doctor_response, _ = llm_tools_api.chat_completion(
+                    self.client, 'roleplay_doctor',
+                    model=self.reply_model,
+                    messages=self.messages,    #不直接使用过去的历史，使用历史+prompt
+                    top_p=0.93,
+                    frequency_penalty=0.8
+                )
                 self.messages.pop()
                 return doctor_response
\ No newline at end of file
@@ -1,87 +1,244 @@
+"""
+对话语料统计工具
+使用多进程逐文件扫描合成对话（DataSyn / Roleplay）或基线数据（D4、CPsyCounD），
+每个文件归约为NumPy数组后合并，输出轮数、医生/患者每轮字数的分布、分位数以及按诊断结果的分组统计
+
+用法（在项目根目录下运行）：
+    python evaluation/statistics.py MDD
+    python evaluation/statistics.py roleplay --workers 16 --output stats.json
+    python evaluation/statistics.py "./DataSyn/patient_*.json" --cases ./raw_data/pa20.json
+"""
+import argparse
+import glob
 import json
 import os
+import re
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import get_patient_info_path
+
+# 数据集名称到文件路径模式的映射
+DATASET_PATTERNS = {
+    'MDD': './DataSyn/patient_*.json',
+    'roleplay': './Roleplay/patient_*.json',
+    'D4': './evaluation/dialog_final_mapped.json',
+    'CPsy': './evaluation/CPsyCounD.json',
+}
+
+# 输出的分位数
+PERCENTILES = [5, 25, 50, 75, 95, 99]
+
+UNKNOWN_DIAGNOSIS = '未知'
+
+
+def resolve_paths(name):
+    """
+    将数据集名称或路径模式解析为文件列表
+
+    Args:
+        name (str): DATASET_PATTERNS 中的数据集名称，或文件路径/通配符
+
+    Returns:
+        list: 排序后的文件路径
+    """
+    pattern = DATASET_PATTERNS.get(name, name)
+    paths = glob.glob(pattern)
+
+    def sort_key(path):
+        match = re.search(r'patient_(\d+)\.json$', path)
+        return (0, int(match.group(1)), path) if match else (1, 0, path)
+
+    return sorted(paths, key=sort_key)
+
 
 def read_file(name):
+    """读取数据集的全部对话（用于基线数据转换）"""
     total = []
-    if 'MDD' in name:
-        for i in range(20):
-            with open(os.path.join('./DataSyn', 'patient_'+str(i+1)+'.json')) as f:
-                file = json.load(f)
-            total.extend(file)
-    elif 'D4' in name:
-        with open('./evaluation/dialog_final_mapped.json') as f:
-            file = json.load(f)
-        total = file
-    elif 'roleplay' in name:
-        for i in range(20):
-            with open(os.path.join('./Roleplay', 'patient_'+str(i+1)+'.json')) as f:
-                file = json.load(f)
-            total.extend(file)
-    elif 'CPsy' in name:
-        with open('./evaluation/CPsyCounD.json') as f:
-            file = json.load(f)
-        total = file
+    for path in resolve_paths(name):
+        with open(path) as f:
+            total.extend(json.load(f))
     return total
 
-def avg_turns(name:str, file:list):
-    if 'MDD' in name or 'roleplay' in name:
-        total_turns = 0
-        for dic in file:
-            con = dic['conversation']
-            turn = len(con)
-            total_turns += turn
-    elif 'D4' in name:
-        pass
-    return total_turns / 100
-
-def avg_words(name, file):
-    doc_total_words = 0
-    pat_total_words = 0
-    doc_total_turns = 0
-    pat_total_turns = 0
-    if 'MDD' in name or 'roleplay' in name:
-        for dic in file:
-            doc_words = 0
-            pat_words = 0
-            con = dic['conversation']
-            pat_turns = len(con)
-            doc_turns = pat_turns+1
-            for i in range(len(con)):
-                if i == len(con)-1:
-                    doc_words += len(con[i]['doctor'])
-                else:
-                    doc_words += len(con[i]['doctor'])
-                    pat_words += len(con[i]['patient'])
-            doc_total_words += doc_words
-            pat_total_words += pat_words
-            doc_total_turns += doc_turns
-            pat_total_turns += pat_turns
-        total_words = doc_total_words + pat_total_words
-        return total_words / 100, doc_total_words / doc_total_turns, pat_total_words / pat_total_turns
-    elif 'CPsy' in name:
-        pass
-    elif 'D4' in name:
-        for dic in file:
-            doc_words = 0
-            pat_words = 0
-            pat_turns = 0
-            doc_turns = 0
-            dial = dic['dialog']
-            for piece in dial:
-                if piece['role'] == 'doctor':
-                    doc_words += len(piece['content'])
-                    doc_turns += 1
-                elif piece['role'] == 'user':
-                    pat_words += len(piece['content'])
-                    pat_turns += 1
-                else:
-                    raise ValueError
-            doc_total_words += doc_words
-            pat_total_words += pat_words
-            doc_total_turns += doc_turns
-            pat_total_turns += pat_turns
-        total_words = doc_total_words + pat_total_words
-        return total_words / 1340, doc_total_words / doc_total_turns, pat_total_words / pat_total_turns
+
+def load_diagnosis_map(case_path):
+    """
+    读取患者案例文件，返回患者编号到诊断结果的映射
+
+    Args:
+        case_path (str): 患者案例JSON文件路径
+
+    Returns:
+        dict: {患者编号: 诊断结果}，文件不存在时为空
+    """
+    if not case_path or not os.path.exists(case_path):
+        return {}
+    with open(case_path) as f:
+        cases = json.load(f)
+    return {case['患者']: case['诊断结果'] for case in cases}
+
+
+def iter_utterances(record):
+    """
+    将不同格式的单个对话统一为 (角色, 文本) 序列
+
+    支持的格式：
+        MDD/roleplay: {"conversation": [{"doctor": ..., "patient": ...}, ...]}
+        D4: {"dialog": [{"role": "doctor"/"user", "content": ...}, ...]}
+        CPsyCounD: {"history": [[患者, 医生], ...], "instruction": 患者, "output": 医生}
+    """
+    if 'conversation' in record:
+        for turn in record['conversation']:
+            if 'doctor' in turn:
+                yield 'doctor', turn['doctor']
+            if 'patient' in turn:
+                yield 'patient', turn['patient']
+    elif 'dialog' in record:
+        for piece in record['dialog']:
+            if piece['role'] == 'doctor':
+                yield 'doctor', piece['content']
+            elif piece['role'] == 'user':
+                yield 'patient', piece['content']
+            else:
+                raise ValueError
+    elif 'history' in record:
+        for item in record['history'] + [[record['instruction'], record['output']]]:
+            yield 'patient', item[0]
+            yield 'doctor', item[1]
+    else:
+        raise ValueError
+
+
+def scan_file(args):
+    """
+    扫描单个文件，归约为NumPy数组（在子进程中运行）
+
+    Args:
+        args (tuple): (文件路径, 该文件对应的诊断结果或None)
+
+    Returns:
+        dict: 每个对话的轮数/医生字数/患者字数，每句医生/患者发言的字数，以及每个对话的诊断结果
+    """
+    path, diagnosis = args
+    with open(path) as f:
+        records = json.load(f)
+
+    conv_turns, conv_doc_chars, conv_pat_chars, conv_diagnosis = [], [], [], []
+    doc_chars, pat_chars = [], []
+    for record in records:
+        doc_turns = pat_turns = 0
+        doc_total = pat_total = 0
+        for role, text in iter_utterances(record):
+            length = len(text or '')
+            if role == 'doctor':
+                doc_chars.append(length)
+                doc_turns += 1
+                doc_total += length
+            else:
+                pat_chars.append(length)
+                pat_turns += 1
+                pat_total += length
+        conv_turns.append(max(doc_turns, pat_turns))
+        conv_doc_chars.append(doc_total)
+        conv_pat_chars.append(pat_total)
+        conv_diagnosis.append(diagnosis or UNKNOWN_DIAGNOSIS)
+
+    return {
+        'conv_turns': np.asarray(conv_turns, dtype=np.int32),
+        'conv_doc_chars': np.asarray(conv_doc_chars, dtype=np.int64),
+        'conv_pat_chars': np.asarray(conv_pat_chars, dtype=np.int64),
+        'conv_diagnosis': conv_diagnosis,
+        'doc_chars': np.asarray(doc_chars, dtype=np.int32),
+        'pat_chars': np.asarray(pat_chars, dtype=np.int32),
+    }
+
+
+def collect(paths, diagnosis_map=None, workers=None):
+    """
+    使用进程池扫描所有文件并合并各文件的部分结果
+
+    Args:
+        paths (list): 文件路径列表
+        diagnosis_map (dict, optional): 患者编号到诊断结果的映射
+        workers (int, optional): 进程数，默认为CPU核数
+
+    Returns:
+        dict: 合并后的数组
+    """
+    diagnosis_map = diagnosis_map or {}
+    jobs = []
+    for path in paths:
+        match = re.search(r'patient_(\d+)\.json$', path)
+        jobs.append((path, diagnosis_map.get(int(match.group(1))) if match else None))
+
+    if workers == 1 or len(jobs) <= 1:
+        partials = [scan_file(job) for job in jobs]
+    else:
+        with Pool(processes=workers) as pool:
+            partials = pool.map(scan_file, jobs, chunksize=max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4)))
+
+    merged = {}
+    for key in ['conv_turns', 'conv_doc_chars', 'conv_pat_chars', 'doc_chars', 'pat_chars']:
+        arrays = [partial[key] for partial in partials]
+        merged[key] = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+    merged['conv_diagnosis'] = np.asarray([d for partial in partials for d in partial['conv_diagnosis']], dtype=object)
+    return merged
+
+
+def describe(values):
+    """计算一组数值的分布统计"""
+    if len(values) == 0:
+        return {'count': 0}
+    percentiles = np.percentile(values, PERCENTILES)
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'min': int(values.min()),
+        'max': int(values.max()),
+        'percentiles': {f'p{p}': float(v) for p, v in zip(PERCENTILES, percentiles)},
+    }
+
+
+def summarize(merged):
+    """
+    由合并后的数组生成统计报告
+
+    Args:
+        merged (dict): collect 返回的数组
+
+    Returns:
+        dict: 统计报告
+    """
+    conv_chars = merged['conv_doc_chars'] + merged['conv_pat_chars']
+    doc_turn_total = max(len(merged['doc_chars']), 1)
+    pat_turn_total = max(len(merged['pat_chars']), 1)
+    report = {
+        'conversations': int(len(merged['conv_turns'])),
+        'turns_per_conversation': describe(merged['conv_turns']),
+        'chars_per_conversation': describe(conv_chars),
+        'doctor_chars_per_turn': describe(merged['doc_chars']),
+        'patient_chars_per_turn': describe(merged['pat_chars']),
+        'doctor_chars_per_turn_overall': float(merged['doc_chars'].sum() / doc_turn_total),
+        'patient_chars_per_turn_overall': float(merged['pat_chars'].sum() / pat_turn_total),
+        'by_diagnosis': {},
+    }
+
+    # 按诊断结果分组统计
+    diagnoses, inverse = np.unique(merged['conv_diagnosis'].astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(diagnoses)))[:-1]
+    for diagnosis, idx in zip(diagnoses, np.split(order, bounds)):
+        report['by_diagnosis'][str(diagnosis)] = {
+            'conversations': int(len(idx)),
+            'turns_per_conversation': describe(merged['conv_turns'][idx]),
+            'chars_per_conversation': describe(conv_chars[idx]),
+        }
+    return report
+
 
 def extract_baselines(name, file):
     if 'D4' in name:
@@ -101,7 +258,7 @@ def extract_baselines(name, file):
                 if len(output_dict) == 2:
                     output_list.append(output_dict)
                     output_dict = {}
-                
+
             total_output_dict["conversation"] = output_list
             total_output_list.append(total_output_dict)
             total_output_dict = {}
@@ -133,6 +290,31 @@ def extract_baselines(name, file):
                     total_output_list = []
 
 
-ll = read_file('D4')
-print(avg_words('D4', ll))
-extract_baselines('D4', ll)
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description='统计对话语料的轮数与字数分布')
+    parser.add_argument('datasets', nargs='+', help='数据集名称（MDD、roleplay、D4、CPsy）或文件路径通配符')
+    parser.add_argument('--cases', default=get_patient_info_path(), help='患者案例JSON文件，用于按诊断结果分组')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    parser.add_argument('--output', default=None, help='将统计报告保存为JSON文件')
+    parser.add_argument('--extract-baselines', action='store_true', help='将D4/CPsy基线转换为与MDD相同的对话格式')
+    args = parser.parse_args()
+
+    diagnosis_map = load_diagnosis_map(args.cases)
+    reports = {}
+    for name in args.datasets:
+        paths = resolve_paths(name)
+        if not paths:
+            print(f"未找到数据集 {name} 的文件，跳过")
+            continue
+        reports[name] = summarize(collect(paths, diagnosis_map, args.workers))
+        if args.extract_baselines:
+            extract_baselines(name, read_file(name))
+
+    print(json.dumps(reports, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
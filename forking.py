@@ -0,0 +1,72 @@
+"""
+对话分叉
+同一患者的各个对话往往有相同的前期走向（相同的医生人设、开场话题和最初的事件询问话题），
+分叉模式下每个患者的第一个对话作为主干完整生成，并在 SystemConfig.FORK_ROUNDS 指定的轮数处保存分叉点
+（医生、患者、诊断树和对话历史的副本）；其余对话从某个分叉点继续生成，共享的前缀只生成一次。
+
+分叉对话使用自己的对话种子（录制/回放时与独立生成的对话一样记录和读取），并按 SystemConfig.FORK_VARY：
+    'story'   患者尚未说出创伤经历时换用该对话的背景故事
+    'topics'  打乱剩余话题在各自部分（事件询问、病情判断、个人史）内的顺序
+"""
+import copy
+
+from config import SystemConfig
+
+
+class ForkPoint:
+    """主干对话在某一轮结束（患者回答之前）时的状态，可以多次分叉"""
+
+    def __init__(self, round_num, doc, pat, state):
+        """
+        Args:
+            round_num (int): 已完成的轮数（医生提问+患者回答为一轮）
+            doc (Doctor): 主干对话的医生
+            pat (Patient): 主干对话的患者
+            state (dict): run_conversation 的对话状态（对话历史、输出、话题和token记录、当前话题）
+        """
+        self.round = round_num
+        self.doc = doc.fork()
+        self.pat = pat.fork()
+        self.state = copy.deepcopy(state)
+        self.base_cost = doc.get_cost() + pat.get_cost()    # 分叉对话的花费中需要扣除的共享前缀花费
+
+    def branch(self, rng, story_path, vary=None):
+        """
+        从分叉点创建一个分叉对话
+
+        Args:
+            rng (random.Random): 分叉对话的随机数生成器
+            story_path (str): 分叉对话的背景故事路径
+            vary (list, optional): 分叉时改变的内容，默认为 SystemConfig.FORK_VARY
+
+        Returns:
+            tuple: (Doctor, Patient, 对话状态)
+        """
+        vary = SystemConfig.FORK_VARY if vary is None else vary
+        doc = self.doc.fork()
+        pat = self.pat.fork()
+        # 医生和诊断树共用同一个随机数生成器，换为分叉对话的种子
+        doc.rng.setstate(rng.getstate())
+        if 'story' in vary and pat.experience is None:
+            pat.story_path = story_path
+        if 'topics' in vary:
+            doc.diagnosis_tree.permute_topics(doc.current_idx + 1)
+        state = copy.deepcopy(self.state)
+        # 共享前缀的发言由主干对话生成，列式输出中标记出来，token数和耗时不重复计入分叉对话
+        for meta in state['turn_meta']:
+            meta['shared_prefix'] = True
+        return doc, pat, state
+
+
+def select_fork(fork_points, i, rounds=None):
+    """
+    第i个对话（i >= 1）使用的分叉点：FORK_ROUNDS 中的第 (i-1) 个（循环使用），
+    主干对话在该轮之前结束时使用之前最近的分叉点
+
+    Returns:
+        ForkPoint or None: 没有可用的分叉点时为None，该对话独立生成
+    """
+    rounds = rounds or SystemConfig.FORK_ROUNDS
+    target = rounds[(i - 1) % len(rounds)]
+    available = [round_num for round_num in fork_points if round_num <= target]
+    return fork_points[max(available)] if available else None
@@ -0,0 +1,281 @@
+"""
+判断类调用的本地蒸馏分类器
+话题是否结束（DiagTree.is_topic_end）、患者是否说出创伤经历（api_patient_experience_trigger）和
+角色扮演对话是否结束（api_isroleplay_end）几乎每轮都要调用一次LLM，而话题结束的判断还会再被 force_topic_end 改写。
+
+1. 记录：SystemConfig.JUDGE_LOG 为True时，每次LLM判断的输入文本、轮数特征、标签和概率追加写入 PathConfig.JUDGE_LOG_PATH
+2. 训练：对每类判断训练“字符n-gram TF-IDF + 轮数特征”的逻辑回归（scikit-learn，只使用CPU），
+   在留出集上报告与LLM的一致率，以及各置信度阈值下的转交比例和本地回答与LLM的一致率
+3. 使用：SystemConfig.JUDGE_DISTILL 为True时由分类器在本地回答，置信度低于 JUDGE_LOCAL_THRESHOLD 时转交LLM；
+   本地回答中按 JUDGE_SHADOW_RATE 的比例（由输入文本确定，回放时可复现）同时调用LLM，估计运行中的一致率。
+   运行结束时 main.py / roleplay.py 输出 JUDGE_STATS
+
+用法：
+    python main.py                      # SystemConfig.JUDGE_LOG = True，积累判断记录
+    python judge_distill.py train --log ./judge_log.jsonl --output ./judge_models
+    python judge_distill.py evaluate --log ./judge_log.jsonl --models ./judge_models
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import random
+import threading
+import zlib
+
+from config import PathConfig, SystemConfig
+
+JUDGES = ['topic_end', 'experience_trigger', 'roleplay_end']
+THRESHOLDS = [0.6, 0.7, 0.8, 0.9, 0.95]
+MAX_TURN_BUCKET = 6
+
+
+class JudgeLog:
+    """线程安全的判断记录（JSONL，每行一次LLM判断）"""
+
+    def __init__(self, path=None):
+        self.path = path or PathConfig.JUDGE_LOG_PATH
+        self.lock = threading.Lock()
+
+    def record(self, name, text, turns, label, probability):
+        line = json.dumps({'judge': name, 'text': text, 'turns': turns, 'label': label, 'probability': probability},
+                          ensure_ascii=False)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+def read_log(path):
+    """按判断类型读取记录，返回 {判断类型: [记录, ...]}"""
+    records = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.setdefault(record['judge'], []).append(record)
+    return records
+
+
+class JudgeClassifier:
+    """字符n-gram TF-IDF 与轮数特征（对数轮数和分桶的轮数）上的逻辑回归"""
+
+    def __init__(self, ngram_range=(1, 3), max_features=50000, C=4.0):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        self.vectorizer = TfidfVectorizer(analyzer='char', ngram_range=ngram_range, max_features=max_features, sublinear_tf=True)
+        self.model = LogisticRegression(C=C, max_iter=1000, class_weight='balanced')
+
+    def _features(self, texts, turns):
+        from scipy.sparse import csr_matrix, hstack
+        numeric = []
+        for turn_num in turns:
+            turn_num = turn_num or 0
+            bucket = [0.0] * MAX_TURN_BUCKET
+            bucket[min(turn_num, MAX_TURN_BUCKET) - 1 if turn_num > 0 else 0] = 1.0
+            numeric.append([math.log1p(turn_num)] + bucket)
+        return hstack([self.vectorizer.transform(texts), csr_matrix(numeric)]).tocsr()
+
+    def fit(self, texts, turns, labels):
+        self.vectorizer.fit(texts)
+        self.model.fit(self._features(texts, turns), labels)
+        return self
+
+    def predict_many(self, texts, turns):
+        """
+        Returns:
+            list: 每条输入的 (标签, 该标签的概率)
+        """
+        probabilities = self.model.predict_proba(self._features(texts, turns))
+        return [(self.model.classes_[row.argmax()], float(row.max())) for row in probabilities]
+
+    def predict(self, text, turns):
+        return self.predict_many([text], [turns])[0]
+
+
+def evaluate(classifier, records, thresholds=None):
+    """
+    分类器与LLM判断的一致率
+
+    Returns:
+        dict: 全部记录的一致率，以及每个阈值下转交LLM的比例和本地回答的一致率
+    """
+    predictions = classifier.predict_many([record['text'] for record in records], [record['turns'] for record in records])
+    agree = [label == record['label'] for (label, _), record in zip(predictions, records)]
+    result = {'records': len(records), 'agreement': sum(agree) / len(records), 'thresholds': {}}
+    for threshold in thresholds or THRESHOLDS:
+        local = [same for same, (_, probability) in zip(agree, predictions) if probability >= threshold]
+        result['thresholds'][threshold] = {
+            'deferral_rate': 1 - len(local) / len(records),
+            'local_agreement': sum(local) / len(local) if local else None,
+        }
+    return result
+
+
+def train(records, test_fraction=0.2, seed=0):
+    """
+    在一类判断的记录上训练分类器：先在留出集上评估，再用全部记录重新训练
+
+    Returns:
+        tuple: (JudgeClassifier, 留出集上的评估结果)，记录不足或只有一种标签时返回 (None, 原因)
+    """
+    labels = {record['label'] for record in records}
+    if len(labels) < 2:
+        return None, f"只有 {len(records)} 条记录、{len(labels)} 种标签"
+    shuffled = list(records)
+    random.Random(seed).shuffle(shuffled)
+    split = max(1, int(len(shuffled) * test_fraction))
+    train_records, test_records = shuffled[split:], shuffled[:split]
+    report = None
+    if len({record['label'] for record in train_records}) == 2:
+        classifier = JudgeClassifier().fit([record['text'] for record in train_records],
+                                           [record['turns'] for record in train_records],
+                                           [record['label'] for record in train_records])
+        report = evaluate(classifier, test_records)
+    classifier = JudgeClassifier().fit([record['text'] for record in records],
+                                       [record['turns'] for record in records],
+                                       [record['label'] for record in records])
+    return classifier, report
+
+
+def model_path(name, model_dir=None):
+    return os.path.join(model_dir or PathConfig.JUDGE_MODEL_DIR, name + '.pkl')
+
+
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+
+def load_classifier(name):
+    """加载某类判断的分类器（缓存），没有训练好的模型时返回None"""
+    with _classifiers_lock:
+        if name not in _classifiers:
+            path = model_path(name)
+            classifier = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    classifier = pickle.load(f)
+            _classifiers[name] = classifier
+        return _classifiers[name]
+
+
+class JudgeStats:
+    """线程安全的本地判断统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def record(self, name, outcome, agree=None):
+        """
+        Args:
+            name (str): 判断类型
+            outcome (str): 'local'（本地回答）、'shadow'（本地回答并同时调用LLM）、'deferred'（置信度不足转交LLM）、'no_model'
+            agree (bool, optional): shadow/deferred 时本地预测与LLM是否一致
+        """
+        with self.lock:
+            entry = self.entries.setdefault(name, {'local': 0, 'shadow': 0, 'deferred': 0, 'no_model': 0,
+                                                   'shadow_agree': 0, 'deferred_agree': 0})
+            entry[outcome] += 1
+            if agree:
+                entry[outcome + '_agree'] += 1
+
+    def summary(self):
+        """各类判断的调用数、转交比例、本地回答与LLM的一致率（由shadow估计）和转交判断上的一致率"""
+        with self.lock:
+            result = {}
+            for name, entry in self.entries.items():
+                local = entry['local'] + entry['shadow']
+                calls = local + entry['deferred'] + entry['no_model']
+                result[name] = {
+                    'calls': calls,
+                    'local': local,
+                    'deferral_rate': (entry['deferred'] + entry['no_model']) / calls if calls else None,
+                    'local_agreement': entry['shadow_agree'] / entry['shadow'] if entry['shadow'] else None,
+                    'deferred_agreement': entry['deferred_agree'] / entry['deferred'] if entry['deferred'] else None,
+                }
+            return result
+
+
+JUDGE_STATS = JudgeStats()
+JUDGE_LOG = JudgeLog()
+
+
+def shadow_sample(text):
+    """由输入文本确定是否同时调用LLM，录制和回放时选择相同"""
+    return zlib.crc32(text.encode('utf-8')) / 2 ** 32 < SystemConfig.JUDGE_SHADOW_RATE
+
+
+def judge(name, text, turns, call):
+    """
+    先由本地分类器回答，置信度不足或没有模型时调用LLM
+
+    Args:
+        name (str): 判断类型（见 JUDGES）
+        text (str): 判断的输入文本
+        turns (int): 轮数特征
+        call (callable): 调用LLM判断，返回 (标签, 概率, token数)
+
+    Returns:
+        tuple: (标签, 概率, token数)，本地回答时token数为0
+    """
+    classifier = load_classifier(name) if SystemConfig.JUDGE_DISTILL else None
+    local = None
+    if classifier is not None:
+        local = classifier.predict(text, turns)
+        if local[1] >= SystemConfig.JUDGE_LOCAL_THRESHOLD and not shadow_sample(text):
+            JUDGE_STATS.record(name, 'local')
+            return local[0], local[1], [0, 0, 0]
+
+    label, probability, tokens = call()
+    if SystemConfig.JUDGE_LOG:
+        JUDGE_LOG.record(name, text, turns, label, probability)
+    if SystemConfig.JUDGE_DISTILL:
+        if local is None:
+            JUDGE_STATS.record(name, 'no_model')
+        else:
+            outcome = 'shadow' if local[1] >= SystemConfig.JUDGE_LOCAL_THRESHOLD else 'deferred'
+            JUDGE_STATS.record(name, outcome, local[0] == label)
+            if outcome == 'shadow':
+                # 抽样检查时仍使用本地回答，与未抽样时的行为一致
+                return local[0], local[1], tokens
+    return label, probability, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description='训练和评估判断类调用的本地分类器')
+    parser.add_argument('command', choices=['train', 'evaluate'])
+    parser.add_argument('--log', default=PathConfig.JUDGE_LOG_PATH, help='判断记录（JSONL）')
+    parser.add_argument('--output', '--models', dest='models', default=PathConfig.JUDGE_MODEL_DIR, help='模型目录')
+    parser.add_argument('--test-fraction', type=float, default=0.2, help='训练时留出评估的比例')
+    args = parser.parse_args()
+
+    records = read_log(args.log)
+    reports = {}
+    for name in JUDGES:
+        if name not in records:
+            continue
+        if args.command == 'train':
+            classifier, report = train(records[name], args.test_fraction)
+            if classifier is None:
+                print(f"{name}: 跳过（{report}）")
+                continue
+            os.makedirs(args.models, exist_ok=True)
+            with open(model_path(name, args.models), 'wb') as f:
+                pickle.dump(classifier, f)
+            print(f"{name}: 使用 {len(records[name])} 条记录训练，已保存到 {model_path(name, args.models)}")
+        else:
+            path = model_path(name, args.models)
+            if not os.path.exists(path):
+                print(f"{name}: 没有模型 {path}")
+                continue
+            with open(path, 'rb') as f:
+                report = evaluate(pickle.load(f), records[name])
+        reports[name] = report
+    print(json.dumps(reports, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    # 通过模块名运行，pickle保存的分类器引用 judge_distill.JudgeClassifier 而不是 __main__
+    import judge_distill
+    judge_distill.main()
@@ -1,123 +1,390 @@
 import os
-import pandas as pd
 import json
+import math
+import threading
+import time
 from openai import OpenAI
+import transcript
 from config import APIConfig, ModelConfig, SystemConfig
 # Set OpenAI's API key and API base to use vLLM's API server.
 
+def model_pricing(model_name):
+    """按模型名称（或模型路径的最后一段）查找每token价格，未配置的模型（如本地部署）使用默认价格"""
+    pricing = ModelConfig.PRICING
+    return pricing.get(model_name) or pricing.get(model_name.split('/')[-1]) or ModelConfig.DEFAULT_PRICING
+
+def token_cost(model_name, prompt_token_num, generate_token_num, cached_token_num=0):
+    """计算一次调用的花费，命中缓存的输入token按缓存价格计算"""
+    price = model_pricing(model_name)
+    return (prompt_token_num - cached_token_num) * price['input'] + cached_token_num * price['cached_input'] + generate_token_num * price['output']
+
+def usage_tokens(chat_response):
+    """返回一次调用的 [输入token数, 输出token数, 命中缓存的输入token数]"""
+    usage = chat_response.usage
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) or 0
+    return [usage.prompt_tokens, usage.completion_tokens, cached]
+
+class CostLedger:
+    """线程安全的花费账本，按调用类型累计token数和花费"""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def record(self, call_type, model_name, tokens, price_scale=1):
+        """price_scale 为价格系数，如批处理接口的折扣"""
+        prompt_token_num, generate_token_num, cached_token_num = (list(tokens) + [0])[:3]
+        cost = token_cost(model_name, prompt_token_num, generate_token_num, cached_token_num) * price_scale
+        with self.lock:
+            entry = self.entries.setdefault(call_type, {'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0, 'cost': 0})
+            entry['calls'] += 1
+            entry['prompt_tokens'] += prompt_token_num
+            entry['cached_tokens'] += cached_token_num
+            entry['completion_tokens'] += generate_token_num
+            entry['cost'] += cost
+        return cost
+
+    def get_cost(self):
+        with self.lock:
+            return sum(entry['cost'] for entry in self.entries.values())
+
+    def summary(self):
+        with self.lock:
+            return {call_type: dict(entry) for call_type, entry in self.entries.items()}
+
+# 不属于医生/患者对话的辅助调用（信息提取、背景故事生成等）的花费
+AUX_LEDGER = CostLedger()
+
+class DialogueHistory(list):
+    """
+    缓存渲染结果的对话历史，只通过 append 追加发言
+    每句发言的repr在追加时计算一次，render 的结果与 str(history[-last:]) 相同
+    """
+    def __init__(self, iterable=()):
+        super().__init__(iterable)
+        self.reprs = [repr(item) for item in self]
+
+    def append(self, item):
+        super().append(item)
+        self.reprs.append(repr(item))
+
+    def render(self, last=None):
+        reprs = self.reprs if last is None else self.reprs[max(len(self.reprs) - last, 0):]
+        return '[' + ', '.join(reprs) + ']'
+
+def render_history(history, last=None):
+    """将对话历史（或其最后last句）渲染为提示词中使用的字符串"""
+    if isinstance(history, DialogueHistory):
+        return history.render(last)
+    return str(history if last is None else history[-last:])
+
+def log(*args):
+    """输出每句发言和调试信息，SystemConfig.QUIET 为True时不输出"""
+    if not SystemConfig.QUIET:
+        print(*args)
+
+def percentile(values, q):
+    """按最近秩计算分位数，values 为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+class StreamStats:
+    """线程安全的流式生成延迟统计，按角色记录首token时间（TTFT）、token间隔和提前停止次数"""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def record(self, role, ttft, gaps, stop_reason):
+        with self.lock:
+            entry = self.entries.setdefault(role, {'calls': 0, 'ttft': [], 'gaps': [], 'early_stops': {}})
+            entry['calls'] += 1
+            if ttft is not None:
+                entry['ttft'].append(ttft)
+            entry['gaps'].extend(gaps)
+            if stop_reason:
+                entry['early_stops'][stop_reason] = entry['early_stops'].get(stop_reason, 0) + 1
+
+    def summary(self):
+        """各角色的调用次数、TTFT和token间隔的均值/p50/p95（秒），以及各类提前停止的次数"""
+        with self.lock:
+            result = {}
+            for role, entry in self.entries.items():
+                result[role] = {'calls': entry['calls'], 'early_stops': dict(entry['early_stops'])}
+                for name in ('ttft', 'gaps'):
+                    values = entry[name]
+                    result[role][name] = {
+                        'mean': sum(values) / len(values) if values else None,
+                        'p50': percentile(values, 50),
+                        'p95': percentile(values, 95),
+                    }
+            return result
+
+# 医生/患者流式生成的延迟统计
+STREAM_STATS = StreamStats()
+
+def stream_stop(text, role):
+    """
+    检查流式生成是否应提前停止
+
+    Args:
+        text (str): 已生成的内容
+        role (str): 调用角色，用于查找 SystemConfig.STREAM_MAX_CHARS 中的长度上限
+
+    Returns:
+        tuple or None: 需要停止时返回 (截断后的内容, 停止原因)
+    """
+    # 思考内容（<think>...</think>）中的空行和长度不计入
+    if '<think>' in text and '</think>' not in text:
+        return None
+    visible = text.split('</think>', 1)[-1].lstrip('\n')
+    prefix = text[:len(text) - len(visible)]
+
+    if SystemConfig.STREAM_STOP_ON_BLANK_LINE and '\n\n' in visible:
+        return prefix + visible.split('\n\n')[0], 'blank_line'
+    max_chars = SystemConfig.STREAM_MAX_CHARS.get(role)
+    if max_chars is not None and len(visible) > max_chars:
+        visible = visible[:max_chars]
+        # 尽量在句末截断
+        cut = max(visible.rfind(mark) for mark in '。！？!?')
+        if cut > 0:
+            visible = visible[:cut + 1]
+        return prefix + visible, 'max_chars'
+    return None
+
+def chat_completion(client, role, **kwargs):
+    """
+    医生/患者的对话补全调用
+
+    SystemConfig.STREAMING 为True时使用流式生成，记录首token时间和token间隔，
+    并在出现空行或超过该角色的最大字数时提前停止（关闭连接，服务端随之停止生成）。
+    提前停止时服务端不会返回usage，输出token数按收到的chunk数计，输入token数按消息字数估算
+
+    Args:
+        client: OpenAI客户端
+        role (str): 调用角色（'doctor'、'patient'、'roleplay_doctor'、'roleplay_patient'）
+        **kwargs: 传给 chat.completions.create 的参数
+
+    Returns:
+        tuple: (回复内容, [输入token数, 输出token数, 命中缓存的输入token数])
+    """
+    if not SystemConfig.STREAMING:
+        chat_response = client.chat.completions.create(**kwargs)
+        return chat_response.choices[0].message.content, usage_tokens(chat_response)
+
+    start = time.perf_counter()
+    stream = client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **kwargs)
+    text = ''
+    chunks = 0
+    usage = None
+    ttft = last = None
+    gaps = []
+    stop_reason = None
+    try:
+        for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = usage_tokens(chunk)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            now = time.perf_counter()
+            if ttft is None:
+                ttft = now - start
+            else:
+                gaps.append(now - last)
+            last = now
+            chunks += 1
+            text += chunk.choices[0].delta.content
+            stop = stream_stop(text, role)
+            if stop is not None:
+                text, stop_reason = stop
+                break
+    finally:
+        if stop_reason is not None:
+            stream.close()
+    STREAM_STATS.record(role, ttft, gaps, stop_reason)
+    if usage is None:
+        usage = [sum(len(message['content']) for message in kwargs['messages']), chunks, 0]
+    return text, usage
+
+def chat_completion_n(client, role, n, **kwargs):
+    """
+    一次请求生成n个回复（不使用流式生成），用于批量预取请求消息相同的开场提问
+    SystemConfig.STREAMING 为True时按流式生成的提前停止规则截断每个回复，输出与逐个流式生成的一致
+
+    Args:
+        client: OpenAI客户端
+        role (str): 调用角色
+        n (int): 回复数
+        **kwargs: 传给 chat.completions.create 的参数
+
+    Returns:
+        tuple: (回复内容列表, 合计的 [输入token数, 输出token数, 命中缓存的输入token数])，
+               不支持n参数的服务可能返回少于n个回复
+    """
+    chat_response = client.chat.completions.create(n=n, **kwargs)
+    contents = []
+    for choice in sorted(chat_response.choices, key=lambda choice: choice.index):
+        content = choice.message.content
+        stop = stream_stop(content, role) if SystemConfig.STREAMING else None
+        contents.append(content if stop is None else stop[0])
+    return contents, usage_tokens(chat_response)
+
 class DoctorCost:
     def __init__(self, model_name) -> None:
         self.model_name = model_name
-        self.input_cost = ModelConfig.GPT4_INPUT_COST
-        self.output_cost = ModelConfig.GPT4_OUTPUT_COST
         self.total_cost = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
 
-    def money_cost(self, prompt_token_num, generate_token_num):
-        if self.model_name == ModelConfig.GPT4_MODEL_NAME:
-            self.total_cost += prompt_token_num * self.input_cost + generate_token_num * self.output_cost
+    def money_cost(self, prompt_token_num, generate_token_num, cached_token_num=0, call_type=None):
+        """call_type 为调用类型时按 ModelConfig.ROUTES 中该类调用使用的模型计价"""
+        model_name = self.model_name if call_type is None else routed_model(call_type, self.model_name)
+        self.prompt_tokens += prompt_token_num
+        self.completion_tokens += generate_token_num
+        self.total_cost += token_cost(model_name, prompt_token_num, generate_token_num, cached_token_num)
 
     def get_cost(self):
         return self.total_cost
+
+    def get_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
     
 class PatientCost:
     def __init__(self, model_name) -> None:
         self.model_name = model_name
-        self.input_cost = ModelConfig.GPT4_INPUT_COST
-        self.output_cost = ModelConfig.GPT4_OUTPUT_COST
         self.total_cost = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
 
-    def money_cost(self, prompt_token_num, generate_token_num):
-        if self.model_name == ModelConfig.GPT4_MODEL_NAME:
-            self.total_cost += prompt_token_num * self.input_cost + generate_token_num * self.output_cost
+    def money_cost(self, prompt_token_num, generate_token_num, cached_token_num=0, call_type=None):
+        """call_type 为调用类型时按 ModelConfig.ROUTES 中该类调用使用的模型计价"""
+        model_name = self.model_name if call_type is None else routed_model(call_type, self.model_name)
+        self.prompt_tokens += prompt_token_num
+        self.completion_tokens += generate_token_num
+        self.total_cost += token_cost(model_name, prompt_token_num, generate_token_num, cached_token_num)
     
     def get_cost(self):
         return self.total_cost
 
+    def get_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
 
-def gpt4_client_init():
-    openai_api_key = APIConfig.OPENAI_API_KEY #enter your apikey here
-    client = OpenAI(
-        api_key=openai_api_key,
-        base_url=APIConfig.OPENAI_BASE_URL
+def local_model_init(model_path):
+    # 只有使用本地推理（use_api=False）时才导入torch和transformers，API模式不承担其导入耗时和内存
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path,
+        torch_dtype=torch.bfloat16,
+        device_map="auto"
     )
-    return client
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    return model, tokenizer
 
-def qwen_client_init():
-    openai_api_key = APIConfig.LOCAL_API_KEY #enter your apikey here
-    openai_api_base = APIConfig.LOCAL_BASE_URL #api
+def route(call_type, model_name):
+    """
+    按 ModelConfig.ROUTES 确定某类调用使用的模型和服务地址
 
-    client = OpenAI(
-        api_key=openai_api_key,
-        base_url=openai_api_base,
-    )
-    return client
+    Args:
+        call_type (str): 调用类型（'doctor_reply'、'topic_end'、'extraction' 等，见 ModelConfig.ROUTES）
+        model_name (str): 调用方的模型，该类调用没有配置路由或路由中没有 'model' 时使用
 
-def tool_client_init(model_name):
-    if 'gpt' in model_name:
-        client = gpt4_client_init()
+    Returns:
+        dict: {'model': 模型名称, 'base_url': 服务地址, 'api_key': API Key, 'backend': 'api' 或 'cpu'}
+    """
+    entry = ModelConfig.ROUTES.get(call_type) or {}
+    model = entry.get('model') or model_name
+    if 'gpt' in model:
+        base_url, api_key = APIConfig.OPENAI_BASE_URL, APIConfig.OPENAI_API_KEY
     else:
-        client = qwen_client_init()
-    return client
+        base_url, api_key = APIConfig.LOCAL_BASE_URL, APIConfig.LOCAL_API_KEY
+    return {'model': model, 'base_url': entry.get('base_url') or base_url, 'api_key': entry.get('api_key') or api_key,
+            'backend': entry.get('backend') or 'api'}
+
+def routed_model(call_type, model_name):
+    """某类调用实际使用的模型名称"""
+    return route(call_type, model_name)['model']
+
+def routed_client(call_type, model_name):
+    """
+    创建某类调用使用的客户端
+
+    Returns:
+        tuple: (模型名称, OpenAI客户端)
+    """
+    target = route(call_type, model_name)
+    if target['backend'] == 'cpu':
+        # 本进程内的CPU量化推理，只在使用时导入 onnxruntime 和 transformers
+        import cpu_backend
+        return target['model'], transcript.wrap_client(lambda: cpu_backend.CpuChatClient(target['model']))
+    return target['model'], transcript.wrap_client(lambda: OpenAI(
+        api_key=target['api_key'],
+        base_url=target['base_url']
+    ))
 
 def doctor_client_init(model_name):
-    if 'gpt' in model_name:
-        client = gpt4_client_init()
-    else:
-        client = qwen_client_init()
-    return client
+    """医生回复使用的客户端，模型名称为 routed_model('doctor_reply', model_name)"""
+    return routed_client('doctor_reply', model_name)[1]
 
 def patient_client_init(model_name):
-    if 'gpt' in model_name:
-        client = gpt4_client_init()
-    else:
-        client = qwen_client_init()
-    return client
+    """患者回复使用的客户端，模型名称为 routed_model('patient_reply', model_name)"""
+    return routed_client('patient_reply', model_name)[1]
 
-def api_load_for_extraction(model_name, input_sentence):    #extract kv pair
+def completion_text(chat_response):
+    """返回调用的回复内容"""
+    response = chat_response.choices[0].message.content
+    
+    # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
+    if not response:
+        response = getattr(chat_response.choices[0].message, 'reasoning_content', None)
+        
+    return response
+
+def extraction_request(model_name, input_sentence):
+    """信息提取调用的请求参数，同步调用和批处理文件（见 batch_jobs.py）共用"""
     messages = []
-    client = tool_client_init(model_name)
     example = {"孕产情况":"足月顺产",
                 "发育情况":"正常"}
     prompt = f'提取文本中所有形如A：B的键值对，以json格式输出，不允许输出其他文字！文本：{input_sentence}'
     messages.extend([{"role": "system", "content": "/no_think 你是一个功能强大的助手，可以处理各种文本任务"},
                 {"role": "user", "content": prompt}])
-    chat_response = client.chat.completions.create(
-        model=model_name,
+    return dict(
+        model=routed_model('extraction', model_name),
         messages=messages,
         response_format={"type": "json_object"},
         temperature=SystemConfig.DEFAULT_TEMPERATURE
     )
+
+def api_load_for_extraction(model_name, input_sentence):    #extract kv pair
+    model_name, client = routed_client('extraction', model_name)
+    chat_response = client.chat.completions.create(**extraction_request(model_name, input_sentence))
     
-    response = chat_response.choices[0].message.content
-    
-    # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
-    if not response:
-        response = chat_response.choices[0].message.reasoning_content
-        
-    return response
+    AUX_LEDGER.record('extraction', model_name, usage_tokens(chat_response))
+    return completion_text(chat_response)
 
-def api_load_for_background_gen(model_name, input_sentence):    #background story generation
+def background_gen_request(model_name, input_sentence):
+    """背景故事生成调用的请求参数，同步调用和批处理文件（见 batch_jobs.py）共用"""
     messages = []
-    client = tool_client_init(model_name)
     prompt = "输入文本是关于精神疾病患者的基本状况和过去经历的关键词，发挥想象力，根据这些信息以第一人称编写一个故事，完整讲述患者过去的经历，这段经历是患者出现精神疾病的主要原因。\n要求1.输出一整段故事，扩充事件的起因、经过、结果，不要使用比喻句，不要使用浮夸的表述。2.不要输出虚拟的患者姓名。3.不允许输出类似“我正在努力走出阴影”，“在医生的指导下”，只需要输出虚构的故事。\n ###输入文本如下：{}".format(input_sentence)
     messages.extend([{"role": "system", "content": "/no_think 你是一个功能强大，想象力丰富的文本助手，非常善于写故事"},
                 {"role": "user", "content": prompt}])
-    chat_response = client.chat.completions.create(
-        model=model_name,
+    return dict(
+        model=routed_model('background_gen', model_name),
         messages=messages,
         top_p=SystemConfig.DEFAULT_TOP_P
     )
-    response = chat_response.choices[0].message.content
-    
-    # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
-    if not response:
-        response = chat_response.choices[0].message.reasoning_content
-        
-    return response
+
+def api_load_for_background_gen(model_name, input_sentence):    #background story generation
+    model_name, client = routed_client('background_gen', model_name)
+    chat_response = client.chat.completions.create(**background_gen_request(model_name, input_sentence))
+    AUX_LEDGER.record('background_gen', model_name, usage_tokens(chat_response))
+    return completion_text(chat_response)
 
 def api_background_exist(model_name, input_sentence):    #check if background already exists
     messages = []
-    client = tool_client_init(model_name)
+    model_name, client = routed_client('background_exist', model_name)
     prompt = "你需要判断输入内容中是否包含了患者过去的经历，这段经历直接或者间接导致了患者出现精神疾病。\n\n###输入文本如下：{}".format(input_sentence)
     messages.extend([{"role": "system", "content": "/no_think 你是一个功能强大的文本助手，非常善于写故事"},
                 {"role": "user", "content": prompt}])
@@ -128,6 +395,7 @@ def api_background_exist(model_name, input_sentence):    #check if background al
         top_p=SystemConfig.DEFAULT_TOP_P,
         temperature=SystemConfig.DEFAULT_TEMPERATURE
     )
+    AUX_LEDGER.record('background_exist', model_name, usage_tokens(chat_response))
     response = chat_response.choices[0].message.content
     
     # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
@@ -136,28 +404,119 @@ def api_background_exist(model_name, input_sentence):    #check if background al
         
     return response
 
-def api_dialogue_state(model_name, input_sentence):
-    messages = []
-    client = tool_client_init(model_name)
-    prompt = input_sentence
-    messages.extend([{"role": "system", "content": "/no_think 你是一个功能强大的文本助手，擅长处理各种文本问题"},
-                {"role": "user", "content": prompt}])
+def judge_probabilities(chat_response, labels):
+    """
+    由第一个输出token的 top_logprobs 计算各候选标签的概率
+
+    只在候选标签之间重新归一化，没有经过校准（与标注数据上的实际正确率不一定一致），
+    不在 top_logprobs 中的标签概率为0
+
+    Returns:
+        dict or None: {标签: 概率}，服务端没有返回logprobs或候选标签都不在其中时返回None
+    """
+    logprobs = getattr(chat_response.choices[0], 'logprobs', None)
+    content = getattr(logprobs, 'content', None)
+    if not content:
+        return None
+    scores = {}
+    for item in content[0].top_logprobs:
+        token = item.token.strip()
+        for label in labels:
+            # top_logprobs 按概率从高到低排列，同一标签只取第一个匹配（标签可能被切分为多个token）
+            if token and label not in scores and label.startswith(token):
+                scores[label] = item.logprob
+    if not scores:
+        return None
+    top = max(scores.values())
+    weights = {label: math.exp(score - top) for label, score in scores.items()}
+    total = sum(weights.values())
+    return {label: weights.get(label, 0) / total for label in labels}
+
+def api_judge(call_type, model_name, system_prompt, prompt, labels, default, temperature):
+    """
+    判断类调用，答案为 labels 中的一个
+
+    SystemConfig.JUDGE_MODE 为 'single_token' 且模型支持 guided_choice（本地部署的vLLM、CPU后端）时，
+    通过 guided_choice 限定输出为候选标签、通过 chat_template_kwargs 关闭思考模式，只生成1个token并请求logprobs；
+    其他情况（包括 'text' 模式和OpenAI模型）与原来一样生成完整回复后按标签顺序匹配：
+    不限定输出时模型常以引号等开头，单个token得不到标签
+
+    Args:
+        call_type (str): 调用类型，按 ModelConfig.ROUTES 选择模型
+        model_name (str): 调用方的模型名称
+        system_prompt (str): 系统提示词
+        prompt (str): 判断提示词
+        labels (list): 候选标签，均为单个token（如“是”/“否”、“True”/“None”），text模式下按此顺序匹配
+        default (str): 完整回复中没有任何候选标签时使用的标签（会输出警告）
+        temperature (float): 采样温度
+
+    Returns:
+        tuple: (标签, 该标签的概率（没有logprobs时为None）, [输入token数, 输出token数, 命中缓存的输入token数])
+    """
+    model_name, client = routed_client(call_type, model_name)
+    messages = [{"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}]
+
+    if SystemConfig.JUDGE_MODE == 'text' or 'gpt' in model_name:
+        chat_response = client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature
+        )
+        response = chat_response.choices[0].message.content
+        # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
+        if not response:
+            response = chat_response.choices[0].message.reasoning_content or ''
+        label = next((label for label in labels if label in response), None)
+        if label is None:
+            print(f"判断调用 {call_type} 的回复中没有候选标签 {labels}，使用 {default}: {response!r}")
+            label = default
+        return label, None, usage_tokens(chat_response)
+
+    extra_body = {'guided_choice': list(labels), 'chat_template_kwargs': {'enable_thinking': False}}
     chat_response = client.chat.completions.create(
         model=model_name,
         messages=messages,
-        temperature=SystemConfig.DEFAULT_TEMPERATURE
+        temperature=temperature,
+        max_tokens=1,
+        logprobs=True,
+        top_logprobs=SystemConfig.JUDGE_TOP_LOGPROBS,
+        extra_body=extra_body
     )
-    response = chat_response.choices[0].message.content
-    
-    # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
-    if not response:
-        response = chat_response.choices[0].message.reasoning_content
-        
-    return response, [chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens]
+    response = (chat_response.choices[0].message.content or '').strip()
+    probabilities = judge_probabilities(chat_response, labels)
+    label = next((label for label in labels if response and label.startswith(response)), None)
+    if label is None:
+        if not probabilities:
+            # guided_choice 下不应出现，说明服务端没有限定输出
+            raise ValueError(f"判断调用 {call_type} 的输出 {response!r} 不是候选标签 {labels}，logprobs中也没有候选标签")
+        label = max(probabilities, key=probabilities.get)
+    return label, probabilities[label] if probabilities else None, usage_tokens(chat_response)
+
+def distilled_judge(name, text, turns, call):
+    """
+    判断类调用经过本地蒸馏分类器（见 judge_distill.py），未启用判断记录和本地分类器时直接调用 call()
+
+    Args:
+        name (str): 判断类型（'topic_end'、'experience_trigger'、'roleplay_end'）
+        text (str): 判断的输入文本
+        turns (int): 轮数特征
+        call (callable): 调用LLM判断，返回 (标签, 概率, token数)
+    """
+    if not (SystemConfig.JUDGE_LOG or SystemConfig.JUDGE_DISTILL):
+        return call()
+    import judge_distill
+    return judge_distill.judge(name, text, turns, call)
+
+def api_dialogue_state(model_name, input_sentence, turns=None):
+    """判断当前话题是否应该结束，返回 (“是”或“否”, 概率, token数)；turns 为当前话题的第几次判断，作为本地分类器的特征"""
+    return distilled_judge('topic_end', input_sentence, turns, lambda: api_judge(
+        'topic_end', model_name, "/no_think 你是一个功能强大的文本助手，擅长处理各种文本问题", input_sentence,
+        ['是', '否'], '是', SystemConfig.DEFAULT_TEMPERATURE))
 
 def api_parse_experience(model_name, input_sentence):
     messages = []
-    client = tool_client_init(model_name)
+    model_name, client = routed_client('parse_experience', model_name)
     prompt = "一名精神疾病患者与精神科医生的对话历史为：{}。根据患者对于自身情况的描述，想象作为一名医生会从哪几个角度进行进一步的询问。\n返回格式如下：以python列表的格式'''[]'''仅返回医生可能询问的角度，返回2-3个，并且以精炼简短的,口语化的语言概括。".format(input_sentence)
     messages.extend([{"role": "system", "content": "/no_think 你是一个专业的精神健康心理科医生，正在与一名精神疾病患者交流"},
                 {"role": "user", "content": prompt}])
@@ -173,26 +532,12 @@ def api_parse_experience(model_name, input_sentence):
     if not response:
         response = chat_response.choices[0].message.reasoning_content
         
-    return response, [chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens]
+    return response, usage_tokens(chat_response)
 
 def api_topic_detection(model_name, input_sentence):
-    messages = []
-    client = tool_client_init(model_name)
-    prompt = input_sentence
-    messages.extend([{"role": "system", "content": "/no_think 你是一个功能强大的文本助手，擅长处理各种文本问题"},
-                {"role": "user", "content": prompt}])
-    chat_response = client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        temperature=1
-    )
-    response = chat_response.choices[0].message.content
-    
-    # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
-    if not response:
-        response = chat_response.choices[0].message.reasoning_content
-        
-    return response, [chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens]
+    """判断话题是否已被覆盖，返回 (“是”或“否”, 概率, token数)"""
+    return api_judge('topic_detection', model_name, "/no_think 你是一个功能强大的文本助手，擅长处理各种文本问题", input_sentence,
+                     ['否', '是'], '否', 1)
 
 def load_background_story(path):
     with open(path, 'r') as f:
@@ -200,27 +545,15 @@ def load_background_story(path):
     return story
 
 def api_patient_experience_trigger(model_name, dialogue_history, path):    #返回生成的背景故事
-    messages = []
-    client = tool_client_init(model_name)
     prompt = "根据患者和医生的对话历史：{}，判断患者现在是否应该说出导致自己出现精神疾病的过去经历，如果应该说出，则输出“True”，否则返回”None“。".format(dialogue_history)
-    messages.extend([{"role": "system", "content": "/no_think 你是一名精神疾病患者，正在与一位专业的精神健康心理科医生交流。"},
-                {"role": "user", "content": prompt}])
-    chat_response = client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        temperature=0.8
-    )
-    response = chat_response.choices[0].message.content
-    
-    # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
-    if not response:
-        response = chat_response.choices[0].message.reasoning_content
-        
-    if 'True' in response:
+    label, _, tokens = distilled_judge('experience_trigger', prompt, len(dialogue_history), lambda: api_judge(
+        'experience_trigger', model_name, "/no_think 你是一名精神疾病患者，正在与一位专业的精神健康心理科医生交流。", prompt,
+        ['True', 'None'], 'None', 0.8))
+    if label == 'True':
         response = load_background_story(path)
-        return response[0], [chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens]
+        return response[0], tokens
     else:
-        return None, [chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens]
+        return None, tokens
     
 def api_isroleplay_end(model_name, input_sentence):
     if input_sentence == []:
@@ -228,25 +561,8 @@ def api_isroleplay_end(model_name, input_sentence):
     elif len(input_sentence) > 22:
         return True
     else:
-        messages = []
-        client = tool_client_init(model_name)
-        prompt = '一段精神科医生与精神疾病患者之间的诊断对话历史如下:{}，请判断诊断是否应该结束，如果应该结束请返回“是”，如果应该继续请返回“否。”'.format(input_sentence)
-        messages.extend([{"role": "system", "content": "/no_think 你是一个功能强大的文本助手，擅长处理各种文本问题"},
-                    {"role": "user", "content": prompt}])
-        chat_response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            temperature=0.6
-        )
-        response = chat_response.choices[0].message.content
-        
-        # 如果response为空，则使用reasoning_content (##BUG: reasoning_content 中会有结果)
-        if not response:
-            response = chat_response.choices[0].message.reasoning_content
-            
-        if '是' in response:
-            return True
-        elif '否' in response:
-            return False
-        else:
-            return True
\ No newline at end of file
+        prompt = '一段精神科医生与精神疾病患者之间的诊断对话历史如下:{}，请判断诊断是否应该结束，如果应该结束请返回“是”，如果应该继续请返回“否。”'.format(render_history(input_sentence))
+        label, _, _ = distilled_judge('roleplay_end', prompt, len(input_sentence), lambda: api_judge(
+            'topic_end', model_name, "/no_think 你是一个功能强大的文本助手，擅长处理各种文本问题", prompt,
+            ['是', '否'], '是', 0.6))
+        return label == '是'
@@ -1,15 +1,23 @@
 from doctor import Doctor
 from patient import Patient
 from diagtree import DiagTree
+from budget import ConversationBudget, RunGovernor
+import llm_tools_api
+import transcript
+import argparse
 import json
 import os
+import random
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import socket
 import threading
+import time
+from collections import Counter
 from config import (
     get_model_name, get_patient_info_path, get_doctor_prompt_path,
     get_diagtree_path, get_output_dir, get_background_story_dir,
-    SystemConfig
+    SystemConfig, PathConfig, ensure_dirs_exist
 )
 
 # 取消设置代理相关的环境变量
@@ -36,65 +44,186 @@ MODEL_NAME = get_model_name()
 NUM = SystemConfig.NUM_CONVERSATIONS
 OUTPUT_DATASYN_PATH = get_output_dir()
 OUTPUT_PASTEXP_PATH = get_background_story_dir()
+OUTPUT_COLUMNAR_PATH = PathConfig.COLUMNAR_OUTPUT_DIR
+OUTPUT_ARCHIVE_PATH = PathConfig.ARCHIVE_OUTPUT_DIR
 
 # 用于线程安全的成本累计
 cost_lock = threading.Lock()
 total_cost = 0
 
+# 使用压缩分片归档存储时的共享写入器
+archive_writer = None
+
+# 增量构建的近重复检测索引
+dedup_index = None
+
+# 各类预算被触发的次数
+budget_hits = Counter()
+
+# 整个运行的花费控制器
+governor = None
+
+# 开场提问的批量预取器
+opening_prefetcher = None
+
+# 线程模式下状态接口使用的运行状态
+run_status = None
+
+# 对话分叉的统计：分叉对话数和复用的轮数
+fork_stats = Counter()
+
+def run_conversation(patient_template, i, doc, pat, state=None, fork_points=None):
+    """
+    生成单个患者的第i个对话
+
+    Args:
+        state (dict, optional): 分叉对话从该状态继续生成（见 forking.py），doc 和 pat 为分叉点的副本
+        fork_points (dict, optional): 主干对话在 SystemConfig.FORK_ROUNDS 的各轮数处保存的 {轮数: ForkPoint}
+
+    Returns:
+        tuple: ({"conversation": [...]}，被截断时包含 "truncated"）, 按发言顺序记录的话题、token数和耗时)
+    """
+    budget = ConversationBudget()
+    truncated = None
+    name = conversation_name(patient_template['患者'], i)
+
+    def add_turn(topic, tokens, latency):
+        turn_meta.append({'topic': topic, 'tokens': tokens, 'latency': latency})
+        if run_status is not None:
+            run_status.turn(name, topic, tokens)
+
+    if state is not None:
+        dialogue_history, output_list, output_dict, turn_meta, current_topic = (
+            state['dialogue_history'], state['output_list'], state['output_dict'], state['turn_meta'], state['current_topic'])
+    else:
+        dialogue_history = []
+        output_list = []
+        output_dict = {}
+        turn_meta = []
+        current_topic = '患者的精神状况'
+        start_time, start_tokens = time.perf_counter(), doc.get_tokens()
+        doctor_response = doc.doctor_response_gen(None, None)
+        add_turn(current_topic, doc.get_tokens() - start_tokens, time.perf_counter() - start_time)
+        output_dict['doctor'] = doctor_response
+        dialogue_history.append('医生：' + doctor_response)
+        llm_tools_api.log(f"患者{patient_template['患者']} 对话{i+1} - 医生：{doctor_response}")
+    
+    while True:
+        if fork_points is not None and len(output_list) in SystemConfig.FORK_ROUNDS and len(output_list) not in fork_points:
+            from forking import ForkPoint
+            fork_points[len(output_list)] = ForkPoint(len(output_list), doc, pat, {
+                'dialogue_history': dialogue_history, 'output_list': output_list, 'output_dict': output_dict,
+                'turn_meta': turn_meta, 'current_topic': current_topic})
+        start_time, start_tokens = time.perf_counter(), pat.get_tokens()
+        patient_response, _ = pat.patient_response_gen(current_topic, dialogue_history)
+        add_turn(current_topic, pat.get_tokens() - start_tokens, time.perf_counter() - start_time)
+        output_dict['patient'] = patient_response
+        dialogue_history.append('患者：' + patient_response)
+        output_list.append(output_dict)
+        output_dict = {}
+        llm_tools_api.log(f"患者{patient_template['患者']} 对话{i+1} - 患者：{patient_response}")
+
+        # 超出轮数、token或耗时预算时，直接以诊断结果结束对话
+        truncated = budget.exceeded(len(output_list), doc.get_tokens() + pat.get_tokens())
+        if truncated:
+            doctor_response = doc.diagnosis_message()
+            add_turn(None, 0, 0.0)
+            output_list.append({'doctor': doctor_response})
+            llm_tools_api.log(f"患者{patient_template['患者']} 对话{i+1} 超出预算（{truncated}），截断对话 - 医生：{doctor_response}")
+            break
+
+        start_time, start_tokens = time.perf_counter(), doc.get_tokens()
+        doctor_response, current_topic, _ = doc.doctor_response_gen(patient_response, dialogue_history)
+        add_turn(current_topic, doc.get_tokens() - start_tokens, time.perf_counter() - start_time)
+        
+        if '诊断结束，你的诊断结果' in doctor_response:
+            output_dict = {'doctor': doctor_response}
+            output_list.append(output_dict)
+            llm_tools_api.log(f"患者{patient_template['患者']} 对话{i+1} - 医生：{doctor_response}")
+            break
+        else:
+            dialogue_history.append('医生：' + doctor_response)
+            output_dict['doctor'] = doctor_response
+            llm_tools_api.log(f"患者{patient_template['患者']} 对话{i+1} - 医生：{doctor_response}")
+    
+    if truncated:
+        with cost_lock:
+            budget_hits[truncated] += 1
+        return {"conversation": output_list, "truncated": truncated}, turn_meta
+    return {"conversation": output_list}, turn_meta
+
+def conversation_name(patient_id, i):
+    """对话名，用于转录文件路径和对话种子"""
+    return 'patient_{}/conversation_{}'.format(patient_id, i)
+
+def prepare_doctor(patient_template, i):
+    """提前创建第i个对话的医生（预取开场提问时使用），返回 (Doctor, 对话种子)"""
+    seed = transcript.prepare_seed(conversation_name(patient_template['患者'], i))
+    return Doctor(patient_template, DOCTOR_PROMPT_PATH, DIAGTREE_PATH, MODEL_NAME, True, random.Random(seed)), seed
+
 def process_single_patient(patient_template):
-    """处理单个患者的对话生成"""
+    """
+    处理单个患者的对话生成
+
+    Returns:
+        tuple: (患者编号, 花费)，全部对话都因超出运行预算未开始时花费为None
+    """
     global total_cost
     
     patient_total_cost = 0
     total_output_list = []
+    total_turn_meta = []    # 每个对话按发言顺序记录的话题、token数和耗时
+    
+    # 已预取开场提问的医生（及其对话种子），分叉模式下只预取主干对话
+    prepared = opening_prefetcher.take(patient_template) if opening_prefetcher is not None else None
+    # 分叉模式下主干对话（第一个对话）保存的分叉点
+    fork_points = {} if SystemConfig.FORK_MODE else None
     
     for i in range(NUM):
-        dialogue_history = []
-        output_list = []
-        output_dict = {}
+        # 超出整个运行的花费预算时不再开始新的对话
+        if governor is not None and not governor.admit():
+            # 未使用的预取开场提问的花费记入辅助调用
+            for doc, _ in (prepared or [])[i:]:
+                if doc.opening_tokens is not None:
+                    llm_tools_api.AUX_LEDGER.record('unused_opening', doc.reply_model, doc.opening_tokens)
+            break
         story_path = os.path.join(OUTPUT_PASTEXP_PATH, 'patient_{}'.format(patient_template['患者']), 'story_{}.txt'.format(i+1))
+        doc = pat = output = fork = None
+        seed = prepared[i][1] if prepared and i < len(prepared) else None
+        if fork_points and i > 0:
+            from forking import select_fork
+            fork = select_fork(fork_points, i)
+        if run_status is not None:
+            run_status.start(conversation_name(patient_template['患者'], i), patient_template['患者'], i)
+        try:
+            with transcript.conversation(conversation_name(patient_template['患者'], i), seed) as rng:
+                if fork is not None:
+                    doc, pat, state = fork.branch(rng, story_path)
+                    output, turn_meta = run_conversation(patient_template, i, doc, pat, state)
+                    output['fork'] = {'conversation': 0, 'round': fork.round}
+                    fork_stats['branches'] += 1
+                    fork_stats['shared_rounds'] += fork.round
+                else:
+                    doc = prepared[i][0] if prepared and i < len(prepared) else Doctor(patient_template, DOCTOR_PROMPT_PATH, DIAGTREE_PATH, MODEL_NAME, True, rng)
+                    pat = Patient(patient_template, MODEL_NAME, True, story_path)
+                    output, turn_meta = run_conversation(patient_template, i, doc, pat, fork_points=fork_points if i == 0 else None)
+        finally:
+            conversation_cost = (doc.get_cost() if doc else 0) + (pat.get_cost() if pat else 0)
+            if fork is not None and doc is not None:
+                # 共享前缀的花费已计入主干对话
+                conversation_cost -= fork.base_cost
+            patient_total_cost += conversation_cost
+            if governor is not None:
+                governor.complete(conversation_cost)
+            if run_status is not None:
+                run_status.finish(conversation_name(patient_template['患者'], i), conversation_cost, failed=output is None)
+        total_output_list.append(output)
+        total_turn_meta.append(turn_meta)
 
-        doc = Doctor(patient_template, DOCTOR_PROMPT_PATH, DIAGTREE_PATH, MODEL_NAME, True)
-        pat = Patient(patient_template, MODEL_NAME, True, story_path)
-
-        doctor_response = doc.doctor_response_gen(None, None)
-        output_dict['doctor'] = doctor_response
-        dialogue_history.append('医生：' + doctor_response)
-        print(f"患者{patient_template['患者']} 对话{i+1} - 医生：{doctor_response}")
-        current_topic = '患者的精神状况'
-        
-        while True:
-            patient_response, patient_cost = pat.patient_response_gen(current_topic, dialogue_history)
-            output_dict['patient'] = patient_response
-            dialogue_history.append('患者：' + patient_response)
-            output_list.append(output_dict)
-            output_dict = {}
-            print(f"患者{patient_template['患者']} 对话{i+1} - 患者：{patient_response}")
-            doctor_response, current_topic, doctor_cost = doc.doctor_response_gen(patient_response, dialogue_history)
-            
-            if not doctor_cost:
-                doctor_cost = 0
-            if not patient_cost:
-                patient_cost = 0
-                
-            patient_total_cost += doctor_cost + patient_cost
-            
-            if '诊断结束，你的诊断结果' in doctor_response:
-                output_dict = {'doctor': doctor_response}
-                output_list.append(output_dict)
-                print(f"患者{patient_template['患者']} 对话{i+1} - 医生：{doctor_response}")
-                break
-            else:
-                dialogue_history.append('医生：' + doctor_response)
-                output_dict['doctor'] = doctor_response
-                print(f"患者{patient_template['患者']} 对话{i+1} - 医生：{doctor_response}")
-        
-        total_output_list.append({"conversation": output_list})
+    if not total_output_list:
+        return patient_template['患者'], None
 
-    # 保存单个患者的对话数据
-    output_file_path = os.path.join(OUTPUT_DATASYN_PATH, 'patient_{}.json'.format(patient_template['患者']))
-    with open(output_file_path, 'w') as f:
-        json.dump(total_output_list, f, indent=2, ensure_ascii=False)
+    save_patient_output(patient_template, total_output_list, total_turn_meta)
     
     # 线程安全地累计总成本
     with cost_lock:
@@ -102,17 +231,203 @@ def process_single_patient(patient_template):
     
     return patient_template['患者'], patient_total_cost
 
-def main():
+def save_patient_output(patient_template, total_output_list, total_turn_meta):
+    """保存单个患者的全部对话，并按配置更新近重复检测索引、写出列式数据"""
+    if archive_writer is not None:
+        archive_writer.add_patient(patient_template['患者'], total_output_list)
+    else:
+        output_file_path = os.path.join(OUTPUT_DATASYN_PATH, 'patient_{}.json'.format(patient_template['患者']))
+        with open(output_file_path, 'w') as f:
+            json.dump(total_output_list, f, indent=2, ensure_ascii=False)
+
+    if dedup_index is not None:
+        dedup_index.add_patient(patient_template['患者'], total_output_list)
+
+    # 同时写出列式数据（turns表和conversations表）
+    if SystemConfig.WRITE_COLUMNAR:
+        from columnar_export import write_patient_tables
+        write_patient_tables(OUTPUT_COLUMNAR_PATH, patient_template['患者'], total_output_list, patient_template, total_turn_meta)
+
+def queue_worker(queue_path, patient_info, output_paths, config_overrides=None):
+    """
+    队列模式的工作进程：每次从任务队列领取一个对话，生成期间定期续约，
+    某个患者的全部对话完成后写出该患者的对话数据
+
+    Args:
+        queue_path (str): 队列数据库路径
+        patient_info (list): 患者案例
+        output_paths (tuple): (对话输出目录, 列式输出目录)，分片时与默认目录不同
+        config_overrides (dict, optional): 命令行参数对 SystemConfig 的修改，工作进程不一定继承主进程的修改
+
+    Returns:
+        int: 本进程完成的对话数
+    """
+    global OUTPUT_DATASYN_PATH, OUTPUT_COLUMNAR_PATH
+    from work_queue import WorkQueue, LeaseKeeper
+
+    OUTPUT_DATASYN_PATH, OUTPUT_COLUMNAR_PATH = output_paths
+    for key, value in (config_overrides or {}).items():
+        setattr(SystemConfig, key, value)
+    queue = WorkQueue(queue_path)
+    worker = '{}-{}'.format(socket.gethostname(), os.getpid())
+    # 队列的 patient 列为 INTEGER，数字字符串编号取出时变为整数，统一按字符串查找
+    templates = {str(patient_template['患者']): patient_template for patient_template in patient_info}
+    finished = 0
+
+    while True:
+        # 队列中所有进程的总花费达到预算时不再领取新的对话
+        if SystemConfig.RUN_BUDGET is not None and queue.spent() >= SystemConfig.RUN_BUDGET:
+            print(f"进程 {worker}：已花费达到预算 {SystemConfig.RUN_BUDGET}，停止领取任务")
+            break
+        job = queue.claim(worker)
+        if job is None:
+            if queue.outstanding() == 0:
+                break
+            # 剩余任务都在其他进程中运行，等待其完成或租约过期
+            time.sleep(SystemConfig.QUEUE_POLL_SECONDS)
+            continue
+
+        patient_id, i = job
+        try:
+            patient_template = templates[str(patient_id)]
+            story_path = os.path.join(OUTPUT_PASTEXP_PATH, 'patient_{}'.format(patient_id), 'story_{}.txt'.format(i+1))
+            with LeaseKeeper(queue, patient_id, i, worker), \
+                    transcript.conversation(conversation_name(patient_id, i)) as rng:
+                doc = Doctor(patient_template, DOCTOR_PROMPT_PATH, DIAGTREE_PATH, MODEL_NAME, True, rng)
+                pat = Patient(patient_template, MODEL_NAME, True, story_path)
+                output, turn_meta = run_conversation(patient_template, i, doc, pat)
+        except Exception as exc:
+            print(f"患者 {patient_id} 对话{i+1} 生成时发生异常: {exc}")
+            queue.fail(patient_id, i, worker, exc)
+            continue
+
+        finished += 1
+        if queue.complete(patient_id, i, worker, doc.get_cost() + pat.get_cost(), {'output': output, 'turn_meta': turn_meta}):
+            results = queue.patient_results(patient_id)
+            save_patient_output(patient_template, [result['output'] for result in results],
+                                [result['turn_meta'] for result in results])
+            print(f"患者 {patient_id} 的全部对话已完成")
+    return finished
+
+def turn_predictor(patient_info, queue=None):
+    """由输出目录中已有的对话（以及队列中已完成的对话）建立轮数预测器（见 scheduling.py）"""
+    from scheduling import TurnPredictor
+    predictor = TurnPredictor()
+    predictor.observe_outputs(OUTPUT_DATASYN_PATH, patient_info)
+    if queue is not None:
+        predictor.observe_queue(queue, patient_info)
+    print(f"按预测轮数从长到短调度，历史对话 {predictor.observed()} 个")
+    return predictor
+
+def config_overrides(args):
+    """命令行参数对应的 SystemConfig 配置"""
+    overrides = {}
+    if args.transcript_mode:
+        overrides['TRANSCRIPT_MODE'] = args.transcript_mode
+    if args.transcripts:
+        overrides['TRANSCRIPT_DIR'] = args.transcripts
+    if args.status_port is not None:
+        overrides['STATUS_PORT'] = args.status_port
+    if args.quiet:
+        overrides['QUIET'] = True
+    return overrides
+
+def run_queue(args, patient_info, completed, failed, rejected):
+    """
+    队列模式：将本次运行的对话加入队列，启动工作进程直到队列中没有可执行的任务
+
+    Returns:
+        dict: 与 RunGovernor.summary() 格式相同的花费统计，由队列中本次运行负责的患者的记录汇总
+    """
     global total_cost
-    
-    with open(PATIENT_INFO_PATH, 'r') as f:
-        patient_info = json.load(f)
+    from sharding import case_ids, id_order
+    from work_queue import WorkQueue
+
+    # 多个进程同时写归档分片和内存中的去重索引并不安全，队列模式只写出 patient_N.json
+    if SystemConfig.OUTPUT_STORAGE == 'archive' or SystemConfig.DEDUP_INDEX:
+        print("队列模式只支持JSON输出，请在完成后运行 dialogue_archive.py convert / dedup.py")
+    # 队列中的对话在不同进程中独立执行，无法共享主干对话的状态
+    if SystemConfig.FORK_MODE:
+        print("队列模式不支持对话分叉，各对话独立生成")
+
+    queue = WorkQueue(args.queue)
+    priorities = None
+    if SystemConfig.SCHEDULE == 'longest_first':
+        predictor = turn_predictor(patient_info, queue)
+        priorities = {patient_template['患者']: predictor.predict(patient_template) for patient_template in patient_info}
+    added = queue.enqueue([patient_template['患者'] for patient_template in patient_info], NUM, priorities)
+    if SystemConfig.STATUS_PORT is not None:
+        from status_server import QueueStatus, serve
+        serve(QueueStatus(queue), SystemConfig.STATUS_PORT)
+        print(f"状态接口: http://{SystemConfig.STATUS_HOST}:{SystemConfig.STATUS_PORT}/status")
+    print(f"队列中新增 {added} 个任务，使用 {args.processes} 个工作进程")
+
+    output_paths = (OUTPUT_DATASYN_PATH, OUTPUT_COLUMNAR_PATH)
+    if args.processes > 1:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [executor.submit(queue_worker, args.queue, patient_info, output_paths, config_overrides(args))
+                       for _ in range(args.processes)]
+            finished = sum(future.result() for future in futures)
+    else:
+        finished = queue_worker(args.queue, patient_info, output_paths)
+    status = queue.status()
+    print(f"本次运行完成 {finished} 个对话，队列状态:", status)
+
+    # 队列中数字字符串编号以整数保存，与案例文件统一按字符串比较
+    assigned = set(case_ids(patient_info))
+    completed.update({str(patient_id): cost for patient_id, cost in queue.patient_costs().items() if str(patient_id) in assigned})
+    failed.extend(str(patient_id) for patient_id in queue.failed_patients() if str(patient_id) in assigned)
+    # 队列的总花费达到预算后未完成的患者（其余对话未被领取）
+    if SystemConfig.RUN_BUDGET is not None and status['spent'] >= SystemConfig.RUN_BUDGET:
+        rejected.extend(sorted(assigned - set(completed) - set(failed), key=id_order))
+    # 单进程时工作函数在本进程中运行，run_conversation 已经累加过 budget_hits；
+    # 以队列中的记录为准，并且只统计本次运行（本分片）负责的患者
+    budget_hits.clear()
+    budget_hits.update(queue.truncated_counts(assigned))
+    # 花费和对话数同样只统计本次运行负责的患者；因预算停止领取时，仍在等待的对话视为未准入
+    totals = queue.job_totals(assigned)
+    # 与线程模式相同，总价格包括未全部完成的患者已完成的对话
+    total_cost = totals['spent']
+    return {'budget': SystemConfig.RUN_BUDGET, 'spent': totals['spent'], 'projected': None,
+            'completed': totals['done'], 'rejected': totals['pending'] if rejected else 0}
+
+def run_threads(patient_info, completed, failed, rejected, dedup_report_path):
+    """
+    线程模式：在当前进程中并行处理患者
+
+    Returns:
+        dict: 整个运行的花费统计
+    """
+    global archive_writer, dedup_index, governor, opening_prefetcher, run_status
+
+    if SystemConfig.SCHEDULE == 'longest_first':
+        # 先处理预测轮数最多的患者，减少最后少数线程仍在生成长对话的长尾
+        from scheduling import longest_first
+        predictor = turn_predictor(patient_info)
+        patient_info = longest_first(patient_info, predictor.predict)
+
+    governor = RunGovernor(len(patient_info) * NUM)
+    if SystemConfig.STATUS_PORT is not None:
+        from status_server import RunStatus, serve
+        run_status = RunStatus(len(patient_info) * NUM)
+        serve(run_status, SystemConfig.STATUS_PORT)
+        print(f"状态接口: http://{SystemConfig.STATUS_HOST}:{SystemConfig.STATUS_PORT}/status")
+    if SystemConfig.OPENING_PREFETCH:
+        from opening import OpeningPrefetcher
+        opening_prefetcher = OpeningPrefetcher(patient_info, 1 if SystemConfig.FORK_MODE else NUM, prepare_doctor)
+
+    if SystemConfig.OUTPUT_STORAGE == 'archive':
+        from dialogue_archive import ArchiveWriter
+        archive_writer = ArchiveWriter(OUTPUT_ARCHIVE_PATH)
+    if SystemConfig.DEDUP_INDEX:
+        from dedup import DedupIndex
+        dedup_index = DedupIndex()
     
     # 设置并行处理的最大工作线程数，可以根据需要调整
     max_workers = 1
     
     print(f"开始并行处理 {len(patient_info)} 个患者，使用 {max_workers} 个线程")
-    
+
     # 使用ThreadPoolExecutor并行处理患者
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # 提交所有任务
@@ -124,11 +439,99 @@ def main():
             patient_template = future_to_patient[future]
             try:
                 patient_id, patient_cost = future.result()
+                if patient_cost is None:
+                    print(f"患者 {patient_id} 的对话均因超出运行预算未开始")
+                    rejected.append(patient_id)
+                    continue
                 print(f"患者 {patient_id} 处理完成，花费: {patient_cost}")
+                completed[patient_id] = patient_cost
             except Exception as exc:
                 print(f"患者 {patient_template['患者']} 处理时发生异常: {exc}")
+                failed.append(patient_template['患者'])
     
+    if archive_writer is not None:
+        archive_writer.close()
+    if dedup_index is not None:
+        dedup_index.save_report(dedup_report_path)
+        print(f"近重复检测报告已保存到 {dedup_report_path}")
+    return governor.summary()
+
+def main(argv=None):
+    global OUTPUT_DATASYN_PATH, OUTPUT_ARCHIVE_PATH, OUTPUT_COLUMNAR_PATH
+
+    parser = argparse.ArgumentParser(description='生成精神科诊断对话')
+    parser.add_argument('--shard-index', type=int, default=0, help='本节点处理的分片编号（从0开始）')
+    parser.add_argument('--shard-count', type=int, default=1, help='分片总数，大于1时输出写入独立的分片目录')
+    parser.add_argument('--queue', default=None, help='任务队列数据库路径，指定时以对话为单位从持久化队列领取任务')
+    parser.add_argument('--processes', type=int, default=1, help='队列模式下启动的工作进程数')
+    parser.add_argument('--transcript-mode', choices=['record', 'replay'], default=None,
+                        help='record：记录所有LLM请求/响应和随机种子；replay：不调用模型，按记录确定性地重新运行')
+    parser.add_argument('--transcripts', default=None, help='转录目录，默认为 PathConfig.TRANSCRIPT_DIR')
+    parser.add_argument('--status-port', type=int, default=None, help='在本机该端口启动状态接口（/status、/metrics）')
+    parser.add_argument('--quiet', action='store_true', help='不输出每句发言和调试信息')
+    args = parser.parse_args(argv)
+    for key, value in config_overrides(args).items():
+        setattr(SystemConfig, key, value)
+    
+    ensure_dirs_exist()
+    with open(PATIENT_INFO_PATH, 'r') as f:
+        patient_info = json.load(f)
+
+    dedup_report_path = PathConfig.DEDUP_REPORT_PATH
+    shard_output_dir = None
+    if args.shard_count > 1:
+        from sharding import select_shard, shard_dir, case_digest
+        digest = case_digest(patient_info)
+        patient_info = select_shard(patient_info, args.shard_index, args.shard_count)
+        shard_output_dir = shard_dir(args.shard_index, args.shard_count)
+        OUTPUT_DATASYN_PATH = os.path.join(shard_output_dir, 'DataSyn')
+        OUTPUT_ARCHIVE_PATH = os.path.join(shard_output_dir, 'archive')
+        OUTPUT_COLUMNAR_PATH = os.path.join(shard_output_dir, 'parquet')
+        dedup_report_path = os.path.join(shard_output_dir, 'dedup_report.json')
+        os.makedirs(OUTPUT_DATASYN_PATH, exist_ok=True)
+        print(f"分片 {args.shard_index}/{args.shard_count}：输出到 {shard_output_dir}")
+
+    completed = {}
+    failed = []
+    rejected = []    # 因超出运行预算未生成的患者
+
+    if args.queue:
+        summary = run_queue(args, patient_info, completed, failed, rejected)
+    else:
+        summary = run_threads(patient_info, completed, failed, rejected, dedup_report_path)
+
+    if budget_hits:
+        print("预算截断的对话数:", dict(budget_hits))
+    if fork_stats:
+        print(f"对话分叉：{fork_stats['branches']} 个分叉对话，共复用 {fork_stats['shared_rounds']} 轮")
+    if opening_prefetcher is not None:
+        print(f"预取开场提问：{opening_prefetcher.conversations} 个对话，{opening_prefetcher.requests} 次请求")
+    if llm_tools_api.AUX_LEDGER.summary():
+        print("辅助调用花费:", llm_tools_api.AUX_LEDGER.summary())
+    print("花费统计:", summary)
+    if SystemConfig.STREAMING:
+        print("流式生成延迟统计:", llm_tools_api.STREAM_STATS.summary())
+    if SystemConfig.JUDGE_DISTILL:
+        from judge_distill import JUDGE_STATS
+        print("本地判断分类器统计:", JUDGE_STATS.summary())
     print("********总价格*********:", total_cost)
 
+    # 记录分片的完成情况和花费，供 sharding.py 校验与合并
+    if shard_output_dir is not None:
+        from sharding import write_ledger, case_ids
+        write_ledger(shard_output_dir, {
+            'shard_index': args.shard_index,
+            'shard_count': args.shard_count,
+            'case_digest': digest,
+            'storage': 'json' if args.queue else SystemConfig.OUTPUT_STORAGE,
+            'assigned': case_ids(patient_info),
+            'completed': completed,
+            'failed': sorted(failed),
+            'rejected': sorted(rejected),
+            'total_cost': total_cost,
+            'budget_hits': dict(budget_hits),
+            'governor': summary,
+        })
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+开场提问的批量预取
+每个对话的第一句医生提问只依赖医生人设、患者的年龄和性别以及第一个话题（诊断树根节点“精神状况”的提示词），
+与对话的其余部分无关。OpeningPrefetcher 按批为若干患者的全部对话提前创建医生，按请求消息分组，
+相同的请求合并为一次使用 n 参数的请求，各组并发请求；对话开始时直接使用预取的开场提问，
+每个对话的关键路径上少一次串行调用。
+患者的第一句回答依赖采样得到的开场提问和各对话的背景故事，无法合并，仍在对话中生成
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import llm_tools_api
+from config import SystemConfig
+
+
+def prefetch_openings(doctors, max_n=None, workers=None):
+    """
+    为一组尚未开始对话的医生批量生成开场提问
+
+    请求消息相同的医生合并为一次请求（每次最多 max_n 个），合计的token数在组内平均分摊（按整数）；
+    请求失败或服务返回的回复数不足时，其余医生在对话开始时照常生成开场提问
+
+    Args:
+        doctors (list): Doctor 对象
+        max_n (int, optional): 单次请求的最大n
+        workers (int, optional): 并发请求数
+
+    Returns:
+        tuple: (发出的请求数, 预取成功的医生数)
+    """
+    max_n = max_n or SystemConfig.OPENING_MAX_N
+    workers = workers or SystemConfig.OPENING_WORKERS
+    groups = {}
+    for doc in doctors:
+        key = json.dumps([doc.reply_model, doc.opening_messages()], ensure_ascii=False)
+        groups.setdefault(key, []).append(doc)
+    requests = [members[start:start + max_n] for members in groups.values() for start in range(0, len(members), max_n)]
+
+    def fetch(members):
+        doc = members[0]
+        try:
+            responses, tokens = llm_tools_api.chat_completion_n(
+                doc.client, 'doctor', len(members),
+                model=doc.reply_model,
+                messages=doc.opening_messages(),
+                top_p=SystemConfig.DEFAULT_TOP_P
+            )
+        except Exception as exc:
+            print(f"预取开场提问失败（{len(members)} 个对话将逐个生成）: {exc}")
+            return 0
+        for j, (member, response) in enumerate(zip(members, responses)):
+            # 按整数分摊，各对话的token数之和等于请求的token数
+            member.set_opening(response, [token_num // len(responses) + (j < token_num % len(responses)) for token_num in tokens])
+        return len(responses)
+
+    if not requests:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=min(workers, len(requests))) as executor:
+        fetched = sum(executor.map(fetch, requests))
+    return len(requests), fetched
+
+
+class OpeningPrefetcher:
+    """
+    按批预取患者对话的开场提问
+    take(patient_template) 返回该患者每个对话的 (Doctor, 对话种子)；第一次取某个患者时，
+    为它及其后尚未预取的共 batch_size 个患者的全部对话创建医生并预取开场提问
+    """
+
+    def __init__(self, patient_info, num, make_doctor, batch_size=None):
+        """
+        Args:
+            patient_info (list): 按处理顺序排列的患者案例
+            num (int): 每个患者的对话数
+            make_doctor (callable): make_doctor(patient_template, i) 返回第i个对话的 (Doctor, 对话种子)
+            batch_size (int, optional): 每批预取的患者数
+        """
+        self.patient_info = patient_info
+        self.num = num
+        self.make_doctor = make_doctor
+        self.batch_size = batch_size or SystemConfig.OPENING_BATCH_PATIENTS
+        self.lock = threading.Lock()
+        self.prepared = {}
+        self.fetched = set()
+        self.requests = 0
+        self.conversations = 0
+
+    def _prefetch_batch(self, patient_id):
+        start = next(idx for idx, patient_template in enumerate(self.patient_info) if patient_template['患者'] == patient_id)
+        batch = []
+        for patient_template in self.patient_info[start:]:
+            if len(batch) == self.batch_size:
+                break
+            if patient_template['患者'] not in self.fetched:
+                batch.append(patient_template)
+        for patient_template in batch:
+            self.fetched.add(patient_template['患者'])
+            self.prepared[patient_template['患者']] = [self.make_doctor(patient_template, i) for i in range(self.num)]
+        doctors = [doc for patient_template in batch for doc, _ in self.prepared[patient_template['患者']]]
+        requests, fetched = prefetch_openings(doctors)
+        self.requests += requests
+        self.conversations += fetched
+        print(f"已为 {len(batch)} 个患者的 {fetched}/{len(doctors)} 个对话预取开场提问，共 {requests} 次请求")
+
+    def take(self, patient_template):
+        """
+        取出某个患者全部对话的医生
+
+        Returns:
+            list: 每个对话的 (Doctor, 对话种子)
+        """
+        with self.lock:
+            if patient_template['患者'] not in self.prepared:
+                self._prefetch_batch(patient_template['患者'])
+            return self.prepared.pop(patient_template['患者'])
@@ -1,7 +1,6 @@
+import copy
 import json
 import random
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
 import llm_tools_api
 from config import SystemConfig
 
@@ -10,6 +9,7 @@ class Patient(llm_tools_api.PatientCost):
         super().__init__(model_path.split('/')[-1])
         self.model_path = model_path
         self.model_name = model_path #.split('/')[-1]
+        self.reply_model = llm_tools_api.routed_model('patient_reply', self.model_name)    # 患者回复使用的模型（见 ModelConfig.ROUTES）
         self.patient_model = None
         self.patient_tokenizer = None
         self.experience = None
@@ -26,15 +26,16 @@ class Patient(llm_tools_api.PatientCost):
         if self.use_api:
             self.client = llm_tools_api.patient_client_init(self.model_name)
         else:
-            self.patient_model = AutoModelForCausalLM.from_pretrained(
-                self.model_path,
-                torch_dtype=torch.bfloat16,
-                device_map="auto"
-            )
-            self.patient_tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            self.patient_model, self.patient_tokenizer = llm_tools_api.local_model_init(self.reply_model)
         self.messages.append({"role": "system", "content": self.system_prompt})
 
 
+    def fork(self):
+        """复制对话进行到当前位置的患者（见 forking.py），客户端和本地模型共享"""
+        memo = {id(self.client): self.client, id(self.patient_model): self.patient_model,
+                id(self.patient_tokenizer): self.patient_tokenizer}
+        return copy.deepcopy(self, memo)
+
     def patient_response_gen(self, current_topic, dialogue_history):
         # self.messages.append({"role": "user", "content": doctor_response})
         if self.use_api:
@@ -44,34 +45,34 @@ class Patient(llm_tools_api.PatientCost):
             patient_template = {key:val for key, val in self.patient_template.items() if key != '处理意见'} 
             if self.experience is None:
                 self.experience, x = llm_tools_api.api_patient_experience_trigger(self.model_name, dialogue_history, self.story_path)
-                super().money_cost(x[0], x[1])
+                super().money_cost(*x, call_type='experience_trigger')
             if self.experience is None:
                 patient_prompt = "你是一名{}患者，正在和一位精神卫生中心临床心理科医生进行交流。如果医生的问题可以用是/否来回答，你的回复要简短精确。\n你的病例为“{}”，\n你和医生的对话历史为{}， \
                     \n现在请根据下面要求生成:\n1.使用第一人称口语化的回答，如果不是必要情况，不要生成疑问句，不要总是以”医生，“开头。\n2.回答围绕{}展开，如果医生的问题可以用是/否来回答，你的回复要简短精确。在对话历史中提到过的内容不要重复再提起。\n3.回复内容必须根据病例内容，对话历史。如果出现不在病例内容中的问题，发挥想象力虚构回答。" \
                     .format(self.patient_template['诊断结果'], patient_template, dialogue_history[-8:], current_topic)
                 self.messages.append({"role": "user", "content": patient_prompt})
-                chat_response = self.client.chat.completions.create(
-                        model=self.model_name,
-                        messages=self.messages,
-                                        top_p=SystemConfig.DEFAULT_TOP_P,
-                frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
-                    )
-                super().money_cost(chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens)
-                patient_response = chat_response.choices[0].message.content
+                patient_response, tokens = llm_tools_api.chat_completion(
+                    self.client, 'patient',
+                    model=self.reply_model,
+                    messages=self.messages,
+                    top_p=SystemConfig.DEFAULT_TOP_P,
+                    frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
+                )
+                super().money_cost(*tokens, call_type='patient_reply')
                 self.messages.pop()
             else:
                 patient_prompt = "你是一名{}患者，正在和一位精神卫生中心临床心理科医生进行交流。 \
                     \n\n现在请根据下面要求生成对医生的回答:\n1.回复内容必须根据：\n  （1）病例：“{}“\n  （2）过去的创伤经历：“{}”\n  （3）对话历史：“{}”。\n2.你当前的回复需要围绕话题“{}”展开，要精炼精确。在对话历史中提到过的内容不要重复再提起。\n3.涉及到过去的创伤经历时，需要详细清晰的阐述。但是如果已经说过，不允许重复生成。 \n4.使用第一人称口语化的回答，不要生成疑问句，不要总是以”医生，“开头。如果遇到不在病例和过去创伤经历中的问题，发挥想象力虚构回答，不要输出类似”一些事情“，要具体细节。" \
                     .format(self.patient_template['诊断结果'], patient_template, self.experience, dialogue_history[-8:], current_topic)
                 self.messages.append({"role": "user", "content": patient_prompt})
-                chat_response = self.client.chat.completions.create(
-                        model=self.model_name,
-                        messages=self.messages,
-                                            top_p=SystemConfig.DEFAULT_TOP_P,
+                patient_response, tokens = llm_tools_api.chat_completion(
+                    self.client, 'patient',
+                    model=self.reply_model,
+                    messages=self.messages,
+                    top_p=SystemConfig.DEFAULT_TOP_P,
                     frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
-                    )
-                super().money_cost(chat_response.usage.prompt_tokens, chat_response.usage.completion_tokens)
-                patient_response = chat_response.choices[0].message.content
+                )
+                super().money_cost(*tokens, call_type='patient_reply')
                 self.messages.pop()
                 # self.messages.append({"role": "assistant", "content": patient_response})
         else:
@@ -102,6 +103,7 @@ class Roleplay_Patient:
         self.patient_template = patient_template
         self.use_api = use_api
         self.model_name = model_path.split('/')[-1]
+        self.reply_model = llm_tools_api.routed_model('patient_reply', self.model_name)
         self.system_prompt = "你是一名{}岁的{}性{}患者，正在和一位精神科医生交流，使用口语化的表达，输出一整段没有空行的内容。如果医生的问题可以用是/否来回答，你的回复要简短精确。".format(self.patient_template['年龄'], self.patient_template['性别'], self.patient_template['诊断结果'])
         self.messages = []
         self.dialbegin = True
@@ -118,14 +120,14 @@ class Roleplay_Patient:
             patient_template = {key:val for key, val in self.patient_template.items() if key != '处理意见'} 
             patient_prompt = "你是一名{}患者，正在和一位精神卫生中心临床心理科医生进行交流。如果医生的问题可以用是/否来回答，你的回复要简短精确。\n你的病例为“{}”，\n你和医生的对话历史为{}， \
                     \n现在请根据下面要求生成:\n1.使用第一人称口语化的回答，如果不是必要情况，不要生成疑问句，不要总是以”医生，“开头。\n2.如果医生的问题可以用是/否来回答，你的回复要简短精确。在对话历史中提到过的内容不要重复再提起。\n3.回复内容必须根据病例内容，对话历史。如果出现不在病例内容中的问题，发挥想象力虚构回答。" \
-                    .format(self.patient_template['诊断结果'], patient_template, dialogue_history[-8:])
+                    .format(self.patient_template['诊断结果'], patient_template, llm_tools_api.render_history(dialogue_history, 8))
             self.messages.append({"role": "user", "content": patient_prompt})
-            chat_response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=self.messages,
-                    top_p=SystemConfig.DEFAULT_TOP_P,
-                    frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
-                )
-            patient_response = chat_response.choices[0].message.content
+            patient_response, _ = llm_tools_api.chat_completion(
+                self.client, 'roleplay_patient',
+                model=self.reply_model,
+                messages=self.messages,
+                top_p=SystemConfig.DEFAULT_TOP_P,
+                frequency_penalty=SystemConfig.DEFAULT_FREQUENCY_PENALTY
+            )
             self.messages.pop()
         return patient_response
\ No newline at end of file
@@ -5,21 +5,29 @@
 1. 从Excel文件读取患者信息并转换为JSON格式
 2. 根据患者信息生成背景故事
 3. 对患者案例进行统计分析
+信息提取和背景故事生成也可以使用批处理文件模式（--batch，见 batch_jobs.py）
 """
 
 import os
+import argparse
 import pandas as pd
 import json
 import re
 import llm_tools_api
+import batch_jobs
+from cohort_profile import CohortProfile
 import ast
 from tqdm import tqdm
 import random
+import queue
+import hashlib
+import openpyxl
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
 # 导入配置文件
-from config import PathConfig, get_model_name, SystemConfig
+from config import PathConfig, ModelConfig, get_model_name, SystemConfig, ensure_dirs_exist
 
 # 并发处理配置类
 class ConcurrencyConfig:
@@ -28,8 +36,10 @@ class ConcurrencyConfig:
     MAX_API_EXTRACTION_WORKERS = 32
     # 背景故事生成阶段的最大并发数  
     MAX_STORY_GENERATION_WORKERS = 32
-    # 单个患者API调用的最大并发数（个人史和精神检查并行）
-    MAX_SINGLE_PATIENT_API_WORKERS = 5
+    # 解析线程与提取线程之间的有界队列长度
+    INGEST_QUEUE_SIZE = 64
+    # 已提交提取请求但尚未写出的最大患者数（控制内存占用）
+    MAX_INGEST_INFLIGHT = 64
     # 请求超时时间（秒）
     REQUEST_TIMEOUT = 60
 
@@ -55,6 +65,75 @@ PATIENT_CASES_ORIGIN_PATH = PathConfig.PATIENT_CASES_ORIGIN_PATH  # 原始患者
 PATIENT_CASES_JSON_PATH = PathConfig.PATIENT_CASES_JSON_PATH      # 转换后的JSON文件路径
 PROMPT_PATH = PathConfig.PROMPTS_DIR                              # 提示词根目录路径
 OUTPUT_PASTEXP_PATH = PathConfig.BACKGROUND_STORY_DIR             # 背景故事输出路径
+STORY_MANIFEST_NAME = 'manifest.jsonl'                            # 背景故事清单文件名
+
+
+class JsonArrayWriter:
+    """
+    增量写出JSON数组，输出格式与 json.dump(list, indent=2, ensure_ascii=False) 一致
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, item):
+        """追加一个数组元素"""
+        self.f.write('[\n  ' if self.count == 0 else ',\n  ')
+        self.f.write(json.dumps(item, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+        self.f.flush()
+        self.count += 1
+
+    def close(self):
+        """写出数组结尾"""
+        self.f.write('\n]' if self.count else '[]')
+
+
+class StoryManifest:
+    """
+    背景故事清单
+    以JSONL格式追加记录每个故事的输入哈希，重复运行时只生成缺失或输入已变化的故事；
+    每条记录在故事写入后立即追加，中断的运行可以从中断处继续
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时可能留下不完整的最后一行
+                        continue
+                    self.entries[entry['key']] = entry
+
+    def is_fresh(self, plan):
+        """故事文件存在且输入哈希与清单记录一致时返回True"""
+        entry = self.entries.get(plan['key'])
+        return entry is not None and entry['input_hash'] == plan['input_hash'] and os.path.exists(plan['output_path'])
+
+    def record(self, plan):
+        """追加一条生成记录"""
+        entry = {'key': plan['key'], 'input_hash': plan['input_hash'], 'seed': plan['seed'], 'keywords': plan['keywords']}
+        with self.lock:
+            self.entries[plan['key']] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def compact(self):
+        """重写清单文件，每个故事只保留最新一条记录"""
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
 
 
 class PatientCases():
@@ -80,167 +159,245 @@ class PatientCases():
         self.gender_mode = None           # 性别模式
         self.age_mode = None              # 年龄模式
 
-    def patient_cases_json(self):
+    def _iter_excel_rows(self):
         """
-        将Excel格式的患者案例数据转换为JSON格式
-        包含数据清洗、格式化和过滤功能
+        以只读模式流式读取Excel文件，逐行产出以表头为键的字典，避免一次性加载整个表格
+
+        Yields:
+            dict: 单行患者数据
+        """
+        workbook = openpyxl.load_workbook(self.xlsx_path, read_only=True)
+        try:
+            rows = workbook['Sheet1'].iter_rows(values_only=True)
+            header = next(rows)
+            for values in rows:
+                yield dict(zip(header, values))
+        finally:
+            workbook.close()
+
+    def _parse_row(self, row, num):
+        """
+        清洗并格式化单行患者数据
+
+        Args:
+            row (dict): Excel中的一行数据
+            num (int): 患者编号
+
+        Returns:
+            dict or None: 格式化后的患者信息，未通过数据质量过滤时返回None
+        """
+        output_dict = {}
+
+        # 基本信息提取
+        output_dict['患者'] = num
+        output_dict['年龄'] = int(row['Age'])
+        output_dict['性别'] = row['Gender']
+
+        # 清理ICD编码末尾的逗号
+        output_dict['ICD编码'] = row['DiagnosisCode'] if str(row['DiagnosisCode'])[-1] != ',' else str(row['DiagnosisCode'])[:-1]
+        # 清理诊断结果末尾的逗号
+        output_dict['诊断结果'] = row['Diagnosis'] if str(row['Diagnosis'])[-1] != ',' else str(row['Diagnosis'])[:-1]
+
+        # ICD编码NAN处理
+        if pd.isna(output_dict['ICD编码']):
+
+            if "抑郁" in output_dict['诊断结果'] and "焦虑" in output_dict['诊断结果']:
+                output_dict['ICD编码'] = 'F32,F41'
+                print(f"Warning: ICD编码为空，诊断结果为抑郁和焦虑，已替换为F32,F41")
+            elif "抑郁" in output_dict['诊断结果']:
+                output_dict['ICD编码'] = 'F32'
+                print(f"Warning: ICD编码为空，诊断结果为抑郁，已替换为F32")
+            elif "焦虑" in output_dict['诊断结果']:
+                output_dict['ICD编码'] = 'F41'
+                print(f"Warning: ICD编码为空，诊断结果为焦虑，已替换为F41")
+            else:
+                output_dict['ICD编码'] = 'F00'
+                print(f"Warning: ICD编码为空，已替换为F00，诊断结果为：{output_dict['诊断结果']}")
+
+        # 使用正则表达式提取主诉信息
+        output_dict['主诉'] = '无' if re.findall(r"主诉：(.+)", str(row['ChiefComplaint'])) == [" "] else re.findall(r"主诉：(.+)", str(row['ChiefComplaint']))[-1]
+        # 使用正则表达式提取现病史信息
+        output_dict['现病史'] = '无' if re.findall(r"现病史：(.+)", str(row['PresentIllnessHistory'])) == [" "] else re.findall(r"现病史：(.+)", str(row['PresentIllnessHistory']))[-1]
+
+        # 处理躯体疾病史，如果为空则标记为"无"
+        output_dict['重要或相关躯体疾病史'] = '无' if pd.isna(row['ImportantRelevantPhysicalIllnessHistory']) else row['ImportantRelevantPhysicalIllnessHistory']
+        # 处理家族史，如果为空则标记为"无"
+        output_dict['家族史'] = '无' if pd.isna(row['FamilyHistory']) else row['FamilyHistory']
+
+        # 使用正则表达式提取个人史和精神检查信息
+        output_dict['个人史'] = '无' if re.findall(r"个人史:(.+)", str(row['PersonalHistory'])) == [" "] else re.findall(r"个人史:(.+)", str(row['PersonalHistory']))[-1]
+        output_dict['精神检查'] = '无' if re.findall(r"精神检查描述：(.+)", str(row['PsychiatricExamination'])) == [" "] else re.findall(r"精神检查描述：(.+)", str(row['PsychiatricExamination']))[-1]
+        output_dict['处理意见'] = '无' if re.findall(r"处理意见：(.+)", str(row['TreatmentRecommendation'])) == [" "] else re.findall(r"处理意见：(.+)", str(row['TreatmentRecommendation']))[-1]
+
+        # 进一步清理家族史数据
+        output_dict['家族史'] = '无' if output_dict['家族史'] == '家族史：阴性。 ' or output_dict['家族史'] == '家族史：阴性 ' or "缺失" in output_dict['家族史'] else output_dict['家族史']
+        output_dict['家族史'] = re.findall(r"家族史：(.+)", str(output_dict['家族史']))[-1] if output_dict['家族史'] != '无' else output_dict['家族史']
+
+        # 进一步清理躯体疾病史数据
+        if re.findall(r"重要或相关躯体疾病史：(.+)", str(output_dict['重要或相关躯体疾病史'])) == []:
+            output_dict['重要或相关躯体疾病史'] = '无'
+        elif re.findall(r"重要或相关躯体疾病史：(.+)", str(output_dict['重要或相关躯体疾病史']))[-1][0] == '无':
+            output_dict['重要或相关躯体疾病史'] = '无'
+        else:
+            output_dict['重要或相关躯体疾病史'] = re.findall(r"重要或相关躯体疾病史：(.+)", str(output_dict['重要或相关躯体疾病史']))[-1]
+
+        # 数据质量过滤：确保关键字段不为"无"
+        for key in ['主诉', '处理意见', '精神检查', '个人史']:
+            if output_dict[key] == '无':
+                return None
+
+        # 将其他部分的nan的值替换为空字符串
+        for key in output_dict.keys():
+            if pd.isna(output_dict[key]):
+                output_dict[key] = ''
+        return output_dict
+
+    def _iter_patient_records(self):
+        """
+        逐行解析Excel，产出通过过滤的患者信息
+
+        Yields:
+            dict: 格式化后的患者信息
         """
-        # 定义输出字段：患者ID、年龄、性别、ICD编码、诊断结果、主诉、现病史、躯体疾病史、家族史、个人史、精神检查、处理意见
-        output_list = []
         num = 0  # 患者编号计数器
-        
-        # 读取Excel文件
-        file = pd.read_excel(self.xlsx_path, sheet_name='Sheet1')
-        
-        # 预处理数据，收集需要API处理的患者信息
-        patients_for_api = []
-        patients_basic_info = []
-        
-        # 逐行处理患者数据
-        for index, row in file.iterrows():
+        for row in self._iter_excel_rows():
             # 过滤掉关键字段为空的记录
             if (not pd.isna(row['Diagnosis'])) and (not pd.isna(row['ChiefComplaint'])) and (not pd.isna(row['PresentIllnessHistory'])) and (not pd.isna(row['TreatmentRecommendation'])):
                 num += 1
-                output_dict = {}
-                
-                # 基本信息提取
-                output_dict['患者'] = num
-                output_dict['年龄'] = int(row['Age'])
-                output_dict['性别'] = row['Gender']
-                
-                # 清理ICD编码末尾的逗号
-                output_dict['ICD编码'] = row['DiagnosisCode'] if str(row['DiagnosisCode'])[-1] != ',' else str(row['DiagnosisCode'])[:-1]
-                # 清理诊断结果末尾的逗号
-                output_dict['诊断结果'] = row['Diagnosis'] if str(row['Diagnosis'])[-1] != ',' else str(row['Diagnosis'])[:-1]
-                
-                # ICD编码NAN处理
-                if pd.isna(output_dict['ICD编码']):
-                    
-                    if "抑郁" in output_dict['诊断结果'] and "焦虑" in output_dict['诊断结果']:
-                        output_dict['ICD编码'] = 'F32,F41'
-                        print(f"Warning: ICD编码为空，诊断结果为抑郁和焦虑，已替换为F32,F41")
-                    elif "抑郁" in output_dict['诊断结果']:
-                        output_dict['ICD编码'] = 'F32'
-                        print(f"Warning: ICD编码为空，诊断结果为抑郁，已替换为F32")
-                    elif "焦虑" in output_dict['诊断结果']:
-                        output_dict['ICD编码'] = 'F41'
-                        print(f"Warning: ICD编码为空，诊断结果为焦虑，已替换为F41")
-                    else:
-                        output_dict['ICD编码'] = 'F00'
-                        print(f"Warning: ICD编码为空，已替换为F00，诊断结果为：{output_dict['诊断结果']}")
-                
-                # 使用正则表达式提取主诉信息
-                output_dict['主诉'] = '无' if re.findall(r"主诉：(.+)", str(row['ChiefComplaint'])) == [" "] else re.findall(r"主诉：(.+)", str(row['ChiefComplaint']))[-1]
-                # 使用正则表达式提取现病史信息
-                output_dict['现病史'] = '无' if re.findall(r"现病史：(.+)", str(row['PresentIllnessHistory'])) == [" "] else re.findall(r"现病史：(.+)", str(row['PresentIllnessHistory']))[-1]
-                
-                # 处理躯体疾病史，如果为空则标记为"无"
-                output_dict['重要或相关躯体疾病史'] = '无' if pd.isna(row['ImportantRelevantPhysicalIllnessHistory']) else row['ImportantRelevantPhysicalIllnessHistory']
-                # 处理家族史，如果为空则标记为"无"
-                output_dict['家族史'] = '无' if pd.isna(row['FamilyHistory']) else row['FamilyHistory']
-                
-                # 使用正则表达式提取个人史和精神检查信息
-                output_dict['个人史'] = '无' if re.findall(r"个人史:(.+)", str(row['PersonalHistory'])) == [" "] else re.findall(r"个人史:(.+)", str(row['PersonalHistory']))[-1]
-                output_dict['精神检查'] = '无' if re.findall(r"精神检查描述：(.+)", str(row['PsychiatricExamination'])) == [" "] else re.findall(r"精神检查描述：(.+)", str(row['PsychiatricExamination']))[-1]
-                output_dict['处理意见'] = '无' if re.findall(r"处理意见：(.+)", str(row['TreatmentRecommendation'])) == [" "] else re.findall(r"处理意见：(.+)", str(row['TreatmentRecommendation']))[-1]
-
-                # 进一步清理家族史数据
-                output_dict['家族史'] = '无' if output_dict['家族史'] == '家族史：阴性。 ' or output_dict['家族史'] == '家族史：阴性 ' or "缺失" in output_dict['家族史'] else output_dict['家族史']
-                output_dict['家族史'] = re.findall(r"家族史：(.+)", str(output_dict['家族史']))[-1] if output_dict['家族史'] != '无' else output_dict['家族史']
-                
-                # 进一步清理躯体疾病史数据
-                if re.findall(r"重要或相关躯体疾病史：(.+)", str(output_dict['重要或相关躯体疾病史'])) == []:
-                    output_dict['重要或相关躯体疾病史'] = '无'
-                elif re.findall(r"重要或相关躯体疾病史：(.+)", str(output_dict['重要或相关躯体疾病史']))[-1][0] == '无':
-                    output_dict['重要或相关躯体疾病史'] = '无'
-                else:
-                    output_dict['重要或相关躯体疾病史'] = re.findall(r"重要或相关躯体疾病史：(.+)", str(output_dict['重要或相关躯体疾病史']))[-1]
-
-                # 数据质量过滤：确保关键字段不为"无"
-                filter_flag = False
-                for key in output_dict.keys():
-                    if key in ['主诉', '处理意见', '精神检查', '个人史']:
-                        if output_dict[key] == '无':
-                            filter_flag = True
-                            break
-                            
-                # 如果通过过滤，收集需要API处理的数据
-                if not filter_flag:
-                    patients_basic_info.append(output_dict.copy())
-                    if self.use_api:
-                        patients_for_api.append({
-                            'index': len(patients_basic_info) - 1,
-                            'personal_history': output_dict['个人史'],
-                            'mental_exam': output_dict['精神检查']
-                        })
-                        
-                # 将其他部分的nan的值替换为空字符串
-                for key in output_dict.keys():
-                    if pd.isna(output_dict[key]):
-                        output_dict[key] = ''
-        
-        # 并行处理API调用
-        if self.use_api and patients_for_api:
-            print(f"开始并行处理 {len(patients_for_api)} 个患者的API请求...")
-            
-            def process_single_patient_api(patient_api_data):
-                """处理单个患者的API请求"""
+                output_dict = self._parse_row(row, num)
+                if output_dict is not None:
+                    yield output_dict
+
+    def _merge_extraction(self, output_dict, futures):
+        """
+        等待单个患者的提取请求完成，并将结果合并到患者信息中
+
+        Args:
+            output_dict (dict): 患者信息
+            futures (tuple or None): (个人史, 精神检查) 的提取请求，不使用API时为None
+
+        Returns:
+            dict: 合并后的患者信息，提取失败时保留原始文本
+        """
+        if futures is None:
+            # TODO: 本地模型处理逻辑待实现
+            return output_dict
+        future_personal, future_mental = futures
+        try:
+            detail_personal = ast.literal_eval(future_personal.result(timeout=ConcurrencyConfig.REQUEST_TIMEOUT))
+            detail_mental = ast.literal_eval(future_mental.result(timeout=ConcurrencyConfig.REQUEST_TIMEOUT))
+        except Exception as e:
+            print(f"处理患者 {output_dict['患者']} 时出错: {e}")
+            return output_dict
+        output_dict['个人史'] = detail_personal
+        output_dict['精神检查'] = detail_mental
+        return output_dict
+
+    def extraction_batch_requests(self):
+        """
+        批处理模式：为每个患者的个人史和精神检查生成信息提取请求
+
+        Returns:
+            tuple: ((custom_id, 请求参数) 列表, 未提取的患者信息列表)
+        """
+        records = list(self._iter_patient_records())
+        requests = []
+        for output_dict in records:
+            for key in ('个人史', '精神检查'):
+                requests.append(('patient_{}/{}'.format(output_dict['患者'], key),
+                                 llm_tools_api.extraction_request(get_model_name(), output_dict[key])))
+        return requests, records
+
+    def ingest_extraction_batch(self, records, responses, errors):
+        """
+        批处理模式：将信息提取结果合并到患者信息中并写出JSON文件
+        与同步处理相同，任一字段提取失败时保留该患者的原始文本
+
+        Args:
+            records (list): extraction_batch_requests 返回的患者信息
+            responses (dict): custom_id 对应的调用结果
+            errors (dict): custom_id 对应的错误信息
+
+        Returns:
+            int: 提取失败的患者数
+        """
+        failed = 0
+        with open(self.json_path + '.tmp', 'w') as f:
+            writer = JsonArrayWriter(f)
+            for output_dict in records:
+                custom_ids = ['patient_{}/{}'.format(output_dict['患者'], key) for key in ('个人史', '精神检查')]
+                for custom_id in custom_ids:
+                    if custom_id in responses:
+                        llm_tools_api.AUX_LEDGER.record('extraction', llm_tools_api.routed_model('extraction', get_model_name()),
+                                                        llm_tools_api.usage_tokens(responses[custom_id]),
+                                                        ModelConfig.BATCH_PRICE_SCALE)
                 try:
-                    index = patient_api_data['index']
-                    personal_history = patient_api_data['personal_history']
-                    mental_exam = patient_api_data['mental_exam']
-                    
-                    # 并行调用API提取个人史和精神检查的详细信息
-                    with ThreadPoolExecutor(max_workers=ConcurrencyConfig.MAX_SINGLE_PATIENT_API_WORKERS) as executor:
-                        future_personal = executor.submit(llm_tools_api.api_load_for_extraction, get_model_name(), personal_history)
-                        future_mental = executor.submit(llm_tools_api.api_load_for_extraction, get_model_name(), mental_exam)
-                        
-                        # 设置超时并获取结果
-                        detail_personal = future_personal.result(timeout=ConcurrencyConfig.REQUEST_TIMEOUT)
-                        detail_mental = future_mental.result(timeout=ConcurrencyConfig.REQUEST_TIMEOUT)
-                    
-                    detail_personal = ast.literal_eval(detail_personal)
-                    detail_mental = ast.literal_eval(detail_mental)
-                    
-                    return {
-                        'index': index,
-                        'personal_history': detail_personal,
-                        'mental_exam': detail_mental
-                    }
+                    detail_personal, detail_mental = [ast.literal_eval(llm_tools_api.completion_text(responses[custom_id]))
+                                                      for custom_id in custom_ids]
                 except Exception as e:
-                    print(f"处理患者 {index} 时出错: {e}")
-                    return {
-                        'index': patient_api_data['index'],
-                        'personal_history': patient_api_data['personal_history'],
-                        'mental_exam': patient_api_data['mental_exam']
-                    }
-            
-            # 使用线程池并行处理所有患者的API请求
-            with ThreadPoolExecutor(max_workers=min(ConcurrencyConfig.MAX_API_EXTRACTION_WORKERS, len(patients_for_api))) as executor:
-                future_to_patient = {executor.submit(process_single_patient_api, patient_data): patient_data for patient_data in patients_for_api}
-                
-                api_results = {}
-                for future in tqdm(as_completed(future_to_patient), total=len(patients_for_api), desc="API处理进度"):
-                    result = future.result()
-                    api_results[result['index']] = result
-            
-            # 将API结果合并到基本信息中
-            for i, basic_info in enumerate(patients_basic_info):
-                if i in api_results:
-                    basic_info['个人史'] = api_results[i]['personal_history']
-                    basic_info['精神检查'] = api_results[i]['mental_exam']
-                output_list.append(basic_info)
-        else:
-            # 不使用API时的处理
-            for basic_info in patients_basic_info:
-                if not self.use_api:
-                    # TODO: 本地模型处理逻辑待实现
-                    detail_mental = llm_tools_api.load_Qwen_for_extraction(basic_info['精神检查'])
-                output_list.append(basic_info)
-                    
-        # 将处理后的数据保存为JSON文件
-        with open(self.json_path, 'w') as f:
-            json.dump(output_list, f, indent=2, ensure_ascii=False)
+                    failed += 1
+                    error = next((errors[custom_id] for custom_id in custom_ids if custom_id in errors), e)
+                    print(f"处理患者 {output_dict['患者']} 时出错: {error}")
+                else:
+                    output_dict['个人史'] = detail_personal
+                    output_dict['精神检查'] = detail_mental
+                writer.write(output_dict)
+            writer.close()
+        os.replace(self.json_path + '.tmp', self.json_path)
+        return failed
+
+    def patient_cases_json(self):
+        """
+        将Excel格式的患者案例数据转换为JSON格式
+        使用有界队列的生产者/消费者流水线：解析线程逐行清洗数据，
+        主线程将每个患者的提取请求提交到共享线程池，并按患者顺序增量写入JSON文件
+        """
+        # 定义输出字段：患者ID、年龄、性别、ICD编码、诊断结果、主诉、现病史、躯体疾病史、家族史、个人史、精神检查、处理意见
+        record_queue = queue.Queue(maxsize=ConcurrencyConfig.INGEST_QUEUE_SIZE)
+        producer_errors = []
+
+        def producer():
+            """解析线程：逐行解析Excel并放入有界队列"""
+            try:
+                for output_dict in self._iter_patient_records():
+                    record_queue.put(output_dict)
+            except Exception as e:
+                producer_errors.append(e)
+            finally:
+                record_queue.put(None)    # 结束标记
+
+        producer_thread = threading.Thread(target=producer, daemon=True)
+        producer_thread.start()
+
+        pending = deque()    # 按患者顺序排列的在途请求
+        progress = tqdm(desc="API处理进度")
+        with open(self.json_path, 'w') as f, \
+                ThreadPoolExecutor(max_workers=ConcurrencyConfig.MAX_API_EXTRACTION_WORKERS) as executor:
+            writer = JsonArrayWriter(f)
+            while True:
+                output_dict = record_queue.get()
+                if output_dict is None:
+                    break
+                futures = None
+                if self.use_api:
+                    futures = (executor.submit(llm_tools_api.api_load_for_extraction, get_model_name(), output_dict['个人史']),
+                               executor.submit(llm_tools_api.api_load_for_extraction, get_model_name(), output_dict['精神检查']))
+                pending.append((output_dict, futures))
+
+                # 在途患者数达到上限时，按顺序写出最早提交的患者
+                while len(pending) >= ConcurrencyConfig.MAX_INGEST_INFLIGHT:
+                    writer.write(self._merge_extraction(*pending.popleft()))
+                    progress.update(1)
+
+            while pending:
+                writer.write(self._merge_extraction(*pending.popleft()))
+                progress.update(1)
+            writer.close()
+        progress.close()
+
+        producer_thread.join()
+        if producer_errors:
+            raise producer_errors[0]
 
 
     def key_word_selelction1(self):
@@ -284,255 +441,406 @@ class PatientCases():
         return dict_for_gen
         
 
-    def key_word_selelction(self):
+    def key_word_selelction(self, gender_mode=None, age_mode=None):
         """
         关键词选择方法（单模式）
         根据性别和年龄模式选择对应的关键词数据
         
+        Args:
+            gender_mode (str, optional): 性别模式，默认使用实例上的设置
+            age_mode (str, optional): 年龄模式，默认使用实例上的设置
+            
         Returns:
             dict or None: 关键词数据字典，如果年龄模式未设置则返回None
         """
-        if self.age_mode is not None:
-            path = self.gender_mode + '_' + self.age_mode + '.json'
+        gender_mode = gender_mode if gender_mode is not None else self.gender_mode
+        age_mode = age_mode if age_mode is not None else self.age_mode
+        if age_mode is not None:
+            path = gender_mode + '_' + age_mode + '.json'
             with open(os.path.join(self.prompt_path, 'patient', path)) as f:
                 data = json.load(f)
             return data
         else:
             return None
 
-    def story_gen_for_background(self, patient):
+    def story_modes(self, patient):
         """
-        为患者生成背景故事
+        根据患者年龄和性别确定关键词文件的模式
         
         Args:
             patient (dict): 患者信息字典
             
         Returns:
-            str: 生成的背景故事文本
+            tuple: (性别模式, 年龄模式)，50岁以上年龄模式为None
         """
-        dict_for_gen = self.key_word_selelction()
-        if dict_for_gen is not None:
-            first = False
-            chosen_key = None
+        gender_mode = 'male' if patient['性别'] == "男" else 'female'
+        # 50岁以下使用具体年龄，50岁以上不设置年龄模式
+        age_mode = str(patient['年龄']) if int(patient['年龄']) <= 50 else None
+        return gender_mode, age_mode
+
+    def sample_story_keywords(self, dict_for_gen, rng):
+        """
+        随机选择关键词生成故事元素
+        
+        Args:
+            dict_for_gen (dict): 关键词数据字典
+            rng (random.Random): 随机数生成器，固定种子时结果可复现
             
-            # 随机选择关键词生成故事元素
-            for key in dict_for_gen.keys():
-                if isinstance(dict_for_gen[key], dict) and first == False:
-                    # 根据权重随机选择子类别
-                    chosen_key = random.choices([x for x in dict_for_gen[key].keys()], [len(dict_for_gen[key][x]) for x in dict_for_gen[key].keys()])[0]
-                    value1 = random.choice(dict_for_gen[key][chosen_key])
-                    dict_for_gen[key] = value1
-                    first = True
-                elif isinstance(dict_for_gen[key], list):
-                    # 随机选择列表中的元素
-                    dict_for_gen[key] = random.choice(dict_for_gen[key])
-                else:
-                    # 使用已选择的子类别
-                    dict_for_gen[key] = random.choice(dict_for_gen[key][chosen_key])
-                    
-            print(dict_for_gen)
+        Returns:
+            dict: 每个字段选中的关键词
+        """
+        keywords = {}
+        chosen_key = None
+        for key in dict_for_gen.keys():
+            if isinstance(dict_for_gen[key], dict) and chosen_key is None:
+                # 根据权重随机选择子类别
+                chosen_key = rng.choices([x for x in dict_for_gen[key].keys()], [len(dict_for_gen[key][x]) for x in dict_for_gen[key].keys()])[0]
+                keywords[key] = rng.choice(dict_for_gen[key][chosen_key])
+            elif isinstance(dict_for_gen[key], list):
+                # 随机选择列表中的元素
+                keywords[key] = rng.choice(dict_for_gen[key])
+            else:
+                # 使用已选择的子类别
+                keywords[key] = rng.choice(dict_for_gen[key][chosen_key])
+        return keywords
+
+    def story_fields(self, patient):
+        """
+        提取背景故事模板 patient_background.txt 用到的患者字段
+        
+        Args:
+            patient (dict): 患者信息字典
             
-            # 读取背景故事模板
+        Returns:
+            dict: 模板字段
+        """
+        return {'age': patient['年龄'], 'gender': patient['性别'], 'diagnosis': patient['诊断结果'],
+                'illness': patient['现病史'], 'work': patient['个人史']['工作、学习情况']}
+
+    def story_template(self):
+        """读取背景故事模板（只读取一次）"""
+        if getattr(self, '_story_template', None) is None:
             with open(os.path.join(self.prompt_path, 'patient', 'patient_background.txt')) as f:
-                text_prompt = f.readlines()[0]
-                
+                self._story_template = f.readlines()[0]
+        return self._story_template
+
+    def plan_background_story(self, patient, story_index, output_dir):
+        """
+        确定单个背景故事的全部输入，并计算输入的内容哈希
+        关键词使用由患者编号和故事编号派生的种子采样，因此重复运行得到相同的输入
+        
+        Args:
+            patient (dict): 患者信息字典
+            story_index (int): 故事编号
+            output_dir (str): 输出目录
+            
+        Returns:
+            dict: 故事生成计划，包含清单键、输出路径、种子、关键词、提示词和输入哈希
+        """
+        seed = '{}:{}:{}'.format(SystemConfig.STORY_SEED, patient['患者'], story_index)
+        dict_for_gen = self.key_word_selelction(*self.story_modes(patient))
+        fields = None
+        keywords = None
+        prompt = None
+        if dict_for_gen is not None:
+            fields = self.story_fields(patient)
+            keywords = self.sample_story_keywords(dict_for_gen, random.Random(seed))
             # 使用患者信息和生成的关键词填充模板
-            text_prompt = text_prompt.format(age=patient['年龄'],gender=patient['性别'],diagnosis=patient['诊断结果'],illness=patient['现病史'],work=patient['个人史']['工作、学习情况'],
-                                            time=dict_for_gen['time'],poeple=dict_for_gen['people'],experience=dict_for_gen['experience'])
+            prompt = self.story_template().format(time=keywords['time'], poeple=keywords['people'], experience=keywords['experience'], **fields)
+        inputs = {
+            'fields': fields,
+            'keywords': keywords,
+            'seed': seed,
+            'model': llm_tools_api.routed_model('background_gen', get_model_name()),
+            'prompt_version': SystemConfig.STORY_PROMPT_VERSION,
+            'template': self.story_template(),
+        }
+        input_hash = hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return {
+            'key': f'patient_{patient["患者"]}/story_{story_index}',
+            'output_path': os.path.join(output_dir, f'patient_{patient["患者"]}', f'story_{story_index}.txt'),
+            'seed': seed,
+            'keywords': keywords,
+            'prompt': prompt,
+            'input_hash': input_hash,
+        }
+
+    def story_gen_for_background(self, plan):
+        """
+        为患者生成背景故事
+        
+        Args:
+            plan (dict): plan_background_story 返回的故事生成计划
             
+        Returns:
+            str: 生成的背景故事文本
+        """
+        if plan['prompt'] is not None:
+            print(plan['keywords'])
             # 调用API生成背景故事
-            response = llm_tools_api.api_load_for_background_gen(get_model_name(), text_prompt)
+            response = llm_tools_api.api_load_for_background_gen(get_model_name(), plan['prompt'])
             return response
         else:
             return ''
 
-    def save_background_story(self, patient, output_path):
+    def save_background_story(self, plan):
         """
         保存患者背景故事到文件
+        先写入临时文件再替换，中断的运行不会留下不完整的故事
         
         Args:
-            patient (dict): 患者信息字典
-            output_path (str): 输出文件路径
+            plan (dict): plan_background_story 返回的故事生成计划
         """
-        age = patient['年龄']
-        gender = patient['性别']
-        
-        # 设置性别模式
-        if gender == "男":
-            self.gender_mode = 'male'
-        else:
-            self.gender_mode = 'female'
-            
-        # 设置年龄模式（50岁以下使用具体年龄，50岁以上不设置年龄模式）
-        if int(age) <= 50:
-            self.age_mode = str(age)
-        else:
-            self.age_mode = None
-            
         # 生成背景故事
-        story = self.story_gen_for_background(patient)
+        story = self.story_gen_for_background(plan)
+        self.write_background_story(plan, story)
+
+    def write_background_story(self, plan, story):
+        """
+        写出背景故事（同步生成和批处理模式共用）
+        
+        Args:
+            plan (dict): plan_background_story 返回的故事生成计划
+            story (str): 生成的背景故事文本
+        """
         story = story.replace("\n", "")  # 移除换行符
         
         # 保存故事到文件
-        with open(output_path, 'w') as f:
+        tmp_path = plan['output_path'] + '.tmp'
+        with open(tmp_path, 'w') as f:
             f.write(story)
+        os.replace(tmp_path, plan['output_path'])
     
-    def generate_background_story_parallel(self, patient_template, story_index, output_dir):
+    def generate_background_story_parallel(self, plan, manifest):
         """
         为单个患者生成单个背景故事（用于并行处理）
         
         Args:
-            patient_template (dict): 患者模板信息
-            story_index (int): 故事编号
-            output_dir (str): 输出目录
+            plan (dict): plan_background_story 返回的故事生成计划
+            manifest (StoryManifest): 故事清单，生成成功后记录输入哈希
             
         Returns:
             str: 成功信息或错误信息
         """
         try:
             # 创建患者专属目录（如果不存在）
-            patient_dir = os.path.join(output_dir, f'patient_{patient_template["患者"]}')
-            if not os.path.exists(patient_dir):
-                os.makedirs(patient_dir, exist_ok=True)
-            
-            # 定义输出文件路径
-            output_path = os.path.join(patient_dir, f'story_{story_index}.txt')
+            os.makedirs(os.path.dirname(plan['output_path']), exist_ok=True)
             
             # 生成并保存背景故事
-            self.save_background_story(patient_template, output_path)
+            self.save_background_story(plan)
+            manifest.record(plan)
             
-            return f"成功生成患者 {patient_template['患者']} 的故事 {story_index}"
+            return f"成功生成 {plan['key']}"
         except Exception as e:
-            return f"生成患者 {patient_template['患者']} 的故事 {story_index} 时出错: {e}"
+            return f"生成 {plan['key']} 时出错: {e}"
 
-    def statistics(self):
+    def story_batch_requests(self, plans, manifest):
         """
-        对患者案例进行统计分析
-        统计内容包括：总数、性别分布、年龄分布、ICD编码分布、家族史和个人史情况
+        批处理模式：为背景故事生成计划生成请求
+        没有对应关键词文件的计划（不需要调用API）直接写出空故事
+
+        Returns:
+            tuple: ((custom_id, 请求参数) 列表, 需要写回结果的计划列表)
         """
-        # 读取患者数据
-        with open(self.json_path, 'r') as f:
-            patient_data = json.load(f)
-            
-        total_num = len(patient_data)
-        gender = [0, 0]    # 性别统计：[男, 女]
-        age = [0, 0, 0, 0, 0, 0, 0, 0]    # 年龄段统计：[10,20,30,40,50,60,70,80]
-        icd_code = {}      # ICD编码统计
-        family = [0, 0]    # 家族史统计：[无家族史, 有家族史]
-        personal = [0, 0]  # 个人疾病史统计：[无疾病史, 有疾病史]
-        
-        # 遍历所有患者案例进行统计
-        for case in patient_data:
-            # 性别统计
-            if case['性别'] == '男':
-                gender[0] += 1
-            else:
-                gender[1] += 1
-                
-            # 年龄统计（按十年为单位）
-            if case['年龄'] == 10:
-                age[0] += 1
-            elif case['年龄'] == 20:
-                age[1] += 1
-            elif case['年龄'] == 30:
-                age[2] += 1
-            elif case['年龄'] == 40:
-                age[3] += 1
-            elif case['年龄'] == 50:
-                age[4] += 1
-            elif case['年龄'] == 60:
-                age[5] += 1
-            elif case['年龄'] == 70:
-                age[6] += 1
-            elif case['年龄'] == 80:
-                age[7] += 1
-                
-            # 家族史统计
-            if case['家族史'] == '无':
-                family[0] += 1
-            else:
-                family[1] += 1
-                
-            # 个人疾病史统计
-            if case['重要或相关躯体疾病史'] == '无':
-                personal[0] += 1
-            else:
-                personal[1] += 1
-                
-            # ICD编码统计
-            icd = case['ICD编码']
-            icd = icd.split(',')  # 分割多个ICD编码
-            for i in icd:
-                if i in icd_code.keys():
-                    icd_code[i] += 1
-                else:
-                    icd_code[i] = 1
-                    
-        # 数据一致性检查
-        assert gender[0]+gender[1] == total_num == family[0]+family[1] == personal[0]+personal[1] == sum(age)
-        print(age, gender, icd_code, family, personal)            
+        requests = []
+        batch_plans = []
+        for plan in plans:
+            if plan['prompt'] is None:
+                self.generate_background_story_parallel(plan, manifest)
+                continue
+            requests.append((plan['key'], llm_tools_api.background_gen_request(get_model_name(), plan['prompt'])))
+            batch_plans.append(plan)
+        return requests, batch_plans
 
-# 主程序执行部分
-# 创建患者案例处理器实例
-patient = PatientCases(PATIENT_CASES_ORIGIN_PATH, PATIENT_CASES_JSON_PATH, PROMPT_PATH, use_api=True)
-
-# 生成患者案例JSON文件
-if not os.path.exists(PATIENT_CASES_JSON_PATH):
-    patient.patient_cases_json()
-
-# 输出患者案例的统计信息
-patient.statistics()
-
-# 设置每个患者案例生成的对话数量
-NUM = SystemConfig.NUM_CONVERSATIONS    # 1个患者案例将用于生成5个对话
-
-# 读取患者信息JSON文件
-with open(PATIENT_CASES_JSON_PATH, 'r') as f:
-    patient_info = json.load(f)
-
-# 为每个患者模板生成背景经历故事（并行处理）
-print(f"开始并行生成 {len(patient_info)} 个患者的背景故事，每个患者生成 {NUM} 个故事...")
-
-# 创建所有需要处理的任务列表
-tasks = []
-for patient_template in patient_info:
-    for i in range(NUM):
-        tasks.append({
-            'patient_template': patient_template,
-            'story_index': i + 1,
-            'output_dir': OUTPUT_PASTEXP_PATH
-        })
-
-print(f"总共需要生成 {len(tasks)} 个背景故事")
-
-# 使用线程池并行生成背景故事
-max_workers = min(ConcurrencyConfig.MAX_STORY_GENERATION_WORKERS, len(tasks))  # 限制最大并发数，避免过度并发
-print(f"使用 {max_workers} 个并发线程进行处理...")
-
-def process_story_task(task):
-    """处理单个故事生成任务"""
-    return patient.generate_background_story_parallel(
-        task['patient_template'], 
-        task['story_index'], 
-        task['output_dir']
-    )
-
-with ThreadPoolExecutor(max_workers=max_workers) as executor:
-    # 提交所有任务
-    future_to_task = {executor.submit(process_story_task, task): task for task in tasks}
-    
-    # 收集结果并显示进度
-    success_count = 0
-    error_count = 0
-    
-    for future in tqdm(as_completed(future_to_task), total=len(tasks), desc="背景故事生成进度"):
-        result = future.result()
-        if "成功生成" in result:
+    def ingest_story_batch(self, plans, responses, errors, manifest):
+        """
+        批处理模式：写出生成的背景故事并记录到清单，失败的故事在下一次 prepare 时重新加入
+
+        Returns:
+            tuple: (成功数, 失败数)
+        """
+        success_count = error_count = 0
+        for plan in plans:
+            response = responses.get(plan['key'])
+            if response is None:
+                error_count += 1
+                print(f"错误: 生成 {plan['key']} 时出错: {errors.get(plan['key'], '没有结果')}")
+                continue
+            llm_tools_api.AUX_LEDGER.record('background_gen', llm_tools_api.routed_model('background_gen', get_model_name()),
+                                            llm_tools_api.usage_tokens(response),
+                                            ModelConfig.BATCH_PRICE_SCALE)
+            os.makedirs(os.path.dirname(plan['output_path']), exist_ok=True)
+            self.write_background_story(plan, llm_tools_api.completion_text(response) or '')
+            manifest.record(plan)
             success_count += 1
+        return success_count, error_count
+
+    def statistics(self, age_bins=None):
+        """
+        对患者案例进行统计分析（见 cohort_profile.py）
+        统计内容包括：总数、性别分布、年龄分布、ICD编码分布、家族史和躯体疾病史情况
+
+        Args:
+            age_bins (list, optional): 年龄分箱边界（左闭右开），默认为 SystemConfig.COHORT_AGE_BINS
+
+        Returns:
+            CohortProfile: 患者案例画像
+        """
+        profile = CohortProfile.from_json(self.json_path)
+        none = profile.none.sum()
+        print(f"共 {len(profile)} 个患者案例")
+        print("年龄分布:", profile.age_histogram(age_bins).to_dict())
+        print("性别分布:", profile.gender_counts().to_dict())
+        print("ICD编码分布:", profile.icd_counts().to_dict())
+        print(f"家族史：无 {none['家族史']}，有 {len(profile) - none['家族史']}")
+        print(f"躯体疾病史：无 {none['重要或相关躯体疾病史']}，有 {len(profile) - none['重要或相关躯体疾病史']}")
+        return profile
+
+def plan_missing_stories(patient, patient_info, num, manifest):
+    """
+    根据清单筛选缺失或输入已变化的故事
+
+    Returns:
+        tuple: (需要生成的故事计划列表, 已是最新的故事数, 无法确定输入的故事数)
+    """
+    tasks = []
+    fresh_count = 0
+    error_count = 0
+    for patient_template in patient_info:
+        for i in range(num):
+            try:
+                plan = patient.plan_background_story(patient_template, i + 1, OUTPUT_PASTEXP_PATH)
+            except Exception as e:
+                error_count += 1
+                print(f"错误: 无法确定患者 {patient_template['患者']} 的故事 {i + 1} 的输入: {e}")
+                continue
+            if manifest.is_fresh(plan):
+                fresh_count += 1
+            else:
+                tasks.append(plan)
+    return tasks, fresh_count, error_count
+
+def run_batch(patient, action, stage, runner):
+    """
+    批处理模式（见 batch_jobs.py）
+
+    Args:
+        patient (PatientCases): 患者案例处理器
+        action (str): 'prepare'（写出请求文件）、'submit'（提交，local 执行完成后直接写回）或 'collect'（下载结果并写回）
+        stage (str): 'extraction'（信息提取，写回患者JSON）或 'story'（背景故事，写回故事目录）
+        runner (str): 'openai'（批处理接口）或 'local'（vLLM离线引擎）
+    """
+    directory = batch_jobs.stage_dir(stage)
+    # 请求文件中的模型和提交的服务地址按该阶段调用类型的路由确定
+    model_name, client = llm_tools_api.routed_client('extraction' if stage == 'extraction' else 'background_gen', get_model_name())
+    manifest = StoryManifest(os.path.join(OUTPUT_PASTEXP_PATH, STORY_MANIFEST_NAME))
+
+    if action == 'prepare':
+        if stage == 'extraction':
+            requests, plan = patient.extraction_batch_requests()
+        else:
+            with open(PATIENT_CASES_JSON_PATH, 'r') as f:
+                patient_info = json.load(f)
+            tasks, fresh_count, _ = plan_missing_stories(patient, patient_info, SystemConfig.NUM_CONVERSATIONS, manifest)
+            print(f"已有 {fresh_count} 个故事是最新的，需要生成 {len(tasks)} 个背景故事")
+            requests, plan = patient.story_batch_requests(tasks, manifest)
+        batch_jobs.write_requests(directory, requests, plan)
+        print(f"已写出 {len(requests)} 个请求到 {os.path.join(directory, batch_jobs.REQUESTS_NAME)}")
+        return
+
+    if action == 'submit':
+        if runner == 'local':
+            batch_jobs.run_local(directory, model_name)
         else:
-            error_count += 1
-            print(f"错误: {result}")
+            batch_id = batch_jobs.submit_openai(directory, client)
+            print(f"已提交批处理任务 {batch_id}，完成后运行 --batch collect --stage {stage}")
+            return
+    elif not batch_jobs.has_results(directory):
+        status = batch_jobs.collect_openai(directory, client)
+        if status != 'completed':
+            print(f"批处理任务状态: {status}")
+            return
+
+    responses, errors = batch_jobs.read_results(directory)
+    plan = batch_jobs.read_plan(directory)
+    if stage == 'extraction':
+        failed = patient.ingest_extraction_batch(plan, responses, errors)
+        print(f"已写出 {len(plan)} 个患者到 {PATIENT_CASES_JSON_PATH}，其中 {failed} 个提取失败")
+    else:
+        success_count, error_count = patient.ingest_story_batch(plan, responses, errors, manifest)
+        manifest.compact()
+        print(f"成功生成: {success_count} 个故事，生成失败: {error_count} 个故事（重新 prepare 可只处理失败的故事）")
+    print(f"辅助调用花费: {llm_tools_api.AUX_LEDGER.summary()}")
+
+# 主程序执行部分
+def main():
+    parser = argparse.ArgumentParser(description='生成患者案例JSON和背景故事')
+    parser.add_argument('--batch', choices=['prepare', 'submit', 'collect'], default=None,
+                        help='批处理模式：写出请求文件、提交、下载结果并写回')
+    parser.add_argument('--stage', choices=['extraction', 'story'], default='story', help='批处理的阶段')
+    parser.add_argument('--runner', choices=['openai', 'local'], default='openai',
+                        help='openai：服务商的批处理接口；local：vLLM离线引擎')
+    args = parser.parse_args()
+
+    ensure_dirs_exist()
+
+    # 创建患者案例处理器实例
+    patient = PatientCases(PATIENT_CASES_ORIGIN_PATH, PATIENT_CASES_JSON_PATH, PROMPT_PATH, use_api=True)
+
+    if args.batch:
+        run_batch(patient, args.batch, args.stage, args.runner)
+        return
+
+    # 生成患者案例JSON文件
+    if not os.path.exists(PATIENT_CASES_JSON_PATH):
+        patient.patient_cases_json()
+
+    # 输出患者案例的统计信息
+    patient.statistics()
+
+    # 设置每个患者案例生成的对话数量
+    NUM = SystemConfig.NUM_CONVERSATIONS    # 1个患者案例将用于生成5个对话
+
+    # 读取患者信息JSON文件
+    with open(PATIENT_CASES_JSON_PATH, 'r') as f:
+        patient_info = json.load(f)
+
+    # 为每个患者模板生成背景经历故事（并行处理）
+    print(f"开始并行生成 {len(patient_info)} 个患者的背景故事，每个患者生成 {NUM} 个故事...")
+
+    # 根据清单筛选缺失或输入已变化的故事，只为这些故事创建任务
+    manifest = StoryManifest(os.path.join(OUTPUT_PASTEXP_PATH, STORY_MANIFEST_NAME))
+    tasks, fresh_count, error_count = plan_missing_stories(patient, patient_info, NUM, manifest)
+
+    print(f"已有 {fresh_count} 个故事是最新的，总共需要生成 {len(tasks)} 个背景故事")
+
+    # 使用线程池并行生成背景故事
+    max_workers = max(1, min(ConcurrencyConfig.MAX_STORY_GENERATION_WORKERS, len(tasks)))  # 限制最大并发数，避免过度并发
+    print(f"使用 {max_workers} 个并发线程进行处理...")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 提交所有任务
+        future_to_task = {executor.submit(patient.generate_background_story_parallel, plan, manifest): plan for plan in tasks}
+        
+        # 收集结果并显示进度
+        success_count = 0
+        
+        for future in tqdm(as_completed(future_to_task), total=len(tasks), desc="背景故事生成进度"):
+            result = future.result()
+            if "成功生成" in result:
+                success_count += 1
+            else:
+                error_count += 1
+                print(f"错误: {result}")
+
+    manifest.compact()
+
+    print(f"\n背景故事生成完成!")
+    print(f"跳过最新: {fresh_count} 个故事")
+    print(f"成功生成: {success_count} 个故事")
+    print(f"生成失败: {error_count} 个故事")
+    print(f"辅助调用花费: {llm_tools_api.AUX_LEDGER.summary()}")
+
 
-print(f"\n背景故事生成完成!")
-print(f"成功生成: {success_count} 个故事")
-print(f"生成失败: {error_count} 个故事")
+if __name__ == "__main__":
+    main()
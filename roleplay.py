@@ -1,40 +1,176 @@
+"""
+角色扮演基线对话生成
+医生和患者只依据对话历史进行角色扮演（不使用诊断树和背景故事），输出格式与 DataSyn 相同。
+以对话为单位并行生成：每个完成的对话先写入 OUTPUT_DIR/.partial/patient_N/conversation_i.json，
+某个患者的全部对话完成后合并为 patient_N.json；中断后重新运行会跳过已完成的患者和对话
+
+用法：
+    python roleplay.py --workers 16
+    python roleplay.py --cases ./raw_data/pat_smhc_train.json --num 5 --output ./Roleplay
+"""
 import llm_tools_api
+import transcript
+import argparse
 import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from doctor import Roleplay_Doctor
 from patient import Roleplay_Patient
 from tqdm import tqdm
-import os
+from config import SystemConfig
 
 NUM = 5
 PATIENT_INFO_PATH = './raw_data/pa20.json'
 MODEL_NAME = 'gpt-4o'
 OUTPUT_DATASYN_PATH = './Roleplay'
 
-with open(PATIENT_INFO_PATH, 'r') as f:
-    patient_info = json.load(f)
-
-for patient_template in tqdm(patient_info):
-    total_output_list = []
-    for i in range(NUM):
-        dialogue_history = []
-        output_list = []
-        output_dict = {}
-        doc = Roleplay_Doctor(patient_template, MODEL_NAME, True)
-        pat = Roleplay_Patient(patient_template, MODEL_NAME, True)
-        
-        while not llm_tools_api.api_isroleplay_end(MODEL_NAME, dialogue_history):
-            doctor_response = doc.doctor_response_gen(dialogue_history)
-            output_dict['doctor'] = doctor_response
-            dialogue_history.append('医生：' + doctor_response)
-            print("医生：", doctor_response)
-            patient_response = pat.patient_response_gen(dialogue_history)
-            output_dict['patient'] = patient_response
-            dialogue_history.append('患者：' + patient_response)
-            output_list.append(output_dict)
-            output_dict = {}
-            print("患者：", patient_response)
-        result = patient_template["处理意见"]
-        output_list.append({"doctor":result})
-        total_output_list.append({"conversation":output_list})
-    with open(os.path.join(OUTPUT_DATASYN_PATH, 'patient_{}.json'.format(patient_template['患者'])), 'w') as f:
-        json_data = json.dump(total_output_list, f, indent=2, ensure_ascii=False)
\ No newline at end of file
+# 各类调用（结束判断、医生回复、患者回复）的耗时（秒）
+timing_lock = threading.Lock()
+call_timings = defaultdict(list)
+
+
+def timed(call_type, func, *args):
+    """调用 func 并记录耗时"""
+    start = time.perf_counter()
+    result = func(*args)
+    with timing_lock:
+        call_timings[call_type].append(time.perf_counter() - start)
+    return result
+
+
+def timing_summary():
+    """各类调用的次数和耗时分布"""
+    with timing_lock:
+        return {call_type: {'calls': len(values),
+                            'mean': sum(values) / len(values),
+                            'p50': llm_tools_api.percentile(values, 50),
+                            'p95': llm_tools_api.percentile(values, 95)}
+                for call_type, values in call_timings.items() if values}
+
+
+def partial_path(output_dir, patient_id, i):
+    return os.path.join(output_dir, '.partial', 'patient_{}'.format(patient_id), 'conversation_{}.json'.format(i))
+
+
+def generate_conversation(patient_template, model_name):
+    """
+    生成单个角色扮演对话
+
+    Returns:
+        dict: {"conversation": [{"doctor": ..., "patient": ...}, ..., {"doctor": 处理意见}]}
+    """
+    # 缓存每句发言的渲染结果，结束判断和提示词中的历史不必每次重新格式化
+    dialogue_history = llm_tools_api.DialogueHistory()
+    output_list = []
+    doc = Roleplay_Doctor(patient_template, model_name, True)
+    pat = Roleplay_Patient(patient_template, model_name, True)
+
+    while not timed('end_check', llm_tools_api.api_isroleplay_end, model_name, dialogue_history):
+        doctor_response = timed('doctor', doc.doctor_response_gen, dialogue_history)
+        dialogue_history.append('医生：' + doctor_response)
+        patient_response = timed('patient', pat.patient_response_gen, dialogue_history)
+        dialogue_history.append('患者：' + patient_response)
+        output_list.append({'doctor': doctor_response, 'patient': patient_response})
+    output_list.append({"doctor": patient_template["处理意见"]})
+    return {"conversation": output_list}
+
+
+def run_conversation(patient_template, i, model_name, output_dir):
+    """生成第i个对话并写入中间文件（原子替换），已存在时直接读取"""
+    path = partial_path(output_dir, patient_template['患者'], i)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    with transcript.conversation('roleplay/patient_{}/conversation_{}'.format(patient_template['患者'], i)):
+        conversation = generate_conversation(patient_template, model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(conversation, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    return conversation
+
+
+def save_patient(output_dir, patient_id, conversations):
+    """按对话编号写出 patient_N.json，并删除中间文件"""
+    path = os.path.join(output_dir, 'patient_{}.json'.format(patient_id))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(conversations, f, indent=2, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    shutil.rmtree(os.path.dirname(partial_path(output_dir, patient_id, 0)), ignore_errors=True)
+
+
+def generate(patient_info, num, model_name, output_dir, workers):
+    """
+    以对话为单位并行生成全部患者的角色扮演对话
+
+    Args:
+        patient_info (list): 患者案例
+        num (int): 每个患者的对话数
+        model_name (str): 模型名称
+        output_dir (str): 输出目录
+        workers (int): 并发对话数
+
+    Returns:
+        tuple: (完成的患者数, 失败的对话数)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pending = [patient_template for patient_template in patient_info
+               if not os.path.exists(os.path.join(output_dir, 'patient_{}.json'.format(patient_template['患者'])))]
+    print(f"共 {len(patient_info)} 个患者，{len(patient_info) - len(pending)} 个已完成，使用 {workers} 个线程")
+
+    results = {patient_template['患者']: [None] * num for patient_template in pending}
+    remaining = {patient_template['患者']: num for patient_template in pending}
+    completed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_conversation, patient_template, i, model_name, output_dir): (patient_template['患者'], i)
+                   for patient_template in pending for i in range(num)}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="角色扮演对话进度"):
+            patient_id, i = futures[future]
+            try:
+                results[patient_id][i] = future.result()
+            except Exception as exc:
+                print(f"患者 {patient_id} 对话{i+1} 生成时发生异常: {exc}")
+                failed += 1
+                continue
+            remaining[patient_id] -= 1
+            if remaining[patient_id] == 0:
+                save_patient(output_dir, patient_id, results.pop(patient_id))
+                completed += 1
+    if not failed and os.path.isdir(os.path.join(output_dir, '.partial')):
+        shutil.rmtree(os.path.join(output_dir, '.partial'), ignore_errors=True)
+    return completed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成角色扮演基线对话')
+    parser.add_argument('--cases', default=PATIENT_INFO_PATH, help='患者案例JSON文件')
+    parser.add_argument('--output', default=OUTPUT_DATASYN_PATH, help='输出目录')
+    parser.add_argument('--model', default=MODEL_NAME, help='模型名称')
+    parser.add_argument('--num', type=int, default=NUM, help='每个患者生成的对话数')
+    parser.add_argument('--workers', type=int, default=SystemConfig.ROLEPLAY_WORKERS, help='并发生成的对话数')
+    parser.add_argument('--transcript-mode', choices=['record', 'replay'], default=SystemConfig.TRANSCRIPT_MODE,
+                        help='录制或回放LLM调用，见 transcript.py')
+    parser.add_argument('--transcripts', default=SystemConfig.TRANSCRIPT_DIR, help='转录目录')
+    args = parser.parse_args()
+    SystemConfig.TRANSCRIPT_MODE = args.transcript_mode
+    SystemConfig.TRANSCRIPT_DIR = args.transcripts
+
+    with open(args.cases, 'r') as f:
+        patient_info = json.load(f)
+
+    completed, failed = generate(patient_info, args.num, args.model, args.output, args.workers)
+    print(f"本次完成 {completed} 个患者，失败 {failed} 个对话（重新运行可继续生成）")
+    print("调用耗时统计:", timing_summary())
+    if SystemConfig.STREAMING:
+        print("流式生成延迟统计:", llm_tools_api.STREAM_STATS.summary())
+    if SystemConfig.JUDGE_DISTILL:
+        from judge_distill import JUDGE_STATS
+        print("本地判断分类器统计:", JUDGE_STATS.summary())
+
+
+if __name__ == "__main__":
+    main()
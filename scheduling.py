@@ -0,0 +1,148 @@
+"""
+对话调度
+对话的轮数差异很大（话题数取决于诊断树，parse 会展开为多个话题，话题结束由模型判断），
+按患者和对话编号的顺序（FIFO）派发时，运行末尾常出现少数进程仍在生成长对话的长尾。
+TurnPredictor 根据 dynamic_select 采样的话题计划和历史对话的轮数预测每个对话的轮数，
+longest_first 按预测轮数从长到短派发，缩短整个运行的完成时间（makespan）。
+
+预测方法：
+1. dynamic_select 会访问诊断树的全部叶节点，计划话题数只取决于诊断树文件（性别、是否为青少年），与采样顺序无关
+2. 每个计划话题的轮数由同一诊断树的历史对话估计（没有历史时使用全部历史，再没有时使用 SCHEDULE_TURNS_PER_TOPIC）
+3. 同一患者有历史对话时，与其历史平均轮数加权，按诊断树的预测相当于 SCHEDULE_PATIENT_WEIGHT 个对话
+
+历史对话来自输出目录中已有的 patient_N.json（之前运行的结果）和队列中已完成的对话，因预算截断的对话不计入。
+新生成的患者通常没有自己的历史对话，这时预测只取决于诊断树（性别、是否为青少年），只能区分几档；
+调度顺序只在多个工作进程（队列模式）同时运行时影响完成时间，线程模式目前只使用一个线程。
+默认仍按FIFO派发，对比 FIFO 的完成时间见 benchmarks/schedule_makespan.py
+"""
+import glob
+import heapq
+import json
+import os
+import random
+import re
+
+from config import SystemConfig, get_diagtree_path, get_doctor_prompt_path
+from diagtree import DiagTree, diagtree_file
+
+
+class TurnPredictor:
+    """对话轮数（医生提问+患者回答为一轮）预测器"""
+
+    def __init__(self, diagtree_dir=None, turns_per_topic=None, patient_weight=None):
+        """
+        Args:
+            diagtree_dir (str, optional): 诊断树目录
+            turns_per_topic (float, optional): 没有历史对话时每个计划话题的轮数
+            patient_weight (float, optional): 与患者历史平均轮数加权时，按诊断树的预测相当于多少个对话
+        """
+        self.diagtree_dir = diagtree_dir or get_diagtree_path()
+        self.turns_per_topic = turns_per_topic or SystemConfig.SCHEDULE_TURNS_PER_TOPIC
+        self.patient_weight = patient_weight if patient_weight is not None else SystemConfig.SCHEDULE_PATIENT_WEIGHT
+        self.plan_sizes = {}
+        self.tree_stats = {}    # 诊断树文件 -> [对话数, 轮数合计, 计划话题数合计]
+        self.patient_stats = {}    # 患者编号（字符串） -> [对话数, 轮数合计]
+
+    def plan_size(self, patient_template):
+        """
+        患者对话的计划话题数（按 Doctor 的规则选择诊断树并采样一次 dynamic_select）
+
+        Returns:
+            tuple: (诊断树文件, 计划话题数)
+        """
+        path = diagtree_file(self.diagtree_dir, patient_template)
+        if path not in self.plan_sizes:
+            tree = DiagTree(model_name=None, prompts={'doctor': get_doctor_prompt_path(), 'diagtree': path}, rng=random.Random(0))
+            tree.load_tree()
+            self.plan_sizes[path] = len(tree.dynamic_select())
+        return path, self.plan_sizes[path]
+
+    def observe(self, patient_template, turns):
+        """记录一个历史对话的轮数"""
+        path, topics = self.plan_size(patient_template)
+        stats = self.tree_stats.setdefault(path, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += turns
+        stats[2] += topics
+        stats = self.patient_stats.setdefault(str(patient_template['患者']), [0, 0])
+        stats[0] += 1
+        stats[1] += turns
+
+    def observed(self):
+        """已记录的历史对话数"""
+        return sum(stats[0] for stats in self.tree_stats.values())
+
+    def predict(self, patient_template):
+        """预测患者一个对话的轮数"""
+        path, topics = self.plan_size(patient_template)
+        stats = self.tree_stats.get(path)
+        if stats is None and self.tree_stats:
+            stats = [sum(column) for column in zip(*self.tree_stats.values())]
+        rate = stats[1] / stats[2] if stats else self.turns_per_topic
+        estimate = topics * rate
+        count, total = self.patient_stats.get(str(patient_template['患者']), (0, 0))
+        return (total + self.patient_weight * estimate) / (count + self.patient_weight)
+
+    def observe_outputs(self, output_dir, patient_info):
+        """
+        从输出目录中已有的 patient_N.json 记录历史对话
+
+        Returns:
+            int: 记录的对话数
+        """
+        # 文件名中的编号是字符串，案例中的编号可能是数字也可能是字符串
+        templates = {str(patient_template['患者']): patient_template for patient_template in patient_info}
+        observed = 0
+        for path in glob.glob(os.path.join(output_dir, 'patient_*.json')):
+            match = re.match(r'patient_(.+)\.json$', os.path.basename(path))
+            if match is None or match.group(1) not in templates:
+                continue
+            try:
+                with open(path) as f:
+                    conversations = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for item in conversations:
+                if item is None or item.get('truncated'):
+                    continue
+                self.observe(templates[match.group(1)], len(item['conversation']))
+                observed += 1
+        return observed
+
+    def observe_queue(self, queue, patient_info):
+        """从任务队列中已完成的对话记录历史对话，返回记录的对话数"""
+        templates = {str(patient_template['患者']): patient_template for patient_template in patient_info}
+        observed = 0
+        for patient_id, _, turns in queue.turn_counts():
+            if str(patient_id) in templates:
+                self.observe(templates[str(patient_id)], turns)
+                observed += 1
+        return observed
+
+
+def longest_first(jobs, predict):
+    """
+    按预测轮数从长到短排序，预测相同的保持原顺序
+
+    Args:
+        jobs (list): 任务
+        predict (callable): 返回任务的预测轮数
+
+    Returns:
+        list: 排序后的任务
+    """
+    return sorted(jobs, key=predict, reverse=True)
+
+
+def makespan(durations, workers):
+    """
+    按给定顺序把任务派发给最早空闲的工作者（与队列中空闲进程领取下一个任务相同），返回全部完成的时间
+
+    Args:
+        durations (list): 按派发顺序排列的任务耗时
+        workers (int): 工作者数
+    """
+    free = [0.0] * workers
+    for duration in durations:
+        heapq.heappush(free, heapq.heappop(free) + duration)
+    return max(free)
@@ -0,0 +1,266 @@
+"""
+多节点静态分片与合并
+main.py 通过 --shard-index/--shard-count 只处理患者案例列表中属于本分片的患者：
+按患者编号排序后轮流分配，同一案例文件在任意节点上得到相同的划分。
+每个分片写入独立的目录 DataSyn_shards/shard-XXX-of-YYY/，包括对话输出和记录花费、完成情况的 ledger.json；
+所有分片结束后运行合并命令，校验每个分片都完整后生成标准的 DataSyn 目录，并汇总花费与统计信息
+
+用法：
+    python main.py --shard-index 0 --shard-count 4
+    python sharding.py --shard-count 4 --output ./DataSyn
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from collections import Counter
+
+from config import get_output_dir, get_patient_info_path, PathConfig
+
+LEDGER_NAME = 'ledger.json'
+MERGED_LEDGER_NAME = 'merged_ledger.json'
+
+
+def id_order(patient_id):
+    """
+    患者编号的排序键：编号统一按字符串处理（案例文件中可能是 1 也可能是 '1'，ledger.json 的键总是字符串），
+    纯数字的编号按数值排在前面，其余按字符串排序
+    """
+    patient_id = str(patient_id)
+    return (0, int(patient_id), '') if patient_id.isdigit() else (1, 0, patient_id)
+
+
+def case_ids(patient_info):
+    """返回排序后的全部患者编号（字符串）"""
+    return sorted((str(case['患者']) for case in patient_info), key=id_order)
+
+
+def case_digest(patient_info):
+    """患者编号列表的摘要，用于校验各分片使用的是同一个案例文件"""
+    return hashlib.sha256(json.dumps(case_ids(patient_info)).encode('utf-8')).hexdigest()
+
+
+def select_shard(patient_info, shard_index, shard_count):
+    """
+    选出属于某个分片的患者案例
+
+    Args:
+        patient_info (list): 全部患者案例
+        shard_index (int): 分片编号（从0开始）
+        shard_count (int): 分片总数
+
+    Returns:
+        list: 按患者编号排序后第 shard_index, shard_index+shard_count, ... 个案例
+    """
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"无效的分片: {shard_index}/{shard_count}")
+    cases = sorted(patient_info, key=lambda case: id_order(case['患者']))
+    return cases[shard_index::shard_count]
+
+
+def shard_dir(shard_index, shard_count, root=None):
+    """分片的输出目录"""
+    return os.path.join(root or PathConfig.SHARD_OUTPUT_DIR, 'shard-{:03d}-of-{:03d}'.format(shard_index, shard_count))
+
+
+def write_ledger(directory, ledger):
+    """原子地写出分片的 ledger.json"""
+    path = os.path.join(directory, LEDGER_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(ledger, f, indent=2, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def read_ledger(directory):
+    path = os.path.join(directory, LEDGER_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def open_shard(directory, ledger):
+    """
+    打开分片的归档（只读取一次索引），JSON输出的分片不需要打开
+
+    Returns:
+        ArchiveReader or None: 归档分片的读取器，JSON输出或归档不存在时返回None
+    """
+    if ledger.get('storage') != 'archive':
+        return None
+    from dialogue_archive import ArchiveReader, INDEX_NAME
+    archive_dir = os.path.join(directory, 'archive')
+    if not os.path.exists(os.path.join(archive_dir, INDEX_NAME)):
+        return None
+    return ArchiveReader(archive_dir)
+
+
+def load_shard_patient(directory, ledger, patient_id, reader=None):
+    """
+    读取分片中单个患者的对话
+
+    Args:
+        reader (ArchiveReader, optional): open_shard 返回的读取器，归档分片需要
+
+    Returns:
+        list or None: patient_N.json 格式的对话，不存在时返回None
+    """
+    if ledger.get('storage') == 'archive':
+        if reader is None:
+            return None
+        return reader.get_patient(patient_id) or None
+    path = os.path.join(directory, 'DataSyn', 'patient_{}.json'.format(patient_id))
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def validate(patient_info, shard_count, root=None):
+    """
+    校验全部分片是否完整
+
+    Args:
+        patient_info (list): 全部患者案例
+        shard_count (int): 分片总数
+        root (str, optional): 分片根目录
+
+    Returns:
+        tuple: (各分片的 (目录, ledger, 读取器) 列表, 问题描述列表)
+    """
+    digest = case_digest(patient_info)
+    shards = []
+    problems = []
+    for shard_index in range(shard_count):
+        directory = shard_dir(shard_index, shard_count, root)
+        ledger = read_ledger(directory)
+        if ledger is None:
+            problems.append(f"分片 {shard_index} 缺少 {LEDGER_NAME}（{directory}）")
+            continue
+        if ledger['shard_count'] != shard_count or ledger['shard_index'] != shard_index:
+            problems.append(f"分片 {shard_index} 的 ledger 记录为 {ledger['shard_index']}/{ledger['shard_count']}")
+            continue
+        if ledger['case_digest'] != digest:
+            problems.append(f"分片 {shard_index} 使用的患者案例文件与当前不一致")
+            continue
+        expected = case_ids(select_shard(patient_info, shard_index, shard_count))
+        if [str(patient_id) for patient_id in ledger['assigned']] != expected:
+            problems.append(f"分片 {shard_index} 分配的患者与确定性划分不一致")
+            continue
+        completed = {str(patient_id) for patient_id in ledger['completed']}
+        # 因超出运行预算未生成的患者不算缺失，合并时跳过
+        rejected = {str(patient_id) for patient_id in ledger.get('rejected', [])}
+        reader = open_shard(directory, ledger)
+        missing = [patient_id for patient_id in expected if patient_id not in rejected and
+                   (patient_id not in completed or load_shard_patient(directory, ledger, patient_id, reader) is None)]
+        if missing:
+            problems.append(f"分片 {shard_index} 缺少 {len(missing)} 个患者的对话: {missing[:20]}")
+        shards.append((directory, ledger, reader))
+    return shards, problems
+
+
+def columnar_output_dir(output_dir):
+    """合并后的列式目录：与 DataSyn 目录同级的 <目录名>_parquet（默认即 PathConfig.COLUMNAR_OUTPUT_DIR）"""
+    return os.path.normpath(output_dir) + '_parquet'
+
+
+def merge(patient_info, shard_count, output_dir, root=None, allow_partial=False, columnar_dir=None):
+    """
+    将全部分片合并为标准的 DataSyn 目录（每个患者一个 patient_N.json），并汇总花费与统计信息
+
+    Args:
+        patient_info (list): 全部患者案例
+        shard_count (int): 分片总数
+        output_dir (str): 合并后的 DataSyn 目录
+        root (str, optional): 分片根目录
+        allow_partial (bool): 为True时跳过缺失的患者继续合并
+        columnar_dir (str, optional): 合并后的列式目录，默认为 columnar_output_dir(output_dir)
+
+    Returns:
+        dict: 合并后的总账
+    """
+    shards, problems = validate(patient_info, shard_count, root)
+    if problems and not allow_partial:
+        raise ValueError("分片不完整:\n" + "\n".join(problems))
+
+    os.makedirs(output_dir, exist_ok=True)
+    merged = {
+        'shard_count': shard_count,
+        'case_digest': case_digest(patient_info),
+        'patients': 0,
+        'conversations': 0,
+        'total_cost': 0,
+        'patient_costs': {},
+        'budget_hits': Counter(),
+        'spent': 0,
+        'completed_conversations': 0,
+        'rejected_conversations': 0,
+        'rejected_patients': [],
+        'problems': problems,
+    }
+    for directory, ledger, reader in shards:
+        for patient_id in ledger['assigned']:
+            conversations = load_shard_patient(directory, ledger, patient_id, reader)
+            if conversations is None:
+                continue
+            path = os.path.join(output_dir, 'patient_{}.json'.format(patient_id))
+            if ledger.get('storage') == 'archive':
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(conversations, f, indent=2, ensure_ascii=False)
+                os.replace(path + '.tmp', path)
+            else:
+                shutil.copyfile(os.path.join(directory, 'DataSyn', 'patient_{}.json'.format(patient_id)), path + '.tmp')
+                os.replace(path + '.tmp', path)
+            merged['patients'] += 1
+            merged['conversations'] += len(conversations)
+        merged['total_cost'] += ledger['total_cost']
+        merged['patient_costs'].update(ledger['completed'])
+        merged['budget_hits'].update(ledger['budget_hits'])
+        merged['spent'] += ledger['governor']['spent']
+        merged['completed_conversations'] += ledger['governor']['completed']
+        merged['rejected_conversations'] += ledger['governor']['rejected']
+        merged['rejected_patients'].extend(str(patient_id) for patient_id in ledger.get('rejected', []))
+
+        # 列式输出按患者分文件，直接复制到合并后的列式目录
+        shard_columnar_dir = os.path.join(directory, 'parquet')
+        if os.path.isdir(shard_columnar_dir):
+            shutil.copytree(shard_columnar_dir, columnar_dir or columnar_output_dir(output_dir), dirs_exist_ok=True)
+
+    merged['budget_hits'] = dict(merged['budget_hits'])
+    merged['rejected_patients'].sort(key=id_order)
+    with open(os.path.join(root or PathConfig.SHARD_OUTPUT_DIR, MERGED_LEDGER_NAME), 'w') as f:
+        json.dump(merged, f, indent=2, ensure_ascii=False)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='校验并合并 main.py 的分片输出')
+    parser.add_argument('--shard-count', type=int, required=True, help='分片总数')
+    parser.add_argument('--shards', default=PathConfig.SHARD_OUTPUT_DIR, help='分片根目录')
+    parser.add_argument('--cases', default=get_patient_info_path(), help='患者案例JSON文件，需与各分片使用的一致')
+    parser.add_argument('--output', default=get_output_dir(), help='合并后的 DataSyn 目录')
+    parser.add_argument('--columnar-output', default=None, help='合并后的列式目录，默认为与 --output 同级的 <目录名>_parquet')
+    parser.add_argument('--allow-partial', action='store_true', help='分片不完整时仍合并已完成的患者')
+    args = parser.parse_args()
+
+    with open(args.cases, 'r') as f:
+        patient_info = json.load(f)
+    try:
+        merged = merge(patient_info, args.shard_count, args.output, args.shards, args.allow_partial, args.columnar_output)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
+    for problem in merged['problems']:
+        print(problem)
+    print(f"已合并 {args.shard_count} 个分片：{merged['patients']} 个患者，{merged['conversations']} 个对话，"
+          f"总花费 {merged['total_cost']}，输出到 {args.output}")
+    if merged['rejected_patients']:
+        print(f"因超出运行预算未生成的患者 {len(merged['rejected_patients'])} 个")
+    if merged['budget_hits']:
+        print("预算截断的对话数:", merged['budget_hits'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+生成运行的状态接口
+在本机启动一个轻量的HTTP服务，长时间运行时不需要控制台即可查看进度：
+    GET /status   JSON格式：在途对话及其当前话题、等待数、完成/失败数、近期吞吐量、token速率和花费
+    GET /metrics  Prometheus文本格式的同一组指标
+
+线程模式下由 main.py 在对话开始、每轮发言和结束时更新 RunStatus；
+队列模式下工作进程在其他进程中运行，QueueStatus 从队列数据库读取状态（不包含当前话题和token速率）
+
+用法：
+    python main.py --status-port 8000 --quiet
+    curl http://127.0.0.1:8000/status
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import SystemConfig
+
+METRIC_PREFIX = 'mdd_'
+
+
+class RunStatus:
+    """线程模式的运行状态，所有方法线程安全"""
+
+    def __init__(self, total, window=None):
+        """
+        Args:
+            total (int): 本次运行的对话总数
+            window (int, optional): 计算近期吞吐量和token速率的时间窗口（秒）
+        """
+        self.total = total
+        self.window = window or SystemConfig.STATUS_WINDOW_SECONDS
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.in_flight = {}
+        self.completed = 0
+        self.failed = 0
+        self.spent = 0
+        self.tokens = 0
+        self.finish_times = deque()
+        self.token_times = deque()
+
+    def start(self, name, patient_id, conversation_idx):
+        """记录对话开始"""
+        with self.lock:
+            self.in_flight[name] = {'patient': patient_id, 'conversation': conversation_idx, 'topic': None,
+                                    'turns': 0, 'tokens': 0, 'started': time.time()}
+
+    def turn(self, name, topic, tokens):
+        """记录一次发言（医生或患者）及其话题和token数"""
+        now = time.time()
+        with self.lock:
+            conversation = self.in_flight.get(name)
+            if conversation is not None:
+                conversation['turns'] += 1
+                conversation['tokens'] += tokens
+                if topic is not None:
+                    conversation['topic'] = topic
+            self.tokens += tokens
+            self.token_times.append((now, tokens))
+
+    def finish(self, name, cost, failed=False):
+        """记录对话结束及其花费"""
+        with self.lock:
+            self.in_flight.pop(name, None)
+            self.spent += cost
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.finish_times.append(time.time())
+
+    def _trim(self, now):
+        while self.finish_times and self.finish_times[0] < now - self.window:
+            self.finish_times.popleft()
+        while self.token_times and self.token_times[0][0] < now - self.window:
+            self.token_times.popleft()
+
+    def snapshot(self):
+        """当前状态，格式见模块说明"""
+        now = time.time()
+        with self.lock:
+            self._trim(now)
+            # 运行时间不足一个窗口时按实际运行时间计算速率
+            span = max(min(self.window, now - self.start_time), 1e-9)
+            in_flight = []
+            for value in self.in_flight.values():
+                conversation = dict(value)
+                conversation['elapsed'] = now - conversation.pop('started')
+                in_flight.append(conversation)
+            return {
+                'mode': 'threads',
+                'uptime': now - self.start_time,
+                'total': self.total,
+                'in_flight': len(in_flight),
+                'conversations': sorted(in_flight, key=lambda conversation: (conversation['patient'], conversation['conversation'])),
+                'queue_depth': self.total - self.completed - self.failed - len(in_flight),
+                'completed': self.completed,
+                'failed': self.failed,
+                'throughput_per_minute': len(self.finish_times) * 60 / span,
+                'tokens': self.tokens,
+                'tokens_per_second': sum(tokens for _, tokens in self.token_times) / span,
+                'spent': self.spent,
+            }
+
+
+class QueueStatus:
+    """队列模式的运行状态，从 WorkQueue 读取"""
+
+    def __init__(self, queue, window=None):
+        self.queue = queue
+        self.window = window or SystemConfig.STATUS_WINDOW_SECONDS
+        self.start_time = time.time()
+
+    def snapshot(self):
+        now = time.time()
+        status = self.queue.status(self.window)
+        in_flight = [{'patient': patient_id, 'conversation': conversation_idx, 'worker': worker, 'elapsed': now - started}
+                     for patient_id, conversation_idx, worker, started in self.queue.running()]
+        return {
+            'mode': 'queue',
+            'uptime': now - self.start_time,
+            'total': status['pending'] + status['running'] + status['done'] + status['failed'],
+            'in_flight': len(in_flight),
+            'conversations': in_flight,
+            'queue_depth': status['pending'],
+            'completed': status['done'],
+            'failed': status['failed'],
+            'throughput_per_minute': status['recent_per_minute'],
+            'stale_leases': status['stale_leases'],
+            'active_workers': status['active_workers'],
+            'spent': status['spent'],
+        }
+
+
+# Prometheus指标：(快照中的键, 指标类型, 说明)
+METRICS = [
+    ('total', 'gauge', '本次运行的对话总数'),
+    ('in_flight', 'gauge', '正在生成的对话数'),
+    ('queue_depth', 'gauge', '等待开始的对话数'),
+    ('completed', 'counter', '已完成的对话数'),
+    ('failed', 'counter', '失败的对话数'),
+    ('throughput_per_minute', 'gauge', '近期每分钟完成的对话数'),
+    ('tokens', 'counter', '医生和患者消耗的token总数'),
+    ('tokens_per_second', 'gauge', '近期每秒消耗的token数'),
+    ('spent', 'counter', '已结束对话的总花费（美元）'),
+    ('stale_leases', 'gauge', '租约已过期的任务数'),
+    ('active_workers', 'gauge', '持有有效租约的工作进程数'),
+    ('uptime', 'gauge', '状态接口启动后的时间（秒）'),
+]
+
+
+def prometheus_text(snapshot):
+    """将状态快照转换为Prometheus文本格式，在途对话按患者和对话编号输出已进行的发言数和耗时"""
+    lines = []
+    for key, metric_type, description in METRICS:
+        if key not in snapshot:
+            continue
+        name = METRIC_PREFIX + key + ('_total' if metric_type == 'counter' else '')
+        lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {metric_type}', f'{name} {snapshot[key]}'])
+    for key, description in (('turns', '在途对话已进行的发言数'), ('elapsed', '在途对话已进行的时间（秒）')):
+        conversations = [conversation for conversation in snapshot['conversations'] if key in conversation]
+        if not conversations:
+            continue
+        name = METRIC_PREFIX + 'conversation_' + key
+        lines.extend([f'# HELP {name} {description}', f'# TYPE {name} gauge'])
+        for conversation in conversations:
+            lines.append('{}{{patient="{}",conversation="{}"}} {}'.format(
+                name, conversation['patient'], conversation['conversation'], conversation[key]))
+    return '\n'.join(lines) + '\n'
+
+
+def serve(source, port, host=None):
+    """
+    在后台线程中启动状态接口
+
+    Args:
+        source: 提供 snapshot() 的 RunStatus 或 QueueStatus
+        port (int): 端口
+        host (str, optional): 监听地址，默认只监听本机
+
+    Returns:
+        ThreadingHTTPServer: 运行结束时调用 shutdown() 停止
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path in ('/', '/status'):
+                body = json.dumps(source.snapshot(), ensure_ascii=False, indent=2).encode('utf-8')
+                content_type = 'application/json; charset=utf-8'
+            elif path == '/metrics':
+                body = prometheus_text(source.snapshot()).encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 不在控制台输出访问日志
+            pass
+
+    server = ThreadingHTTPServer((host or SystemConfig.STATUS_HOST, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
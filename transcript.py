@@ -0,0 +1,284 @@
+"""
+LLM调用的录制与回放
+录制模式下，所有通过 llm_tools_api 创建的客户端发出的请求及其响应都写入转录文件；
+每个对话一个文件（TRANSCRIPT_DIR/<对话名>.jsonl），第一行记录该对话的随机种子，
+诊断树的话题选择、话题结束的强制判断和医生人设的选择都使用由该种子初始化的随机数生成器。
+不属于任何对话的调用（如患者模板生成中的信息提取）写入 TRANSCRIPT_DIR/global.jsonl。
+
+回放模式下不连接任何模型：对话中的请求按顺序与转录比对（请求不一致时抛出 TranscriptMismatch），
+返回录制的响应，并使用录制的种子，整个流程可以确定性地重新运行，用于编排层的性能基准、回归测试和重新处理输出
+
+用法：
+    python main.py --transcript-mode record --transcripts ./transcripts
+    python main.py --transcript-mode replay --transcripts ./transcripts
+"""
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+from contextlib import contextmanager
+
+from config import PathConfig, SystemConfig
+
+GLOBAL_TRANSCRIPT = 'global'
+
+# 当前线程正在生成的对话的转录
+current_transcript = contextvars.ContextVar('current_transcript', default=None)
+
+
+class TranscriptMismatch(Exception):
+    """回放时请求与录制的不一致，或录制的调用已用完"""
+
+
+def transcript_dir():
+    return SystemConfig.TRANSCRIPT_DIR or PathConfig.TRANSCRIPT_DIR
+
+
+def request_key(kwargs):
+    """请求参数的摘要，用于回放时比对请求"""
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def dump_response(response):
+    if hasattr(response, 'model_dump'):
+        return response.model_dump(mode='json', exclude_none=True)
+    return response
+
+
+class Transcript:
+    """
+    单个对话（或全局调用）的转录文件
+
+    录制时逐条追加写入；回放时对话转录按顺序取出，全局转录按请求摘要取出（全局调用可能来自多个线程）
+    """
+
+    def __init__(self, name, mode, seed=None):
+        self.name = name
+        self.mode = mode
+        self.path = os.path.join(transcript_dir(), name + '.jsonl')
+        self.lock = threading.Lock()
+        self.seed = seed
+        self.entries = []
+        self.by_key = {}
+        self.position = 0
+        if mode == 'record':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'w')
+            self.file.write(json.dumps({'seed': seed}) + '\n')
+            self.file.flush()
+        else:
+            if not os.path.exists(self.path):
+                raise TranscriptMismatch(f"转录文件不存在: {self.path}")
+            self.file = None
+            with open(self.path) as f:
+                self.seed = json.loads(f.readline())['seed']
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.append(entry)
+                        self.by_key.setdefault(entry['key'], []).append(entry)
+
+    def record(self, kwargs, response, stream=False):
+        """追加一条请求/响应记录，流式响应为chunk列表"""
+        entry = {'key': request_key(kwargs), 'request': kwargs, 'stream': stream, 'response': response}
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            self.file.flush()
+
+    def next_response(self, kwargs, ordered=True):
+        """
+        取出与请求对应的录制响应
+
+        Args:
+            kwargs (dict): 请求参数
+            ordered (bool): 为True时按录制顺序比对，否则按请求摘要查找
+        """
+        key = request_key(kwargs)
+        with self.lock:
+            if ordered:
+                if self.position >= len(self.entries):
+                    raise TranscriptMismatch(f"{self.name}: 录制的 {len(self.entries)} 次调用已用完")
+                entry = self.entries[self.position]
+                if entry['key'] != key:
+                    raise TranscriptMismatch(f"{self.name}: 第 {self.position + 1} 次调用的请求与录制的不一致")
+                self.position += 1
+                return entry
+            candidates = self.by_key.get(key)
+            if not candidates:
+                raise TranscriptMismatch(f"{self.name}: 没有与请求匹配的录制调用")
+            return candidates.pop(0)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class RecordedStream:
+    """包装流式响应，记录调用方实际读取的chunk，在读取结束或关闭时写入转录"""
+
+    def __init__(self, stream, transcript, kwargs):
+        self.stream = stream
+        self.transcript = transcript
+        self.kwargs = kwargs
+        self.chunks = []
+        self.recorded = False
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                self.chunks.append(dump_response(chunk))
+                yield chunk
+        finally:
+            self._record()
+
+    def _record(self):
+        if not self.recorded:
+            self.recorded = True
+            self.transcript.record(self.kwargs, self.chunks, stream=True)
+
+    def close(self):
+        self._record()
+        self.stream.close()
+
+
+class ReplayStream:
+    """回放录制的流式响应"""
+
+    def __init__(self, chunks):
+        from openai.types.chat import ChatCompletionChunk
+        self.chunks = [ChatCompletionChunk.model_validate(chunk) for chunk in chunks]
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+class _Completions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **kwargs):
+        return self.client.create(kwargs)
+
+
+class _Chat:
+    def __init__(self, client):
+        self.completions = _Completions(client)
+
+
+class RecordingClient:
+    """包装OpenAI客户端，将 chat.completions.create 的请求和响应写入当前对话（或全局）的转录"""
+
+    def __init__(self, client):
+        self.inner = client
+        self.chat = _Chat(self)
+
+    def create(self, kwargs):
+        transcript = current_transcript.get() or global_transcript('record')
+        response = self.inner.chat.completions.create(**kwargs)
+        if kwargs.get('stream'):
+            return RecordedStream(response, transcript, kwargs)
+        transcript.record(kwargs, dump_response(response))
+        return response
+
+
+class ReplayClient:
+    """不连接模型，从转录中返回录制的响应"""
+
+    def __init__(self):
+        self.chat = _Chat(self)
+
+    def create(self, kwargs):
+        from openai.types.chat import ChatCompletion
+        transcript = current_transcript.get()
+        if transcript is not None:
+            entry = transcript.next_response(kwargs)
+        else:
+            entry = global_transcript('replay').next_response(kwargs, ordered=False)
+        if entry['stream']:
+            return ReplayStream(entry['response'])
+        return ChatCompletion.model_validate(entry['response'])
+
+
+_global_lock = threading.Lock()
+_global_transcripts = {}
+
+
+def global_transcript(mode):
+    """不属于任何对话的调用使用的全局转录（每个进程一个）"""
+    with _global_lock:
+        if mode not in _global_transcripts:
+            _global_transcripts[mode] = Transcript(GLOBAL_TRANSCRIPT, mode)
+        return _global_transcripts[mode]
+
+
+def wrap_client(make_client):
+    """
+    按 SystemConfig.TRANSCRIPT_MODE 创建客户端
+
+    Args:
+        make_client (callable): 创建真实OpenAI客户端的函数，回放模式下不会被调用
+    """
+    mode = SystemConfig.TRANSCRIPT_MODE
+    if mode == 'replay':
+        return ReplayClient()
+    client = make_client()
+    if mode == 'record':
+        return RecordingClient(client)
+    return client
+
+
+def conversation_seed(name):
+    """对话的随机种子：设置了 SystemConfig.RUN_SEED 时由其和对话名确定，否则随机生成"""
+    if SystemConfig.RUN_SEED is not None:
+        digest = hashlib.sha256('{}:{}'.format(SystemConfig.RUN_SEED, name).encode('utf-8')).hexdigest()
+        return int(digest[:16], 16)
+    return random.SystemRandom().getrandbits(63)
+
+
+def prepare_seed(name):
+    """
+    在进入对话之前确定其随机种子（如预取开场提问时需要提前创建医生），之后传给 conversation(name, seed)
+
+    Returns:
+        int: 回放时为录制的种子，否则同 conversation_seed
+    """
+    if SystemConfig.TRANSCRIPT_MODE == 'replay':
+        path = os.path.join(transcript_dir(), name + '.jsonl')
+        if not os.path.exists(path):
+            raise TranscriptMismatch(f"转录文件不存在: {path}")
+        with open(path) as f:
+            return json.loads(f.readline())['seed']
+    return conversation_seed(name)
+
+
+@contextmanager
+def conversation(name, seed=None):
+    """
+    在一个对话的范围内启用录制或回放，并提供该对话的随机数生成器
+
+    Args:
+        name (str): 对话名，如 'patient_1/conversation_0'，同时作为转录文件的相对路径
+        seed (int, optional): 由 prepare_seed 提前确定的种子，None时在此生成（回放时读取录制的种子）
+
+    Yields:
+        random.Random: 由对话种子（回放时为录制的种子）初始化的随机数生成器
+    """
+    mode = SystemConfig.TRANSCRIPT_MODE
+    if seed is None and mode != 'replay':
+        seed = conversation_seed(name)
+    if mode not in ('record', 'replay'):
+        yield random.Random(seed)
+        return
+    transcript = Transcript(name, mode, seed if mode == 'record' else None)
+    token = current_transcript.set(transcript)
+    try:
+        yield random.Random(transcript.seed)
+    finally:
+        current_transcript.reset(token)
+        transcript.close()
@@ -0,0 +1,325 @@
+"""
+基于SQLite的持久化任务队列
+以 (患者编号, 对话编号) 为单位记录生成任务，多个工作进程从同一个队列领取任务：
+1. 领取任务时获得租约，生成过程中定期心跳续约；进程崩溃后租约过期，任务会被其他进程重新领取
+2. 失败的任务记录错误并重试，超过最大尝试次数后标记为失败
+3. 每个对话完成后结果写入队列，某个患者的全部对话完成时由完成最后一个对话的进程写出 patient_N.json
+
+用法：
+    python main.py --queue ./work_queue.db --processes 8
+    python work_queue.py status --queue ./work_queue.db
+    python work_queue.py retry-failed --queue ./work_queue.db
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+
+from config import PathConfig, SystemConfig
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    patient INTEGER NOT NULL,
+    conversation_idx INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    cost REAL,
+    result TEXT,
+    error TEXT,
+    priority REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (patient, conversation_idx)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+"""
+
+
+class WorkQueue:
+    """
+    SQLite任务队列，每个线程使用独立的连接，可以被同一台机器上的任意多个进程同时使用
+    任务状态：pending（等待）、running（已被领取）、done（完成）、failed（超过最大尝试次数）
+    """
+
+    def __init__(self, path=None, lease_seconds=None, max_attempts=None):
+        self.path = path or PathConfig.QUEUE_PATH
+        self.lease_seconds = lease_seconds or SystemConfig.QUEUE_LEASE_SECONDS
+        self.max_attempts = max_attempts or SystemConfig.QUEUE_MAX_ATTEMPTS
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        # 之前版本创建的队列没有 priority 列
+        if 'priority' not in [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]:
+            conn.execute('ALTER TABLE jobs ADD COLUMN priority REAL NOT NULL DEFAULT 0')
+
+    def _conn(self):
+        if getattr(self.local, 'conn', None) is None:
+            self.local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return self.local.conn
+
+    def _transaction(self, func):
+        """在写事务中执行 func(conn)，BEGIN IMMEDIATE 保证多个进程之间领取任务互斥"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def enqueue(self, patient_ids, num_conversations, priorities=None):
+        """
+        加入任务，已存在的任务保持原状态（重复启动时不会重新生成已完成的对话）
+
+        Args:
+            patient_ids (list): 患者编号
+            num_conversations (int): 每个患者的对话数
+            priorities (dict, optional): {患者编号: 优先级}，优先级高的任务先被领取（见 scheduling.py），
+                                         同时更新已存在的等待中任务的优先级
+
+        Returns:
+            int: 新加入的任务数
+        """
+        now = time.time()
+        priorities = priorities or {}
+        rows = [(patient_id, idx, now, priorities.get(patient_id, 0))
+                for patient_id in patient_ids for idx in range(num_conversations)]
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO jobs (patient, conversation_idx, created, priority) VALUES (?, ?, ?, ?)', rows)
+            added = conn.total_changes - before
+            conn.executemany("UPDATE jobs SET priority = ? WHERE patient = ? AND status = 'pending'",
+                             [(priority, patient_id) for patient_id, priority in priorities.items()])
+            return added
+        return self._transaction(insert)
+
+    def claim(self, worker):
+        """
+        领取一个等待中或租约已过期的任务
+
+        Args:
+            worker (str): 工作进程标识
+
+        Returns:
+            tuple or None: (患者编号, 对话编号)，没有可领取的任务时返回None
+        """
+        def claim_one(conn):
+            now = time.time()
+            # 租约多次过期（进程反复崩溃）的任务不再重试
+            conn.execute("UPDATE jobs SET status = 'failed', error = COALESCE(error, '租约过期') "
+                         "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+            row = conn.execute(
+                "SELECT patient, conversation_idx FROM jobs "
+                "WHERE status = 'pending' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY attempts, priority DESC, patient, conversation_idx LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, started = ?, attempts = attempts + 1 "
+                "WHERE patient = ? AND conversation_idx = ?", (worker, now + self.lease_seconds, now, row[0], row[1]))
+            return row[0], row[1]
+        return self._transaction(claim_one)
+
+    def heartbeat(self, patient_id, conversation_idx, worker):
+        """
+        续约
+
+        Returns:
+            bool: 租约仍属于该进程时返回True
+        """
+        cursor = self._conn().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE patient = ? AND conversation_idx = ? AND worker = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, patient_id, conversation_idx, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, patient_id, conversation_idx, worker, cost, result):
+        """
+        记录任务完成
+
+        Args:
+            result (dict): 对话结果，以JSON保存
+
+        Returns:
+            bool: 该患者的全部对话都已完成时返回True（只有一个进程会得到True）
+        """
+        def finish(conn):
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, cost = ?, result = ?, error = NULL, lease_expires = NULL "
+                "WHERE patient = ? AND conversation_idx = ? AND worker = ? AND status = 'running'",
+                (time.time(), cost, json.dumps(result, ensure_ascii=False), patient_id, conversation_idx, worker))
+            if cursor.rowcount != 1:
+                # 租约已过期且任务被其他进程领取或完成，丢弃本次结果
+                return False
+            remaining = conn.execute("SELECT COUNT(*) FROM jobs WHERE patient = ? AND status != 'done'",
+                                     (patient_id,)).fetchone()[0]
+            return remaining == 0
+        return self._transaction(finish)
+
+    def fail(self, patient_id, conversation_idx, worker, error):
+        """记录任务失败，未超过最大尝试次数时重新等待领取"""
+        self._conn().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_expires = NULL WHERE patient = ? AND conversation_idx = ? AND worker = ? AND status = 'running'",
+            (self.max_attempts, str(error), patient_id, conversation_idx, worker))
+
+    def retry_failed(self):
+        """将失败的任务重置为等待状态并清零尝试次数"""
+        return self._conn().execute("UPDATE jobs SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+
+    def patient_results(self, patient_id):
+        """按对话编号返回某个患者已完成对话的结果"""
+        rows = self._conn().execute(
+            "SELECT result FROM jobs WHERE patient = ? AND status = 'done' ORDER BY conversation_idx", (patient_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def outstanding(self):
+        """尚未结束（等待中或运行中）的任务数"""
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    def spent(self):
+        """已完成任务的总花费"""
+        return self._conn().execute("SELECT COALESCE(SUM(cost), 0) FROM jobs WHERE status = 'done'").fetchone()[0]
+
+    def job_totals(self, patients=None):
+        """
+        各状态的任务数和已完成任务的总花费
+
+        Args:
+            patients (set, optional): 只统计这些患者（编号为字符串）的对话，None时统计队列中的全部对话
+
+        Returns:
+            dict: {'pending': 数量, 'running': 数量, 'done': 数量, 'failed': 数量, 'spent': 已完成任务的花费}
+        """
+        rows = self._conn().execute(
+            "SELECT patient, status, COUNT(*), COALESCE(SUM(cost), 0) FROM jobs GROUP BY patient, status").fetchall()
+        totals = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0, 'spent': 0}
+        for patient, status, count, cost in rows:
+            if patients is None or str(patient) in patients:
+                totals[status] += count
+                if status == 'done':
+                    totals['spent'] += cost
+        return totals
+
+    def patient_costs(self):
+        """全部对话都已完成的患者及其花费"""
+        rows = self._conn().execute(
+            "SELECT patient, SUM(cost) FROM jobs GROUP BY patient HAVING SUM(status != 'done') = 0").fetchall()
+        return {patient: cost for patient, cost in rows}
+
+    def truncated_counts(self, patients=None):
+        """
+        已完成对话中因超出预算被截断的数量，按预算类型统计
+
+        Args:
+            patients (set, optional): 只统计这些患者（编号为字符串）的对话，None时统计队列中的全部对话
+        """
+        rows = self._conn().execute(
+            "SELECT patient, json_extract(result, '$.output.truncated') AS reason, COUNT(*) FROM jobs "
+            "WHERE status = 'done' AND reason IS NOT NULL GROUP BY patient, reason").fetchall()
+        counts = {}
+        for patient, reason, count in rows:
+            if patients is None or str(patient) in patients:
+                counts[reason] = counts.get(reason, 0) + count
+        return counts
+
+    def turn_counts(self):
+        """已完成且未被截断的对话的轮数：(患者编号, 对话编号, 轮数)，作为调度的历史数据"""
+        return self._conn().execute(
+            "SELECT patient, conversation_idx, json_array_length(result, '$.output.conversation') FROM jobs "
+            "WHERE status = 'done' AND json_extract(result, '$.output.truncated') IS NULL").fetchall()
+
+    def running(self):
+        """正在运行的任务：(患者编号, 对话编号, 工作进程, 开始时间)"""
+        return self._conn().execute(
+            "SELECT patient, conversation_idx, worker, started FROM jobs WHERE status = 'running' "
+            "ORDER BY patient, conversation_idx").fetchall()
+
+    def failed_patients(self):
+        rows = self._conn().execute("SELECT DISTINCT patient FROM jobs WHERE status = 'failed' ORDER BY patient").fetchall()
+        return [row[0] for row in rows]
+
+    def status(self, window=600):
+        """
+        队列状态
+
+        Args:
+            window (int): 计算近期吞吐量的时间窗口（秒）
+
+        Returns:
+            dict: 各状态的任务数、租约过期的任务数、重试次数、近期与整体吞吐量（对话/分钟）和总花费
+        """
+        conn = self._conn()
+        now = time.time()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        stale = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running' AND lease_expires < ?", (now,)).fetchone()[0]
+        retries = conn.execute("SELECT COALESCE(SUM(MAX(attempts - 1, 0)), 0) FROM jobs").fetchone()[0]
+        recent = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'done' AND finished >= ?", (now - window,)).fetchone()[0]
+        first_start, last_finish = conn.execute(
+            "SELECT MIN(started), MAX(finished) FROM jobs WHERE status = 'done'").fetchone()
+        workers = conn.execute("SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'running' AND lease_expires >= ?",
+                               (now,)).fetchone()[0]
+        done = counts.get('done', 0)
+        elapsed = (last_finish - first_start) if done else 0
+        return {
+            'pending': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'done': done,
+            'failed': counts.get('failed', 0),
+            'depth': counts.get('pending', 0) + counts.get('running', 0),
+            'stale_leases': stale,
+            'active_workers': workers,
+            'retries': retries,
+            'recent_per_minute': recent * 60 / window,
+            'overall_per_minute': done * 60 / elapsed if elapsed > 0 else None,
+            'spent': self.spent(),
+        }
+
+
+class LeaseKeeper:
+    """在后台线程中定期为正在生成的任务续约，用法：with LeaseKeeper(queue, patient_id, idx, worker): ..."""
+
+    def __init__(self, queue, patient_id, conversation_idx, worker):
+        self.queue = queue
+        self.job = (patient_id, conversation_idx, worker)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(*self.job):
+                print(f"任务 {self.job[0]}/{self.job[1]} 的租约已丢失")
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看和管理对话生成任务队列')
+    parser.add_argument('command', choices=['status', 'retry-failed'])
+    parser.add_argument('--queue', default=PathConfig.QUEUE_PATH, help='队列数据库路径')
+    parser.add_argument('--window', type=int, default=600, help='计算近期吞吐量的时间窗口（秒）')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    if args.command == 'status':
+        print(json.dumps(queue.status(args.window), indent=2, ensure_ascii=False))
+    else:
+        print(f"已重置 {queue.retry_failed()} 个失败的任务")
+
+
+if __name__ == "__main__":
+    main()